@@ -0,0 +1,185 @@
+"""
+Журнал ошибок в формате JSON Lines с записью в фоновом потоке.
+
+Вызывающий поток только кладёт запись в ограниченную очередь, а форматирование
+трассировки и запись в файл выполняет QueueListener. Файл ротируется по размеру
+и по времени, одинаковые ошибки, повторяющиеся в течение окна, схлопываются
+в одну запись со счётчиком повторов.
+"""
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import traceback
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from config import Config
+from metrics import LOG_RECORDS_DROPPED
+
+# Логгер ошибок приложения; не передаёт записи корневому логгеру,
+# чтобы вызывающий поток не писал в консоль
+ERROR_LOGGER = 'bot.errors'
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога в одну строку JSON: время, уровень, место, контекст и трассировка"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'where': f'{record.module}:{record.lineno}',
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        context = getattr(record, 'context', None)
+        if context:
+            entry['context'] = context
+        repeated = getattr(record, 'repeated', 0)
+        if repeated:
+            entry['repeated'] = repeated
+        if record.exc_info:
+            exc_type, exc, tb = record.exc_info
+            entry['exception'] = {
+                'type': exc_type.__name__,
+                'message': str(exc),
+                'traceback': ''.join(traceback.format_exception(exc_type, exc, tb)),
+            }
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DedupFilter(logging.Filter):
+    """
+    Схлопывает одинаковые записи (место вызова, тип и текст исключения) в пределах window секунд.
+    Первая запись проходит сразу, повторы отбрасываются; первая запись после окна
+    получает атрибут repeated — сколько повторов было отброшено.
+    """
+
+    def __init__(self, window: float, max_keys: int = 10000):
+        super().__init__()
+        self.window = window
+        self.max_keys = max_keys
+        # ключ записи -> [начало окна, отброшено повторов]
+        self._seen: Dict[Hashable, list] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(record: logging.LogRecord) -> Tuple:
+        exc = record.exc_info[1] if record.exc_info else None
+        return (
+            record.name, record.levelno, record.pathname, record.lineno,
+            type(exc).__name__ if exc else None, str(exc) if exc else record.msg,
+        )
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.window <= 0:
+            return True
+        key = self._key(record)
+        now = time.monotonic()
+        with self._lock:
+            seen = self._seen.get(key)
+            if seen is not None and now - seen[0] < self.window:
+                seen[1] += 1
+                LOG_RECORDS_DROPPED.inc(reason='duplicate')
+                return False
+            if seen is not None and seen[1]:
+                record.repeated = seen[1]
+            if len(self._seen) >= self.max_keys:
+                self._seen = {k: v for k, v in self._seen.items() if now - v[0] < self.window}
+            self._seen[key] = [now, 0]
+        return True
+
+
+class BufferedQueueHandler(QueueHandler):
+    """
+    QueueHandler, который не форматирует запись в вызывающем потоке:
+    трассировка собирается уже в потоке записи. При переполнении очереди запись отбрасывается.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        # Аргументы сообщения подставляем сразу: к моменту записи они могут измениться
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc(reason='queue_full')
+
+
+class SizedTimedRotatingFileHandler(RotatingFileHandler):
+    """Ротация по размеру (max_bytes) и по времени (каждые interval секунд) с нумерованными архивами"""
+
+    def __init__(self, filename: str, max_bytes: int, backup_count: int, interval: float):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        self.interval = interval
+        self.rollover_at = time.time() + interval
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.interval > 0 and time.time() >= self.rollover_at and os.path.exists(self.baseFilename):
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self) -> None:
+        super().doRollover()
+        self.rollover_at = time.time() + self.interval
+
+
+_listener: Optional[QueueListener] = None
+_setup_lock = threading.Lock()
+
+
+def setup_error_log() -> logging.Logger:
+    """Настраивает логгер ошибок и запускает поток записи (один раз на процесс)"""
+    global _listener
+    logger = logging.getLogger(ERROR_LOGGER)
+    with _setup_lock:
+        if _listener is not None:
+            return logger
+
+        os.makedirs(Config.LOG_DIR, exist_ok=True)
+        file_handler = SizedTimedRotatingFileHandler(
+            os.path.join(Config.LOG_DIR, Config.LOG_FILE),
+            max_bytes=Config.LOG_MAX_BYTES,
+            backup_count=Config.LOG_BACKUP_COUNT,
+            interval=Config.LOG_ROTATE_INTERVAL,
+        )
+        file_handler.setFormatter(JsonFormatter())
+
+        records: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=Config.LOG_QUEUE_SIZE)
+        queue_handler = BufferedQueueHandler(records)
+        queue_handler.addFilter(DedupFilter(Config.LOG_DEDUP_WINDOW))
+
+        logger.addHandler(queue_handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+        _listener = QueueListener(records, file_handler)
+        _listener.start()
+        # При завершении процесса дописываем очередь в файл
+        atexit.register(_listener.stop)
+    return logger
+
+
+def log_exception(e: BaseException, **context: Any) -> None:
+    """
+    Записывает исключение в журнал ошибок.
+    Дополнительные именованные аргументы (chat_id, city...) попадают в поле context.
+    """
+    logger = logging.getLogger(ERROR_LOGGER) if _listener is not None else setup_error_log()
+    logger.error(
+        str(e) or type(e).__name__,
+        exc_info=(type(e), e, e.__traceback__),
+        extra={'context': context},
+        stacklevel=2,
+    )
@@ -0,0 +1,174 @@
+"""
+Асинхронный запуск бота: AsyncTeleBot и асинхронные запросы к OpenWeatherMap и OSRM.
+
+Обработчики не блокируют потоки на сетевых запросах, поэтому один процесс
+выдерживает тысячи одновременных /weather. Утренняя рассылка по-прежнему
+выполняется планировщиком из bot.py.
+"""
+import asyncio
+
+from telebot import asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+
+import messages
+from bot import start_scheduler
+from config import Config
+from metrics import start_metrics_server, track_handler
+from database import is_active_chat, log_exception, run_migrations, save_chat, get_city_name, set_reports_enabled, update_city
+from services.http import close_async_session
+from services.quota import command_throttle
+from services.weather import async_resolve_city, async_get_weather
+from services.traffic import async_get_traffic_level
+
+if Config.TELEGRAM_API_URL:
+    asyncio_helper.API_URL = Config.TELEGRAM_API_URL
+
+bot = AsyncTeleBot(Config.TELEGRAM_BOT_TOKEN)
+
+
+@bot.message_handler(commands=['start'])
+@track_handler('start')
+async def send_welcome(message):
+    """Обработка команды /start - активация бота"""
+    chat_id = message.chat.id
+    chat_type = message.chat.type
+
+    try:
+        if not await asyncio.to_thread(is_active_chat, chat_id):
+            success = await asyncio.to_thread(save_chat, chat_id, chat_type)
+            if success:
+                await bot.send_message(chat_id, messages.WELCOME)
+            else:
+                await bot.send_message(chat_id, messages.SAVE_FAILED)
+        else:
+            await bot.send_message(chat_id, messages.ALREADY_ACTIVE)
+
+    except Exception as e:
+        log_exception(e, chat_id=chat_id)
+        await bot.send_message(chat_id, messages.START_FAILED)
+
+
+@bot.message_handler(commands=['set_city'])
+@track_handler('set_city')
+async def set_city(message):
+    """Обработка команды /set_city - изменение города"""
+    chat_id = message.chat.id
+
+    try:
+        parts = message.text.split(maxsplit=1)
+        if len(parts) < 2:
+            await bot.send_message(chat_id, messages.SET_CITY_USAGE)
+            return
+
+        city_name = parts[1].strip()
+        if not city_name:
+            await bot.send_message(chat_id, messages.EMPTY_CITY)
+            return
+
+        if not command_throttle.allow(chat_id):
+            await bot.send_message(chat_id, messages.TOO_MANY_REQUESTS)
+            return
+
+        await bot.send_message(chat_id, messages.searching_city(city_name))
+
+        place = await async_resolve_city(city_name)
+        if place is None:
+            await bot.send_message(chat_id, messages.city_not_found(city_name))
+            return
+
+        success = await asyncio.to_thread(
+            update_city, chat_id, city_name, place['city_id'], place['lat'], place['lon']
+        )
+        if success:
+            await bot.send_message(chat_id, messages.city_saved(city_name))
+        else:
+            await bot.send_message(chat_id, messages.NOT_STARTED)
+
+    except Exception as e:
+        log_exception(e, chat_id=chat_id, text=message.text)
+        await bot.send_message(chat_id, messages.SET_CITY_FAILED)
+
+
+@bot.message_handler(commands=['stop'])
+@track_handler('stop')
+async def stop_bot(message):
+    """Обработка команды /stop - остановка ежедневной рассылки"""
+    chat_id = message.chat.id
+
+    if not await asyncio.to_thread(is_active_chat, chat_id):
+        await bot.send_message(chat_id, messages.NOT_ACTIVATED)
+        return
+
+    success = await asyncio.to_thread(set_reports_enabled, chat_id, False)
+    if success:
+        await bot.send_message(chat_id, messages.REPORTS_STOPPED)
+    else:
+        await bot.send_message(chat_id, messages.STOP_FAILED)
+
+
+@bot.message_handler(commands=['resume'])
+@track_handler('resume')
+async def resume_reports(message):
+    """Обработка команды /resume - возобновление ежедневной рассылки"""
+    chat_id = message.chat.id
+
+    if not await asyncio.to_thread(is_active_chat, chat_id):
+        await bot.send_message(chat_id, messages.NOT_ACTIVATED)
+        return
+
+    success = await asyncio.to_thread(set_reports_enabled, chat_id, True)
+    if success:
+        await bot.send_message(chat_id, messages.REPORTS_RESUMED)
+    else:
+        await bot.send_message(chat_id, messages.RESUME_FAILED)
+
+
+@bot.message_handler(commands=['weather'])
+@track_handler('weather')
+async def handle_weather(message):
+    chat_id = message.chat.id
+    if not command_throttle.allow(chat_id):
+        await bot.send_message(chat_id, messages.TOO_MANY_REQUESTS)
+        return
+    city = await asyncio.to_thread(get_city_name, chat_id)
+    if not city:
+        await bot.send_message(chat_id, messages.NOT_STARTED)
+    else:
+        weather = await async_get_weather(city)
+        if weather['status'] == 200:
+            await bot.send_message(chat_id, messages.weather_text(weather))
+        else:
+            await bot.send_message(chat_id, messages.WEATHER_FAILED)
+
+
+@bot.message_handler(commands=['traffic'])
+@track_handler('traffic')
+async def handle_traffic(message):
+    chat_id = message.chat.id
+    if not command_throttle.allow(chat_id):
+        await bot.send_message(chat_id, messages.TOO_MANY_REQUESTS)
+        return
+    city = await asyncio.to_thread(get_city_name, chat_id)
+    if not city:
+        await bot.send_message(chat_id, messages.NOT_STARTED)
+    else:
+        traffic = await async_get_traffic_level(city)
+        if traffic['status'] == 200:
+            await bot.send_message(chat_id, messages.traffic_text(city, traffic))
+        else:
+            await bot.send_message(chat_id, messages.TRAFFIC_FAILED)
+
+
+async def main():
+    try:
+        await bot.infinity_polling()
+    finally:
+        await close_async_session()
+        await bot.close_session()
+
+
+if __name__ == '__main__':
+    run_migrations()
+    start_metrics_server(Config.METRICS_HOST, Config.METRICS_PORT)
+    start_scheduler()
+    asyncio.run(main())
@@ -0,0 +1,300 @@
+"""
+Локальные заглушки Telegram Bot API, OpenWeatherMap и OSRM для бенчмарков.
+
+У каждой заглушки настраиваются задержка ответа, доля ответов с ошибкой 5xx
+и доля ответов 429 с заданным retry_after. Заглушки считают запросы по эндпоинтам.
+
+Запуск всех трёх заглушек для ручной проверки бота:
+    python benchmarks/fakes.py [--latency 0.05] [--error-rate 0.01] [--rate-limit-rate 0.001]
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+# Ответ заглушки: (HTTP-статус, JSON-тело)
+Reply = Tuple[int, Any]
+
+
+class FakeServer(ThreadingHTTPServer):
+    """
+    HTTP-сервер заглушки внешнего сервиса.
+
+    - latency: задержка каждого ответа, сек (с разбросом ±jitter)
+    - error_rate: доля ответов 500
+    - rate_limit_rate: доля ответов 429 с retry_after секунд
+    Подклассы реализуют route(path, params) и error_body(status).
+    """
+
+    daemon_threads = True
+    name = 'fake'
+
+    def __init__(
+        self,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        retry_after: int = 1,
+    ):
+        super().__init__((host, port), FakeHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.calls: Counter = Counter()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, endpoint: str) -> None:
+        with self._lock:
+            self.calls[endpoint] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.calls)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.calls.clear()
+
+    def respond(self, path: str, params: Dict[str, str]) -> Reply:
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        roll = random.random()
+        if roll < self.rate_limit_rate:
+            self.count('rate_limited')
+            return 429, self.error_body(429)
+        if roll < self.rate_limit_rate + self.error_rate:
+            self.count('errors')
+            return 500, self.error_body(500)
+        return self.route(path, params)
+
+    def route(self, path: str, params: Dict[str, str]) -> Reply:
+        raise NotImplementedError
+
+    def error_body(self, status: int) -> Any:
+        return {'message': 'error'}
+
+    def start(self) -> 'FakeServer':
+        self._thread = threading.Thread(target=self.serve_forever, name=f'{self.name}-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    # keep-alive, как у настоящих сервисов: клиенты переиспользуют соединения из пула
+    protocol_version = 'HTTP/1.1'
+    # Заголовки и тело уходят разными записями: без TCP_NODELAY keep-alive ловит задержку 40 мс (Nagle + delayed ACK)
+    disable_nagle_algorithm = True
+
+    def _handle(self) -> None:
+        parsed = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            body = self.rfile.read(length).decode('utf-8')
+            if self.headers.get('Content-Type', '').startswith('application/json'):
+                params.update({key: str(value) for key, value in json.loads(body).items()})
+            else:
+                params.update({key: values[-1] for key, values in parse_qs(body).items()})
+
+        status, data = self.server.respond(parsed.path, params)
+        payload = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        if status == 429:
+            self.send_header('Retry-After', str(self.server.retry_after))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = _handle
+    do_POST = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeTelegram(FakeServer):
+    """Заглушка Bot API: sendMessage и getMe, адрес в формате telebot — {url}/bot{0}/{1}"""
+
+    name = 'telegram'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._message_id = 0
+
+    @property
+    def api_url(self) -> str:
+        return self.url + '/bot{0}/{1}'
+
+    def route(self, path: str, params: Dict[str, str]) -> Reply:
+        method = path.rsplit('/', 1)[-1]
+        self.count(method)
+        if method == 'getMe':
+            return 200, {'ok': True, 'result': {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}}
+        if method != 'sendMessage':
+            return 200, {'ok': True, 'result': True}
+
+        with self._lock:
+            self._message_id += 1
+            message_id = self._message_id
+        chat_id = int(params.get('chat_id', 0))
+        return 200, {'ok': True, 'result': {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'group', 'title': 'bench'},
+            'text': params.get('text', ''),
+        }}
+
+    def error_body(self, status: int) -> Any:
+        if status == 429:
+            return {
+                'ok': False,
+                'error_code': 429,
+                'description': f'Too Many Requests: retry after {self.retry_after}',
+                'parameters': {'retry_after': self.retry_after},
+            }
+        return {'ok': False, 'error_code': status, 'description': 'Internal Server Error'}
+
+
+def fake_weather(city_id: int, name: str) -> Dict[str, Any]:
+    """Ответ OpenWeatherMap о погоде в городе; температура зависит от id, чтобы отчёты различались"""
+    temp = round(-10 + (city_id * 7919) % 400 / 10, 1)
+    return {
+        'id': city_id,
+        'name': name,
+        'main': {'temp': temp, 'feels_like': round(temp - 2, 1), 'humidity': 60, 'pressure': 1013},
+        'weather': [{'description': 'облачно с прояснениями'}],
+        'wind': {'speed': 3.0},
+    }
+
+
+def _city_id(name: str) -> int:
+    return sum(ord(char) for char in name) % 100000 + 1
+
+
+class FakeOpenWeatherMap(FakeServer):
+    """Заглушка OpenWeatherMap: /data/2.5/weather, /data/2.5/group и /geo/1.0/direct"""
+
+    name = 'openweathermap'
+
+    def route(self, path: str, params: Dict[str, str]) -> Reply:
+        if path.endswith('/data/2.5/weather'):
+            self.count('weather')
+            if 'q' in params:
+                return 200, fake_weather(_city_id(params['q']), params['q'])
+            lat, lon = float(params.get('lat', 0)), float(params.get('lon', 0))
+            return 200, fake_weather(int(abs(lat * 1000 + lon)) % 100000 + 1, f'{lat:.2f},{lon:.2f}')
+        if path.endswith('/data/2.5/group'):
+            self.count('group')
+            ids = [int(city_id) for city_id in params.get('id', '').split(',') if city_id]
+            items = [fake_weather(city_id, f'city-{city_id}') for city_id in ids]
+            return 200, {'cnt': len(items), 'list': items}
+        if path.endswith('/geo/1.0/direct'):
+            self.count('geo')
+            name = params.get('q', '')
+            return 200, [{'name': name, 'local_names': {'ru': name}, 'lat': 55.75, 'lon': 37.62}]
+        self.count('not_found')
+        return 404, {'cod': '404', 'message': 'not found'}
+
+    def error_body(self, status: int) -> Any:
+        return {'cod': status, 'message': 'rate limited' if status == 429 else 'internal error'}
+
+
+_TABLE_PATH = re.compile(r'/table/v1/driving/(?P<coordinates>[^/]+)$')
+
+
+class FakeOSRM(FakeServer):
+    """
+    Заглушка OSRM: /table/v1/driving/{координаты}.
+    Расстояния считаются по прямой, время — как при скорости 60 км/ч с коэффициентом задержки.
+    """
+
+    name = 'osrm'
+
+    def __init__(self, *args, delay_ratio: float = 1.6, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.delay_ratio = delay_ratio
+
+    def route(self, path: str, params: Dict[str, str]) -> Reply:
+        match = _TABLE_PATH.search(path)
+        if not match:
+            self.count('not_found')
+            return 404, {'code': 'InvalidUrl'}
+        self.count('table')
+        points = [tuple(map(float, pair.split(','))) for pair in match.group('coordinates').split(';')]
+        distances = [
+            [((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2) ** 0.5 * 111000 for b in points]
+            for a in points
+        ]
+        durations = [[distance / 1000 / 60 * 3600 * self.delay_ratio for distance in row] for row in distances]
+        return 200, {'code': 'Ok', 'durations': durations, 'distances': distances}
+
+    def error_body(self, status: int) -> Any:
+        return {'code': 'TooBig' if status == 429 else 'InternalError'}
+
+
+def start_fakes(
+    latency: float = 0.0,
+    error_rate: float = 0.0,
+    rate_limit_rate: float = 0.0,
+    retry_after: int = 1,
+) -> Dict[str, FakeServer]:
+    """Запускает все три заглушки на свободных портах"""
+    options = dict(latency=latency, jitter=latency / 2, error_rate=error_rate,
+                   rate_limit_rate=rate_limit_rate, retry_after=retry_after)
+    return {
+        'telegram': FakeTelegram(**options).start(),
+        'openweathermap': FakeOpenWeatherMap(**options).start(),
+        'osrm': FakeOSRM(**options).start(),
+    }
+
+
+def fake_env(fakes: Dict[str, FakeServer]) -> Dict[str, str]:
+    """Переменные окружения, направляющие бота на заглушки"""
+    return {
+        'TELEGRAM_API_URL': fakes['telegram'].api_url,
+        'OPENWEATHER_BASE_URL': fakes['openweathermap'].url,
+        'OSRM_BASE_URL': fakes['osrm'].url,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Заглушки Telegram, OpenWeatherMap и OSRM')
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=int, default=1)
+    args = parser.parse_args()
+
+    servers = start_fakes(args.latency, args.error_rate, args.rate_limit_rate, args.retry_after)
+    for key, value in fake_env(servers).items():
+        print(f"{key}={value}")
+    try:
+        while True:
+            time.sleep(10)
+            print({name: server.stats() for name, server in servers.items()})
+    except KeyboardInterrupt:
+        for server in servers.values():
+            server.stop()
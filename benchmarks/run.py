@@ -0,0 +1,281 @@
+"""
+Сквозной бенчмарк утренней рассылки и обработчиков команд.
+
+Запускает заглушки Telegram, OpenWeatherMap и OSRM (benchmarks/fakes.py) и для каждого
+сценария в отдельном процессе с чистой базой SQLite:
+- создаёт N чатов в M городах и замеряет полную рассылку (run_daily_report);
+- вызывает обработчики /weather и /traffic и замеряет их задержку.
+
+Для каждого сценария сохраняются время рассылки, сообщений в секунду,
+число запросов к каждой заглушке и p50/p99 задержки обработчиков.
+Результат пишется в JSON (по умолчанию benchmarks/results/<commit>-<время>.json).
+
+    python benchmarks/run.py                          # сценарии 1k, 10k, 100k
+    python benchmarks/run.py --scenarios 1k,10k --cities 100 --latency 0.05 --rate-limit-rate 0.001
+    python benchmarks/run.py --compare old.json new.json
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import argparse
+import json
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, List
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+SCENARIOS = {'1k': 1000, '10k': 10000, '100k': 100000}
+
+# Метрики, которые сравниваются между прогонами: (ключ, больше — лучше)
+COMPARED = [
+    ('broadcast_wall', False),
+    ('msgs_per_s', True),
+    ('upstream_calls', False),
+    ('handler_p50_ms', False),
+    ('handler_p99_ms', False),
+]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return 'unknown'
+
+
+def city_names(count: int) -> List[str]:
+    """Города из справочника; если их не хватает — вымышленные (без координат, пробки по времени суток)"""
+    names = []
+    with open(os.path.join(ROOT, 'services', 'data', 'cities.tsv'), encoding='utf-8') as f:
+        next(f)
+        for line in f:
+            names.append(line.split('\t')[1])
+    names = names[:count]
+    names += [f'Город {index}' for index in range(len(names), count)]
+    return names
+
+
+def populate(chats: int, cities: int, group_share: float) -> None:
+    """Заполняет базу чатами: city_id задан, поэтому погода запрашивается групповым эндпоинтом"""
+    from sqlalchemy import insert
+
+    from database import Chat, engine
+
+    names = city_names(cities)
+    rows = []
+    for index in range(chats):
+        chat_id = index + 1
+        if random.random() < group_share:
+            chat_id = -chat_id
+        city_index = index % len(names)
+        rows.append({
+            'chat_id': chat_id,
+            'chat_type': 'group' if chat_id < 0 else 'private',
+            'city': names[city_index],
+            'is_active': True,
+            'reports_enabled': True,
+            'city_id': city_index + 1,
+        })
+    with engine.begin() as connection:
+        for start in range(0, len(rows), 10000):
+            connection.execute(insert(Chat), rows[start:start + 10000])
+
+
+def measure_handlers(samples: int) -> List[float]:
+    """Вызывает обработчики /weather и /traffic от личных чатов напрямую и возвращает задержки в мс"""
+    from sqlalchemy import select
+    from telebot import types
+
+    import bot
+    from database import Chat, SessionLocal
+
+    with SessionLocal() as session:
+        chat_ids = list(session.execute(select(Chat.chat_id).where(Chat.chat_id > 0)).scalars())
+
+    handlers = [('/weather', bot.handle_weather), ('/traffic', bot.handle_traffic)]
+    latencies = []
+    for index in range(samples):
+        command, handler = handlers[index % len(handlers)]
+        chat_id = random.choice(chat_ids)
+        message = types.Message.de_json({
+            'message_id': index + 1,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'bench'},
+            'text': command,
+        })
+        started = time.perf_counter()
+        handler(message)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+def run_child(args: argparse.Namespace) -> Dict[str, Any]:
+    """Один сценарий: выполняется в отдельном процессе, окружение уже направлено на заглушки"""
+    from database import run_migrations
+    from services.report import run_daily_report
+
+    run_migrations()
+    populate(args.chats, args.cities, args.group_share)
+
+    import bot
+
+    started = time.perf_counter()
+    stats = run_daily_report(bot.broadcaster.run)
+    bot.deactivation_buffer.flush()
+    wall = time.perf_counter() - started
+
+    latencies = measure_handlers(args.samples)
+    percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        'chats': args.chats,
+        'cities': args.cities,
+        'broadcast_wall': round(wall, 3),
+        'sent': stats['run'].get('done', 0),
+        'failed': stats['run'].get('failed', 0),
+        'pending': stats['run'].get('pending', 0),
+        'msgs_per_s': round(stats['run'].get('done', 0) / wall, 1) if wall > 0 else 0.0,
+        'timings': {stage: round(value, 3) for stage, value in stats['timings'].items()},
+        'handler_samples': len(latencies),
+        'handler_p50_ms': round(percentiles[49], 2),
+        'handler_p99_ms': round(percentiles[98], 2),
+    }
+
+
+def run_scenario(name: str, args: argparse.Namespace, fakes: Dict[str, Any]) -> Dict[str, Any]:
+    from fakes import fake_env
+
+    for server in fakes.values():
+        server.reset()
+
+    with tempfile.TemporaryDirectory(prefix=f'bench-{name}-') as workdir:
+        env = dict(os.environ)
+        env.update(fake_env(fakes))
+        env.update({
+            'DATABASE_URL': f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+            'SQLITE_PERFORMANCE_MODE': '1',
+            'TELEGRAM_BOT_TOKEN': 'bench',
+            'OPENWEATHER_API_KEY': 'bench',
+            'BROADCAST_RATE': str(args.rate),
+            'BROADCAST_WORKERS': str(args.workers),
+            'OWM_CALLS_PER_MINUTE': '1000000',
+            'OWM_CALLS_PER_DAY': '0',
+            'COMMAND_RATE_LIMIT': '1000000',
+            'PYTHONPATH': ROOT,
+        })
+        command = [
+            sys.executable, os.path.abspath(__file__), '--child',
+            '--chats', str(SCENARIOS[name]),
+            '--cities', str(args.cities),
+            '--samples', str(args.samples),
+            '--group-share', str(args.group_share),
+        ]
+        # Рабочая папка — временная: там же окажутся logs/ процесса
+        process = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True)
+        if process.returncode != 0:
+            raise RuntimeError(f"Сценарий {name} завершился с ошибкой:\n{process.stderr}")
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+
+    result['upstream'] = {service: server.stats() for service, server in fakes.items()}
+    result['upstream_calls'] = sum(
+        count for service, calls in result['upstream'].items() if service != 'telegram'
+        for count in calls.values()
+    )
+    return result
+
+
+def compare(old_path: str, new_path: str) -> None:
+    """Печатает изменение метрик между двумя файлами результатов"""
+    with open(old_path, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, encoding='utf-8') as f:
+        new = json.load(f)
+    print(f"{old['commit']} -> {new['commit']}")
+    for name, result in new['scenarios'].items():
+        before = old['scenarios'].get(name)
+        if before is None:
+            continue
+        print(f"\n[{name}]")
+        for metric, higher_is_better in COMPARED:
+            a, b = before.get(metric), result.get(metric)
+            if not a or b is None:
+                continue
+            change = (b - a) / a * 100
+            better = change > 0 if higher_is_better else change < 0
+            mark = '+' if better else ('-' if change else ' ')
+            print(f"  {mark} {metric:<16} {a:>10} -> {b:<10} ({change:+.1f}%)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Бенчмарк рассылки и обработчиков на локальных заглушках')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='через запятую: 1k,10k,100k')
+    parser.add_argument('--cities', type=int, default=50, help='число городов')
+    parser.add_argument('--samples', type=int, default=500, help='вызовов обработчиков для замера задержки')
+    parser.add_argument('--group-share', type=float, default=0.1, help='доля групповых чатов')
+    parser.add_argument('--rate', type=float, default=1000, help='BROADCAST_RATE, сообщений в секунду')
+    parser.add_argument('--workers', type=int, default=32, help='BROADCAST_WORKERS')
+    parser.add_argument('--latency', type=float, default=0.02, help='задержка ответа заглушек, сек')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов 500')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='доля ответов 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='retry_after в ответах 429, сек')
+    parser.add_argument('--output', help='файл результатов')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='сравнить два файла результатов')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--chats', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.child:
+        print(json.dumps(run_child(args)))
+        return
+
+    from fakes import start_fakes
+
+    fakes = start_fakes(args.latency, args.error_rate, args.rate_limit_rate, args.retry_after)
+    results = {
+        'commit': git_commit(),
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'params': {
+            key: value for key, value in vars(args).items()
+            if key not in ('child', 'chats', 'compare', 'output')
+        },
+        'scenarios': {},
+    }
+    try:
+        for name in args.scenarios.split(','):
+            print(f"Сценарий {name}: {SCENARIOS[name]} чатов, {args.cities} городов...", flush=True)
+            result = run_scenario(name, args, fakes)
+            results['scenarios'][name] = result
+            print(
+                f"  рассылка {result['broadcast_wall']:.2f} с, {result['msgs_per_s']} msg/s, "
+                f"отправлено {result['sent']}, ошибок {result['failed']}, "
+                f"запросов к API {result['upstream_calls']}, "
+                f"обработчики p50 {result['handler_p50_ms']} мс / p99 {result['handler_p99_ms']} мс",
+                flush=True,
+            )
+    finally:
+        for server in fakes.values():
+            server.stop()
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{results['commit']}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"Результаты: {output}")
+
+
+if __name__ == '__main__':
+    main()
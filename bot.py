@@ -1,20 +1,89 @@
 import atexit
-from datetime import datetime
+import logging
+from datetime import date, datetime, time as dt_time, timedelta
 
 import pytz
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 import telebot
 
+import messages
 from config import Config
-from database import SessionLocal, Chat, deactivate_chat, is_active_chat, log_exception, save_chat, select, get_city_name, set_reports_enabled, are_reports_enabled
-from services.weather import is_valid_city, get_weather
+from metrics import start_metrics_server, track_handler
+from database import DeactivationBuffer, is_active_chat, migrate_chat, run_migrations, log_exception, save_chat, get_city_name, set_reports_enabled, update_city
+from services.http import telegram_request
+from services.quota import command_throttle
+from services.weather import resolve_city, get_weather
 from services.traffic import get_traffic_level
-
-bot = telebot.TeleBot(Config.TELEGRAM_BOT_TOKEN)
+from services.report import prefetch_report_data, resume_broadcasts, run_daily_report
+from services import samples
+from services.broadcast import PERMANENT, Broadcaster, classify_error
+from services.cluster import LeaderElection, count_sending_nodes
+from services.dispatcher import ChatDispatcher
+from webhook import WebhookServer
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger(__name__)
+
+if Config.TELEGRAM_API_URL:
+    telebot.apihelper.API_URL = Config.TELEGRAM_API_URL
+# Запросы к Bot API идут через общий пул соединений и попадают в метрики
+telebot.apihelper.CUSTOM_REQUEST_SENDER = telegram_request
+
+
+def update_chat_id(update: telebot.types.Update):
+    """Чат, в пределах которого сохраняется порядок обработки; обновления без чата не упорядочиваются"""
+    for message in (update.message, update.edited_message, update.channel_post, update.edited_channel_post):
+        if message is not None:
+            return message.chat.id
+    if update.callback_query is not None and update.callback_query.message is not None:
+        return update.callback_query.message.chat.id
+    for event in (update.my_chat_member, update.chat_member, update.chat_join_request):
+        if event is not None:
+            return event.chat.id
+    return ('update', update.update_id)
+
+
+class DispatchingTeleBot(telebot.TeleBot):
+    """
+    TeleBot, который передаёт обновления ChatDispatcher вместо своего пула потоков:
+    команды одного чата выполняются по порядку, разных чатов — параллельно.
+    При переполнении очереди новые обновления отбрасываются.
+    """
+
+    def __init__(self, token: str, workers: int, queue_size: int):
+        # Обработчики выполняются в потоках диспетчера, собственный пул telebot не нужен
+        super().__init__(token, threaded=False)
+        self.dispatcher = ChatDispatcher(self._process_update, workers, queue_size, name='commands')
+
+    def submit_update(self, update: telebot.types.Update) -> bool:
+        """Передаёт обновление диспетчеру; False, если очередь заполнена и обновление не принято"""
+        if update.update_id > self.last_update_id:
+            self.last_update_id = update.update_id
+        if not self.dispatcher.submit(update_chat_id(update), update):
+            logger.debug("Dispatcher queue is full, update %d dropped", update.update_id)
+            return False
+        return True
+
+    def process_new_updates(self, updates):
+        # offset для getUpdates сдвигается сразу: обновление принято диспетчером или отброшено
+        for update in updates:
+            self.submit_update(update)
+
+    def _process_update(self, update: telebot.types.Update) -> None:
+        super().process_new_updates([update])
+
+
+bot = DispatchingTeleBot(
+    Config.TELEGRAM_BOT_TOKEN,
+    workers=Config.DISPATCH_WORKERS,
+    queue_size=Config.DISPATCH_QUEUE_SIZE,
+)
 
 
 @bot.message_handler(commands=['start'])
+@track_handler('start')
 def send_welcome(message):
     """Обработка команды /start - активация бота"""
     chat_id = message.chat.id
@@ -24,40 +93,19 @@ def send_welcome(message):
         if not is_active_chat(chat_id):
             success = save_chat(chat_id, chat_type)
             if success:
-                welcome_text = (
-                    "👋 Привет! Я информационный бот.\n\n"
-                    "📋 Что я умею:\n"
-                    "• 🌤 Ежедневная утренняя рассылка с погодой и пробками\n"
-                    "• 🌡 Текущая погода по команде /weather\n"
-                    "• 🚗 Текущие пробки по команде /traffic\n"
-                    "• 🏙 Выбор вашего города: /set_city\n"
-                    "• ⏸ Управление рассылкой: /stop и /resume\n\n"
-                    "📍 Город по умолчанию: Москва\n"
-                    "🕐 Рассылка приходит каждое утро в 7:00 (по Мск)\n\n"
-                    "Для изменения города используйте:\n"
-                    "/set_city Название"
-                )
-                bot.send_message(chat_id, welcome_text)
+                bot.send_message(chat_id, messages.WELCOME)
             else:
-                bot.send_message(chat_id, "❌ Не удалось сохранить данные. Попробуйте позже.")
+                bot.send_message(chat_id, messages.SAVE_FAILED)
         else:
-            bot.send_message(
-                chat_id,
-                "✅ Бот уже активен!\n"
-                "Доступные команды:\n"
-                "/set_city — изменить город\n"
-                "/weather — текущая погода\n"
-                "/traffic — текущие пробки\n"
-                "/stop — остановить рассылку\n"
-                "/resume — возобновить рассылку"
-            )
+            bot.send_message(chat_id, messages.ALREADY_ACTIVE)
 
     except Exception as e:
-        log_exception(e)
-        bot.send_message(chat_id, "⚠️ Что-то пошло не так при активации. Админу отправлен отчёт.")
+        log_exception(e, chat_id=chat_id)
+        bot.send_message(chat_id, messages.START_FAILED)
 
 
 @bot.message_handler(commands=['set_city'])
+@track_handler('set_city')
 def set_city(message):
     """Обработка команды /set_city - изменение города"""
     chat_id = message.chat.id
@@ -65,186 +113,239 @@ def set_city(message):
     try:
         parts = message.text.split(maxsplit=1)
         if len(parts) < 2:
-            bot.send_message(
-                chat_id,
-                "📌 Укажите город после команды:\n"
-                "/set_city Москва\n"
-                "/set_city Krasnodar"
-            )
+            bot.send_message(chat_id, messages.SET_CITY_USAGE)
             return
 
         city_name = parts[1].strip()
         if not city_name:
-            bot.send_message(chat_id, "❌ Название города не может быть пустым.")
+            bot.send_message(chat_id, messages.EMPTY_CITY)
+            return
+
+        if not command_throttle.allow(chat_id):
+            bot.send_message(chat_id, messages.TOO_MANY_REQUESTS)
             return
 
-        bot.send_message(chat_id, f"🔍 Ищу город «{city_name}»...")
-
-        if not is_valid_city(city_name):
-            bot.send_message(
-                chat_id,
-                f"❌ Город «{city_name}» не найден.\n"
-                "Попробуйте:\n"
-                "• Проверить орфографию\n"
-                "• Использовать полное название (например: Санкт-Петербург)\n"
-                "• Написать на русском или английском"
-            )
+        bot.send_message(chat_id, messages.searching_city(city_name))
+
+        place = resolve_city(city_name)
+        if place is None:
+            bot.send_message(chat_id, messages.city_not_found(city_name))
             return
 
-        from database import update_city
-        success = update_city(chat_id, city_name)
+        success = update_city(chat_id, city_name, place['city_id'], place['lat'], place['lon'])
         if success:
-            bot.send_message(chat_id, f"✅ Отлично! Теперь я буду присылать данные для: {city_name}")
+            bot.send_message(chat_id, messages.city_saved(city_name))
         else:
-            bot.send_message(chat_id, "❌ Сначала активируйте бота командой /start")
+            bot.send_message(chat_id, messages.NOT_STARTED)
 
     except Exception as e:
-        log_exception(e)
-        bot.send_message(chat_id, "⚠️ Не удалось проверить город. Попробуйте позже.")
+        log_exception(e, chat_id=chat_id, text=message.text)
+        bot.send_message(chat_id, messages.SET_CITY_FAILED)
 
 
 @bot.message_handler(commands=['stop'])
+@track_handler('stop')
 def stop_bot(message):
     """Обработка команды /stop - остановка ежедневной рассылки"""
     chat_id = message.chat.id
 
     if not is_active_chat(chat_id):
-        bot.send_message(
-            chat_id,
-            "❌ Бот не активирован.\n"
-            "Сначала активируйте бота командой /start"
-        )
+        bot.send_message(chat_id, messages.NOT_ACTIVATED)
         return
 
     success = set_reports_enabled(chat_id, False)
     if success:
-        bot.send_message(
-            chat_id,
-            "⏸ Ежедневная рассылка остановлена.\n\n"
-            "Бот остаётся активным, вы можете:\n"
-            "• /weather — узнать текущую погоду\n"
-            "• /set_city — изменить город\n"
-            "• /resume — возобновить рассылку"
-        )
+        bot.send_message(chat_id, messages.REPORTS_STOPPED)
     else:
-        bot.send_message(chat_id, "⚠️ Не удалось остановить рассылку. Попробуйте позже.")
+        bot.send_message(chat_id, messages.STOP_FAILED)
 
 
 @bot.message_handler(commands=['resume'])
+@track_handler('resume')
 def resume_reports(message):
     """Обработка команды /resume - возобновление ежедневной рассылки"""
     chat_id = message.chat.id
 
     if not is_active_chat(chat_id):
-        bot.send_message(
-            chat_id,
-            "❌ Бот не активирован.\n"
-            "Сначала активируйте бота командой /start"
-        )
+        bot.send_message(chat_id, messages.NOT_ACTIVATED)
         return
 
     success = set_reports_enabled(chat_id, True)
     if success:
-        bot.send_message(
-            chat_id,
-            "✅ Ежедневная рассылка возобновлена!\n\n"
-            "🕐 Отчёт будет приходить каждое утро в 7:00 (по Мск)\n"
-            "Для остановки используйте /stop"
-        )
+        bot.send_message(chat_id, messages.REPORTS_RESUMED)
     else:
-        bot.send_message(chat_id, "⚠️ Не удалось возобновить рассылку. Попробуйте позже.")
+        bot.send_message(chat_id, messages.RESUME_FAILED)
 
 
 @bot.message_handler(commands=['weather'])
+@track_handler('weather')
 def handle_weather(message):
     chat_id = message.chat.id
+    if not command_throttle.allow(chat_id):
+        bot.send_message(chat_id, messages.TOO_MANY_REQUESTS)
+        return
     city = get_city_name(chat_id)
     if not city:
-        bot.send_message(chat_id, "❌ Сначала активируйте бота командой /start")
+        bot.send_message(chat_id, messages.NOT_STARTED)
     else:
         weather = get_weather(city)
         if weather['status'] == 200:
-            bot.send_message(
-                chat_id,
-                f'🌡 В городе {weather["city"]}: {weather["temp"]}°C\n'
-                f'🤔 Ощущается как {weather["feels_like"]}°C\n'
-                f'☁️ {weather["description"]}'
-            )
+            bot.send_message(chat_id, messages.weather_text(weather))
         else:
-            bot.send_message(chat_id, "❌ Не удалось получить данные о погоде. Попробуйте позже.")
+            bot.send_message(chat_id, messages.WEATHER_FAILED)
 
 
 @bot.message_handler(commands=['traffic'])
+@track_handler('traffic')
 def handle_traffic(message):
     chat_id = message.chat.id
+    if not command_throttle.allow(chat_id):
+        bot.send_message(chat_id, messages.TOO_MANY_REQUESTS)
+        return
     city = get_city_name(chat_id)
     if not city:
-        bot.send_message(chat_id, "❌ Сначала активируйте бота командой /start")
+        bot.send_message(chat_id, messages.NOT_STARTED)
     else:
         traffic = get_traffic_level(city)
         if traffic['status'] == 200:
-            bot.send_message(
-                chat_id,
-                f'🚗 Пробки в городе {city.capitalize()}\n'
-                f'📊 Уровень: {traffic["level"]}/10\n'
-                f'📝 {traffic["description"]}'
-            )
+            bot.send_message(chat_id, messages.traffic_text(city, traffic))
         else:
-            bot.send_message(chat_id, "❌ Не удалось получить данные о пробках. Попробуйте позже.")
+            bot.send_message(chat_id, messages.TRAFFIC_FAILED)
+
+deactivation_buffer = DeactivationBuffer()
+
+
+def handle_delivery_failure(chat_id, e):
+    """Обрабатывает ошибку отправки отчёта"""
+    # Если бота кикнули или чат удалён — деактивируем чат
+    if classify_error(e) == PERMANENT:
+        deactivation_buffer.add(chat_id)
+
+
+def handle_chat_migration(chat_id, new_chat_id):
+    """Группа стала супергруппой: переносим чат на новый id"""
+    logger.info("Chat %d migrated to %d", chat_id, new_chat_id)
+    migrate_chat(chat_id, new_chat_id)
+
+
+broadcaster = Broadcaster(
+    bot.send_message,
+    workers=Config.BROADCAST_WORKERS,
+    rate=Config.BROADCAST_RATE,
+    group_rate=Config.BROADCAST_GROUP_RATE,
+    max_retries=Config.BROADCAST_MAX_RETRIES,
+    on_failure=handle_delivery_failure,
+    peers=count_sending_nodes,
+    on_migrate=handle_chat_migration,
+)
+
 
 def send_daily_report():
     """Отправляет утренний отчёт всем активным чатам с включенной рассылкой"""
-    with SessionLocal() as session:
-        active_chats = session.execute(
-            select(Chat).where(Chat.is_active == True, Chat.reports_enabled == True)
-        ).scalars().all()
-
-        for chat in active_chats:
-            try:
-                # Получаем данные о погоде
-                weather_data = get_weather(chat.city)
-                weather_text = "❌ Не удалось получить"
-                if weather_data['status'] == 200:
-                    weather_text = (
-                        f"{weather_data['temp']}°C (ощущается как {weather_data['feels_like']}°C)\n"
-                        f"   {weather_data['description']}"
-                    )
-
-                # Получаем данные о пробках
-                traffic_data = get_traffic_level(chat.city)
-                traffic_text = "❌ Не удалось получить"
-                if traffic_data['status'] == 200:
-                    traffic_text = (
-                        f"Уровень: {traffic_data['level']}/10\n"
-                        f"   {traffic_data['description']}"
-                    )
-
-                message = (
-                    f"🌤 Утренний отчёт для {chat.city}\n"
-                    f"🕗 {datetime.now().strftime('%d.%m.%Y %H:%M')}\n\n"
-                    f"🌡 Погода:\n{weather_text}\n\n"
-                    f"🚗 Пробки:\n{traffic_text}\n\n"
-                    f"Хорошего дня! ☀"
-                )
-                bot.send_message(chat.chat_id, message)
-            except Exception as e:
-                # Если бота кикнули — деактивируем чат
-                if "Forbidden" in str(e) or "kicked" in str(e):
-                    chat.is_active = False
-                    session.commit()
+    try:
+        run_daily_report(broadcaster.run)
+    finally:
+        deactivation_buffer.flush()
+
+
+def resume_daily_reports():
+    """Досылает незавершённые рассылки: повторы и прерванные перезапуском прогоны"""
+    try:
+        resume_broadcasts(broadcaster.run)
+    finally:
+        deactivation_buffer.flush()
+
+
+def prefetch_daily_report():
+    """Заранее загружает данные для утреннего отчёта и удаляет устаревшие замеры"""
+    try:
+        samples.prune()
+    except Exception as e:
+        log_exception(e)
+    prefetch_report_data()
 
 
 # Настройка планировщика
+report_time = datetime.combine(date.today(), dt_time(Config.REPORT_HOUR, Config.REPORT_MINUTE))
+prefetch_time = report_time - timedelta(minutes=Config.PREFETCH_LEAD_MINUTES)
+if Config.PREFETCH_LEAD_MINUTES * 60 + Config.PREFETCH_MARGIN > min(Config.WEATHER_CACHE_TTL, Config.TRAFFIC_CACHE_TTL):
+    logger.warning(
+        "PREFETCH_LEAD_MINUTES=%d leaves less than %.0fs before prefetched data expires, "
+        "the report will refetch it", Config.PREFETCH_LEAD_MINUTES, Config.PREFETCH_MARGIN
+    )
+
 scheduler = BackgroundScheduler(timezone=pytz.timezone('Europe/Moscow'))
+scheduler.add_job(
+    prefetch_daily_report,
+    trigger=CronTrigger(hour=prefetch_time.hour, minute=prefetch_time.minute),
+    id='daily_report_prefetch',
+    misfire_grace_time=600
+)
 scheduler.add_job(
     send_daily_report,
-    trigger=CronTrigger(hour=4, minute=0),
-    id='daily_weather_report'
+    trigger=CronTrigger(hour=report_time.hour, minute=report_time.minute),
+    id='daily_weather_report',
+    # Новый лидер, выбранный вскоре после падения старого, всё ещё запустит отчёт;
+    # повторный запуск безопасен — он продолжит тот же прогон
+    misfire_grace_time=3600
+)
+# Повторы неудачных отправок и продолжение рассылки, прерванной перезапуском
+scheduler.add_job(
+    resume_daily_reports,
+    trigger=IntervalTrigger(minutes=1),
+    id='broadcast_resume',
+    coalesce=True
 )
-scheduler.start()
 
-atexit.register(lambda: scheduler.shutdown() if scheduler.running else None)
+
+# Задачи планировщика выполняет только один процесс — держатель аренды 'scheduler'
+election = LeaderElection(
+    'scheduler',
+    ttl=Config.LEADER_LEASE_TTL,
+    on_elected=scheduler.resume,
+    on_demoted=scheduler.pause,
+)
+
+
+def stop_scheduler():
+    election.stop()
+    if scheduler.running:
+        scheduler.shutdown()
+
+
+def start_scheduler():
+    """
+    Запускает планировщик утреннего отчёта.
+    Планировщик стартует на паузе и включается, только пока процесс является лидером.
+    """
+    scheduler.start(paused=True)
+    election.start()
+    atexit.register(stop_scheduler)
+
+
+def run_webhook():
+    """Регистрирует webhook в Telegram и запускает HTTP-сервер для приёма обновлений"""
+    # Обновление попадает в диспетчер до ответа Telegram: при заполненной очереди
+    # сервер отвечает 503, и Telegram повторит доставку
+    server = WebhookServer(
+        bot.submit_update,
+        host=Config.WEBHOOK_HOST,
+        port=Config.WEBHOOK_PORT,
+        path=Config.WEBHOOK_PATH,
+        secret=Config.WEBHOOK_SECRET,
+        stats=bot.dispatcher.stats,
+    )
+    if Config.WEBHOOK_URL:
+        bot.remove_webhook()
+        bot.set_webhook(url=Config.WEBHOOK_URL, secret_token=Config.WEBHOOK_SECRET)
+    server.serve_forever()
 
 
 if __name__ == '__main__':
-    bot.infinity_polling()
+    run_migrations()
+    start_metrics_server(Config.METRICS_HOST, Config.METRICS_PORT)
+    start_scheduler()
+    if Config.BOT_MODE == 'webhook':
+        run_webhook()
+    else:
+        bot.infinity_polling()
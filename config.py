@@ -9,3 +9,135 @@ class Config:
     TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
     DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///app.db')
     OPENWEATHER_API_KEY = os.getenv('OPENWEATHER_API_KEY')
+    OSRM_BASE_URL = os.getenv('OSRM_BASE_URL', 'https://router.project-osrm.org')
+    OPENWEATHER_BASE_URL = os.getenv('OPENWEATHER_BASE_URL', 'https://api.openweathermap.org')
+    # Шаблон адреса Bot API в формате telebot, например http://127.0.0.1:8081/bot{0}/{1};
+    # пусто — официальный api.telegram.org
+    TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+
+    # Параметры рассылки утреннего отчёта. BROADCAST_RATE — общий лимит бота (msg/s):
+    # процессы, одновременно отправляющие рассылку, делят его поровну
+    BROADCAST_WORKERS = int(os.getenv('BROADCAST_WORKERS', '8'))
+    BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '30'))
+    BROADCAST_GROUP_RATE = float(os.getenv('BROADCAST_GROUP_RATE', '20'))
+    BROADCAST_MAX_RETRIES = int(os.getenv('BROADCAST_MAX_RETRIES', '3'))
+
+    # Очередь доставки рассылки: строк за одну выборку, попыток на сообщение,
+    # базовая задержка повтора (сек), через сколько секунд забранная строка считается брошенной
+    # и через сколько секунд незавершённый прогон закрывается
+    OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '500'))
+    OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '5'))
+    OUTBOX_RETRY_BACKOFF = float(os.getenv('OUTBOX_RETRY_BACKOFF', '60'))
+    OUTBOX_CLAIM_TIMEOUT = float(os.getenv('OUTBOX_CLAIM_TIMEOUT', '600'))
+    OUTBOX_RUN_TTL = float(os.getenv('OUTBOX_RUN_TTL', str(6 * 3600)))
+    # Сколько секунд хранить завершённые прогоны вместе с очередью доставки и текстами
+    OUTBOX_RETENTION = float(os.getenv('OUTBOX_RETENTION', str(7 * 24 * 3600)))
+
+    # Несколько процессов: число шардов рассылки (по хэшу chat_id), время жизни аренды
+    # лидера планировщика и аренды шарда (сек), как часто отдельный воркер проверяет очередь (сек)
+    BROADCAST_SHARDS = int(os.getenv('BROADCAST_SHARDS', '16'))
+    LEADER_LEASE_TTL = float(os.getenv('LEADER_LEASE_TTL', '30'))
+    SHARD_LEASE_TTL = float(os.getenv('SHARD_LEASE_TTL', '60'))
+    WORKER_POLL_INTERVAL = float(os.getenv('WORKER_POLL_INTERVAL', '5'))
+    # Имя процесса в арендах; по умолчанию hostname:pid
+    NODE_ID = os.getenv('NODE_ID')
+
+    # Кэш погоды: время жизни (сек), сколько ещё отдавать устаревшие данные, размер
+    WEATHER_CACHE_TTL = float(os.getenv('WEATHER_CACHE_TTL', '600'))
+    WEATHER_CACHE_STALE_TTL = float(os.getenv('WEATHER_CACHE_STALE_TTL', '1800'))
+    WEATHER_CACHE_SIZE = int(os.getenv('WEATHER_CACHE_SIZE', '2048'))
+
+    # Кэш геокодирования в базе: найденные города и отрицательные ответы (сек)
+    GEOCODE_CACHE_TTL = float(os.getenv('GEOCODE_CACHE_TTL', str(30 * 24 * 3600)))
+    GEOCODE_NEGATIVE_TTL = float(os.getenv('GEOCODE_NEGATIVE_TTL', str(6 * 3600)))
+
+    # Кэш состояния чатов для обработчиков команд: размер и время жизни записи (сек).
+    # Кэш свой у каждого процесса и сбрасывается только при записи в этом же процессе:
+    # при нескольких процессах изменение, сделанное другим, видно не позже чем через TTL
+    CHAT_STATE_CACHE_SIZE = int(os.getenv('CHAT_STATE_CACHE_SIZE', '50000'))
+    CHAT_STATE_CACHE_TTL = float(os.getenv('CHAT_STATE_CACHE_TTL', '300'))
+
+    # Режим производительности SQLite: WAL, pragma и пул соединений
+    SQLITE_PERFORMANCE_MODE = os.getenv('SQLITE_PERFORMANCE_MODE', '0').lower() in ('1', 'true', 'yes')
+    SQLITE_CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB', '20000'))
+    # Сколько секунд ждать, пока другое соединение освободит блокировку записи
+    SQLITE_BUSY_TIMEOUT = float(os.getenv('SQLITE_BUSY_TIMEOUT', '30'))
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+
+    # Кэш пробок: время жизни (сек), сколько ещё отдавать устаревшие данные и размер
+    TRAFFIC_CACHE_TTL = float(os.getenv('TRAFFIC_CACHE_TTL', '600'))
+    TRAFFIC_CACHE_STALE_TTL = float(os.getenv('TRAFFIC_CACHE_STALE_TTL', '600'))
+    TRAFFIC_CACHE_SIZE = int(os.getenv('TRAFFIC_CACHE_SIZE', '2048'))
+
+    # Сколько секунд ждать результата такого же запроса, уже выполняемого другим обработчиком
+    COALESCE_WAIT_TIMEOUT = float(os.getenv('COALESCE_WAIT_TIMEOUT', '15'))
+
+    # Время утреннего отчёта (в часовом поясе планировщика) и предварительной загрузки данных.
+    # Загруженные заранее данные должны оставаться свежими к началу рассылки:
+    # PREFETCH_LEAD_MINUTES с запасом меньше времени жизни кэшей погоды и пробок
+    REPORT_HOUR = int(os.getenv('REPORT_HOUR', '4'))
+    REPORT_MINUTE = int(os.getenv('REPORT_MINUTE', '0'))
+    PREFETCH_LEAD_MINUTES = int(os.getenv('PREFETCH_LEAD_MINUTES', '3'))
+    PREFETCH_WORKERS = int(os.getenv('PREFETCH_WORKERS', '8'))
+    PREFETCH_MARGIN = float(os.getenv('PREFETCH_MARGIN', '120'))
+
+    # Способ получения обновлений: polling или webhook
+    BOT_MODE = os.getenv('BOT_MODE', 'polling')
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+    WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+    WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+    WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+    WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+
+    # Диспетчер команд: потоков обработчиков и максимум обновлений в очереди,
+    # сверх которого новые обновления отбрасываются
+    DISPATCH_WORKERS = int(os.getenv('DISPATCH_WORKERS', '8'))
+    DISPATCH_QUEUE_SIZE = int(os.getenv('DISPATCH_QUEUE_SIZE', '1000'))
+
+    # Общий HTTP-клиент: пул соединений, таймауты (сек) и повторы запросов
+    HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '100'))
+    HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '3'))
+    HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '10'))
+    HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', '2'))
+    HTTP_RETRY_BACKOFF = float(os.getenv('HTTP_RETRY_BACKOFF', '0.5'))
+
+    # Circuit breaker внешних сервисов: сколько ошибок подряд до размыкания и пауза (сек)
+    BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', '5'))
+    BREAKER_RESET_TIMEOUT = float(os.getenv('BREAKER_RESET_TIMEOUT', '30'))
+
+    # Квота запросов к OpenWeatherMap: на минуту, на сутки (0 — без ограничения),
+    # доля минутной квоты для рассылки и сколько пакетный запрос может ждать квоту (сек)
+    OWM_CALLS_PER_MINUTE = int(os.getenv('OWM_CALLS_PER_MINUTE', '60'))
+    OWM_CALLS_PER_DAY = int(os.getenv('OWM_CALLS_PER_DAY', '30000'))
+    OWM_BATCH_SHARE = float(os.getenv('OWM_BATCH_SHARE', '0.75'))
+    OWM_BATCH_QUOTA_WAIT = float(os.getenv('OWM_BATCH_QUOTA_WAIT', '120'))
+
+    # Ограничение частоты команд одного чата: не больше COMMAND_RATE_LIMIT за COMMAND_RATE_WINDOW сек
+    COMMAND_RATE_LIMIT = int(os.getenv('COMMAND_RATE_LIMIT', '5'))
+    COMMAND_RATE_WINDOW = float(os.getenv('COMMAND_RATE_WINDOW', '60'))
+
+    # Метрики Prometheus: адрес HTTP-сервера /metrics (порт 0 — отключено)
+    # и семплирующий профайлер /debug/profile?seconds=N на том же сервере
+    METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+    METRICS_PORT = int(os.getenv('METRICS_PORT', '9464'))
+    PROFILER_ENABLED = os.getenv('PROFILER_ENABLED', '0').lower() in ('1', 'true', 'yes')
+
+    # Журнал ошибок (JSON Lines): папка и файл, ротация по размеру (байт) и времени (сек),
+    # число архивов, размер очереди записи и окно схлопывания одинаковых ошибок (сек)
+    LOG_DIR = os.getenv('LOG_DIR', 'logs')
+    LOG_FILE = os.getenv('LOG_FILE', 'errors.jsonl')
+    LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+    LOG_ROTATE_INTERVAL = float(os.getenv('LOG_ROTATE_INTERVAL', '86400'))
+    LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '14'))
+    LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+    LOG_DEDUP_WINDOW = float(os.getenv('LOG_DEDUP_WINDOW', '60'))
+
+    # Замеры погоды и пробок по городам: размер пачки записи, интервал сброса (сек),
+    # срок хранения (дней), глубина почасовой нормы (дней), минимум замеров для нормы
+    # и окно вокруг того же времени вчера (сек)
+    SAMPLES_BATCH_SIZE = int(os.getenv('SAMPLES_BATCH_SIZE', '200'))
+    SAMPLES_FLUSH_INTERVAL = float(os.getenv('SAMPLES_FLUSH_INTERVAL', '60'))
+    SAMPLES_RETENTION_DAYS = int(os.getenv('SAMPLES_RETENTION_DAYS', '15'))
+    SAMPLES_BASELINE_DAYS = int(os.getenv('SAMPLES_BASELINE_DAYS', '7'))
+    SAMPLES_MIN_COUNT = int(os.getenv('SAMPLES_MIN_COUNT', '3'))
+    SAMPLES_YESTERDAY_WINDOW = int(os.getenv('SAMPLES_YESTERDAY_WINDOW', '3600'))
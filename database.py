@@ -1,15 +1,89 @@
-import os
-from datetime import datetime
-from typing import Optional
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
 
-from sqlalchemy import Boolean, Integer, String, create_engine, select
+from sqlalchemy import (
+    Boolean, Connection, DateTime, Float, Index, Integer, String, Table,
+    and_, create_engine, delete, event, func, insert, inspect, literal, or_, select, text, update,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, sessionmaker
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.dml import Insert
 
+from applog import log_exception
 from config import Config
+from metrics import DB_ERRORS, DB_QUERY_SECONDS, register_cache
+from services.cache import TTLCache
 
-os.makedirs("logs", exist_ok=True)
+logger = logging.getLogger(__name__)
 
-engine = create_engine(Config.DATABASE_URL, echo=False)
+
+def create_db_engine(url: str) -> Engine:
+    """
+    Создаёт движок базы данных.
+    Для SQLite в режиме производительности включаются WAL, настроенные pragma
+    и пул соединений, рассчитанный на потоки обработчиков и рассылки.
+    """
+    if not (Config.SQLITE_PERFORMANCE_MODE and url.startswith('sqlite')):
+        return create_engine(url, echo=False)
+
+    sqlite_engine = create_engine(
+        url,
+        echo=False,
+        poolclass=QueuePool,
+        pool_size=Config.DB_POOL_SIZE,
+        max_overflow=Config.DB_POOL_SIZE,
+        # timeout драйвера sqlite3 задаёт busy timeout: сколько ждать блокировки записи
+        connect_args={'check_same_thread': False, 'timeout': Config.SQLITE_BUSY_TIMEOUT},
+    )
+
+    @event.listens_for(sqlite_engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # WAL позволяет читать базу, пока обработчики пишут
+        cursor.execute('PRAGMA journal_mode=WAL')
+        # В WAL режим NORMAL безопасен при падении процесса и заметно быстрее FULL
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute(f'PRAGMA cache_size=-{Config.SQLITE_CACHE_SIZE_KB}')
+        cursor.execute('PRAGMA temp_store=MEMORY')
+        cursor.close()
+
+    return sqlite_engine
+
+
+def sql_operation(statement: str) -> str:
+    """Метка запроса в метриках: первое слово SQL (SELECT, INSERT, UPDATE...)"""
+    return statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'OTHER'
+
+
+def instrument_engine(db_engine: Engine) -> None:
+    """Замеряет каждый запрос движка и считает ошибки по типу операции"""
+
+    @event.listens_for(db_engine, 'before_cursor_execute')
+    def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(db_engine, 'after_cursor_execute')
+    def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['query_started'].pop()
+        DB_QUERY_SECONDS.observe(time.perf_counter() - started, operation=sql_operation(statement))
+
+    @event.listens_for(db_engine, 'handle_error')
+    def count_query_error(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get('query_started'):
+            connection.info['query_started'].pop()
+        DB_ERRORS.inc(operation=sql_operation(exception_context.statement or ''))
+
+
+engine = create_db_engine(Config.DATABASE_URL)
+instrument_engine(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
@@ -26,34 +100,193 @@ class Chat(Base):
     city: Mapped[str] = mapped_column(String, nullable=False)
     is_active: Mapped[bool] = mapped_column(Boolean, default=True)
     reports_enabled: Mapped[bool] = mapped_column(Boolean, default=True)
+    city_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    lat: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    lon: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
 
     def __repr__(self) -> str:
         return f"Chat(chat_id={self.chat_id}, chat_type='{self.chat_type}', city='{self.city}')"
 
 
-def log_exception(e: Exception) -> None:
-    """Логирует исключение в файл"""
-    now = datetime.now()
-    filename = f"logs/error_{now.strftime('%Y-%m-%d_%H-%M-%S')}.log"
-    with open(filename, 'w', encoding='utf-8') as f:
-        f.write(f"=== Ошибка при работе с базой ===\n\n{str(e)}\n")
+# Покрывающий индекс для выборки получателей рассылки:
+# chat_id в SQLite является rowid и хранится в каждом индексе
+chats_report_index = Index('ix_chats_report', Chat.is_active, Chat.reports_enabled, Chat.city)
+
+
+class GeoCache(Base):
+    """Кэш геокодирования: нормализованный запрос -> найденный город"""
+    __tablename__ = 'geocache'
+
+    query: Mapped[str] = mapped_column(String, primary_key=True)
+    found: Mapped[bool] = mapped_column(Boolean, nullable=False)
+    name: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    lat: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    lon: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    city_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"GeoCache(query='{self.query}', found={self.found}, name='{self.name}')"
+
+
+class BroadcastRun(Base):
+    """Прогон рассылки, например утренний отчёт за конкретный день"""
+    __tablename__ = 'broadcast_runs'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    key: Mapped[str] = mapped_column(String, nullable=False, unique=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    shards: Mapped[int] = mapped_column(Integer, nullable=False, default=1)
+
+    def __repr__(self) -> str:
+        return f"BroadcastRun(id={self.id}, key='{self.key}')"
+
+
+# Статусы строк очереди доставки
+DELIVERY_PENDING = 'pending'
+DELIVERY_SENDING = 'sending'
+DELIVERY_DONE = 'done'
+DELIVERY_FAILED = 'failed'
+
+
+class Delivery(Base):
+    """Строка очереди доставки (outbox): одно сообщение прогона одному чату"""
+    __tablename__ = 'deliveries'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    run_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    chat_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    city: Mapped[str] = mapped_column(String, nullable=False)
+    shard: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    status: Mapped[str] = mapped_column(String, nullable=False, default=DELIVERY_PENDING)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    claim_token: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    claimed_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    delivered_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    last_error: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+
+    def __repr__(self) -> str:
+        return f"Delivery(run_id={self.run_id}, chat_id={self.chat_id}, status='{self.status}')"
+
+
+# Один чат попадает в прогон не больше одного раза
+deliveries_run_chat_index = Index('ux_deliveries_run_chat', Delivery.run_id, Delivery.chat_id, unique=True)
+# Выборка готовых к отправке строк шарда прогона
+deliveries_claim_index = Index(
+    'ix_deliveries_shard_claim', Delivery.run_id, Delivery.shard, Delivery.status, Delivery.next_attempt_at
+)
+
+
+class BroadcastMessage(Base):
+    """Готовый текст прогона для города: общий для всех процессов, отправляющих прогон"""
+    __tablename__ = 'broadcast_messages'
+
+    run_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    key: Mapped[str] = mapped_column(String, primary_key=True)
+    text: Mapped[str] = mapped_column(String, nullable=False)
+
+
+class Lease(Base):
+    """Аренда с истечением: лидерство планировщика или шард рассылки"""
+    __tablename__ = 'leases'
+
+    name: Mapped[str] = mapped_column(String, primary_key=True)
+    owner: Mapped[str] = mapped_column(String, nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"Lease(name='{self.name}', owner='{self.owner}', expires_at={self.expires_at})"
+
+
+class QuotaUsage(Base):
+    """Использование квоты внешнего API в текущем окне, общее для всех процессов"""
+    __tablename__ = 'quota_usage'
+
+    name: Mapped[str] = mapped_column(String, primary_key=True)
+    # Окно квоты: 'minute' или 'day'
+    window: Mapped[str] = mapped_column(String, primary_key=True)
+    # Номер текущего периода окна: минута или день от начала эпохи
+    period: Mapped[int] = mapped_column(Integer, nullable=False)
+    used: Mapped[int] = mapped_column(Integer, nullable=False)
+
+
+# Метрики временных рядов по городам
+SAMPLE_TEMP = 1
+SAMPLE_TRAFFIC = 2
+
+
+class CitySample(Base):
+    """Замер по городу, полученный при запросе к API: температура или уровень пробок"""
+    __tablename__ = 'city_samples'
+    # Ключ (город, метрика, время) сразу служит индексом для выборки по интервалам,
+    # без rowid таблица не хранит его второй копией
+    __table_args__ = {'sqlite_with_rowid': False}
+
+    city: Mapped[str] = mapped_column(String, primary_key=True)
+    metric: Mapped[int] = mapped_column(Integer, primary_key=True)
+    ts: Mapped[int] = mapped_column(Integer, primary_key=True)
+    value: Mapped[float] = mapped_column(Float, nullable=False)
+
+
+class ChatState(NamedTuple):
+    """Состояние чата, нужное обработчикам команд"""
+    is_active: bool
+    reports_enabled: bool
+    city: str
+
+
+# Кэш состояния чатов: chat_id -> ChatState или None, если чата нет в базе.
+# Обновляется при каждой записи через функции этого модуля.
+chat_state_cache = TTLCache(maxsize=Config.CHAT_STATE_CACHE_SIZE, ttl=Config.CHAT_STATE_CACHE_TTL)
+register_cache('chat_state', chat_state_cache)
+
+
+def _cache_chat_state(chat: Chat) -> None:
+    chat_state_cache.set(chat.chat_id, ChatState(chat.is_active, chat.reports_enabled, chat.city))
+
+
+def _load_chat_state(chat_id: int) -> Optional[ChatState]:
+    with SessionLocal() as session:
+        stmt = select(Chat.is_active, Chat.reports_enabled, Chat.city).where(Chat.chat_id == chat_id)
+        row = session.execute(stmt).one_or_none()
+        return ChatState(*row) if row else None
+
+
+def get_chat_state(chat_id: int) -> Optional[ChatState]:
+    """Возвращает состояние чата из кэша, при промахе читает его из базы"""
+    return chat_state_cache.get_or_load(chat_id, lambda: _load_chat_state(chat_id))
 
 
 def save_chat(chat_id: int, chat_type: str, city: str = "Москва") -> bool:
-    """Сохраняет или обновляет чат в базе данных"""
+    """
+    Сохраняет или обновляет чат в базе данных.
+    Повторно активированный чат начинает с города city: id и координаты прежнего города сбрасываются.
+    """
     try:
         with SessionLocal() as session:
-            chat = Chat(chat_id=chat_id, chat_type=chat_type, city=city)
-            session.merge(chat)
+            chat = Chat(
+                chat_id=chat_id, chat_type=chat_type, city=city,
+                is_active=True, city_id=None, lat=None, lon=None,
+            )
+            chat = session.merge(chat)
             session.commit()
+            _cache_chat_state(chat)
             return True
     except Exception as e:
-        log_exception(e)
+        log_exception(e, chat_id=chat_id)
         return False
 
 
-def update_city(chat_id: int, city_name: str) -> bool:
-    """Обновляет город для указанного чата"""
+def update_city(
+    chat_id: int,
+    city_name: str,
+    city_id: Optional[int] = None,
+    lat: Optional[float] = None,
+    lon: Optional[float] = None,
+) -> bool:
+    """Обновляет город для указанного чата вместе с его id и координатами"""
     try:
         with SessionLocal() as session:
             stmt = select(Chat).where(Chat.chat_id == chat_id)
@@ -61,19 +294,21 @@ def update_city(chat_id: int, city_name: str) -> bool:
             if chat is None:
                 return False
             chat.city = city_name
+            chat.city_id = city_id
+            chat.lat = lat
+            chat.lon = lon
             session.commit()
+            _cache_chat_state(chat)
             return True
     except Exception as e:
-        log_exception(e)
+        log_exception(e, chat_id=chat_id, city=city_name)
         return False
 
 
 def is_active_chat(chat_id: int) -> bool:
     """Проверяет, активен ли чат"""
-    with SessionLocal() as session:
-        stmt = select(Chat).where(Chat.chat_id == chat_id, Chat.is_active == True)
-        result = session.execute(stmt).scalar_one_or_none()
-        return result is not None
+    state = get_chat_state(chat_id)
+    return state is not None and state.is_active
 
 
 def deactivate_chat(chat_id: int) -> bool:
@@ -85,18 +320,148 @@ def deactivate_chat(chat_id: int) -> bool:
             if chat:
                 chat.is_active = False
                 session.commit()
+                _cache_chat_state(chat)
                 return True
             return False
     except Exception as e:
-        log_exception(e)
+        log_exception(e, chat_id=chat_id)
+        return False
+
+
+def deactivate_chats(chat_ids: List[int]) -> int:
+    """Деактивирует сразу несколько чатов одним UPDATE ... WHERE chat_id IN (...)"""
+    updated = 0
+    # Ограничиваем размер IN (...), чтобы не упереться в лимит параметров SQLite
+    for start in range(0, len(chat_ids), 500):
+        chunk = chat_ids[start:start + 500]
+        with SessionLocal() as session:
+            result = session.execute(
+                update(Chat).where(Chat.chat_id.in_(chunk)).values(is_active=False)
+            )
+            session.commit()
+            updated += result.rowcount
+        for chat_id in chunk:
+            chat_state_cache.invalidate(chat_id)
+    return updated
+
+
+def migrate_chat(old_chat_id: int, new_chat_id: int) -> bool:
+    """
+    Переносит чат на новый chat_id, когда группа становится супергруппой.
+    Если новый чат уже есть в базе, старый просто деактивируется.
+    """
+    try:
+        with SessionLocal() as session:
+            if session.get(Chat, new_chat_id) is not None:
+                session.execute(update(Chat).where(Chat.chat_id == old_chat_id).values(is_active=False))
+            else:
+                session.execute(
+                    update(Chat)
+                    .where(Chat.chat_id == old_chat_id)
+                    .values(chat_id=new_chat_id, chat_type='supergroup')
+                )
+            session.commit()
+    except Exception as e:
+        log_exception(e, chat_id=old_chat_id, new_chat_id=new_chat_id)
         return False
+    chat_state_cache.invalidate(old_chat_id)
+    chat_state_cache.invalidate(new_chat_id)
+    return True
+
+
+class DeactivationBuffer:
+    """
+    Копит chat_id недоступных чатов и деактивирует их пачками.
+    Сброс происходит, когда буфер заполнен или прошло flush_interval секунд.
+    """
+
+    def __init__(self, max_size: int = 500, flush_interval: float = 10.0):
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self._chat_ids: List[int] = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, chat_id: int) -> None:
+        with self._lock:
+            self._chat_ids.append(chat_id)
+            due = (
+                len(self._chat_ids) >= self.max_size
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            )
+        if due:
+            self.flush()
+
+    def flush(self) -> int:
+        """Записывает накопленные chat_id в базу, возвращает число обновлённых строк"""
+        with self._lock:
+            chat_ids, self._chat_ids = self._chat_ids, []
+            self._last_flush = time.monotonic()
+        if not chat_ids:
+            return 0
+        try:
+            return deactivate_chats(chat_ids)
+        except Exception as e:
+            log_exception(e, chats=len(chat_ids))
+            return 0
+
+
+class SampleBuffer:
+    """
+    Копит замеры по городам и записывает их пачками.
+    Запись выполняет фоновый поток: раз в flush_interval секунд или сразу,
+    как только буфер заполнился, поэтому add не ждёт базу.
+    """
+
+    def __init__(self, max_size: int = 200, flush_interval: float = 60.0):
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self._rows: Dict[Tuple[str, int, int], float] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, city: str, metric: int, value: float, ts: Optional[int] = None) -> None:
+        with self._lock:
+            # Повторный замер в ту же секунду заменяет предыдущий
+            self._rows[(city, metric, int(ts if ts is not None else time.time()))] = float(value)
+            full = len(self._rows) >= self.max_size
+        self._ensure_started()
+        if full:
+            self._wakeup.set()
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='sample-flush', daemon=True)
+            self._thread.start()
+
+    def flush(self) -> int:
+        """Записывает накопленные замеры в базу, возвращает их число"""
+        with self._lock:
+            rows, self._rows = self._rows, {}
+        if not rows:
+            return 0
+        try:
+            return save_samples([(city, metric, ts, value) for (city, metric, ts), value in rows.items()])
+        except Exception as e:
+            log_exception(e, samples=len(rows))
+            return 0
+
 
 def get_city_name(chat_id: int) -> Optional[str]:
     """Получает название города для указанного чата"""
-    with SessionLocal() as session:
-        stmt = select(Chat).where(Chat.chat_id == chat_id, Chat.is_active == True)
-        chat = session.execute(stmt).scalar_one_or_none()
-        return chat.city if chat else None
+    state = get_chat_state(chat_id)
+    return state.city if state and state.is_active else None
 
 
 def set_reports_enabled(chat_id: int, enabled: bool) -> bool:
@@ -108,19 +473,591 @@ def set_reports_enabled(chat_id: int, enabled: bool) -> bool:
             if chat:
                 chat.reports_enabled = enabled
                 session.commit()
+                _cache_chat_state(chat)
                 return True
             return False
     except Exception as e:
-        log_exception(e)
+        log_exception(e, chat_id=chat_id)
         return False
 
 
 def are_reports_enabled(chat_id: int) -> bool:
     """Проверяет, включена ли рассылка для чата"""
+    state = get_chat_state(chat_id)
+    return state.reports_enabled if state and state.is_active else False
+
+
+def get_report_cities() -> List[Tuple[str, Optional[int]]]:
+    """Возвращает уникальные пары (city, city_id) чатов с включенной рассылкой"""
     with SessionLocal() as session:
-        stmt = select(Chat).where(Chat.chat_id == chat_id, Chat.is_active == True)
-        chat = session.execute(stmt).scalar_one_or_none()
-        return chat.reports_enabled if chat else False
+        stmt = (
+            select(Chat.city, Chat.city_id)
+            .where(Chat.is_active == True, Chat.reports_enabled == True)
+            .distinct()
+        )
+        return [(city, city_id) for city, city_id in session.execute(stmt)]
+
+
+def get_cached_geocode(query: str) -> Optional[Dict[str, Any]]:
+    """
+    Возвращает результат геокодирования из кэша.
+    None — записи нет или она устарела; {'found': False, ...} — город точно не найден.
+    """
+    try:
+        with SessionLocal() as session:
+            entry = session.get(GeoCache, query)
+            if entry is None:
+                return None
+            ttl = Config.GEOCODE_CACHE_TTL if entry.found else Config.GEOCODE_NEGATIVE_TTL
+            if datetime.utcnow() - entry.updated_at > timedelta(seconds=ttl):
+                return None
+            return {
+                'found': entry.found,
+                'name': entry.name,
+                'lat': entry.lat,
+                'lon': entry.lon,
+                'city_id': entry.city_id,
+            }
+    except Exception as e:
+        log_exception(e, query=query)
+        return None
+
+
+def save_geocode(
+    query: str,
+    found: bool,
+    name: Optional[str] = None,
+    lat: Optional[float] = None,
+    lon: Optional[float] = None,
+    city_id: Optional[int] = None,
+) -> bool:
+    """Сохраняет результат геокодирования (в том числе отрицательный)"""
+    try:
+        with SessionLocal() as session:
+            session.merge(GeoCache(
+                query=query, found=found, name=name, lat=lat, lon=lon,
+                city_id=city_id, updated_at=datetime.utcnow()
+            ))
+            session.commit()
+            return True
+    except Exception as e:
+        log_exception(e, query=query)
+        return False
+
+
+def start_broadcast_run(key: str, shards: int = 1) -> Tuple[int, bool]:
+    """
+    Создаёт прогон рассылки и ставит в очередь по строке на каждый чат с включенной рассылкой.
+    Очередь заполняется одним INSERT ... SELECT в той же транзакции, что и прогон;
+    строки делятся на shards шардов по abs(chat_id) % shards.
+    Если прогон с таким ключом уже есть, возвращает его: повторный запуск
+    (например, после перезапуска бота) не создаёт дублей.
+    Возвращает (id прогона, создан ли он сейчас).
+    """
+    with SessionLocal() as session:
+        run_id = session.execute(select(BroadcastRun.id).where(BroadcastRun.key == key)).scalar_one_or_none()
+        if run_id is not None:
+            return run_id, False
+
+        now = datetime.now()
+        run = BroadcastRun(key=key, created_at=now, shards=shards)
+        session.add(run)
+        try:
+            session.flush()
+            recipients = select(
+                literal(run.id), Chat.chat_id, Chat.city, func.abs(Chat.chat_id) % shards,
+                literal(DELIVERY_PENDING), literal(0), literal(now, DateTime)
+            ).where(Chat.is_active == True, Chat.reports_enabled == True)
+            session.execute(
+                insert(Delivery).from_select(
+                    ['run_id', 'chat_id', 'city', 'shard', 'status', 'attempts', 'next_attempt_at'], recipients
+                )
+            )
+            session.commit()
+            return run.id, True
+        except IntegrityError:
+            # Прогон с этим ключом одновременно создал другой процесс
+            session.rollback()
+            return session.execute(select(BroadcastRun.id).where(BroadcastRun.key == key)).scalar_one(), False
+
+
+def get_run_shards(run_id: int) -> int:
+    """Возвращает число шардов прогона"""
+    with SessionLocal() as session:
+        return session.execute(select(BroadcastRun.shards).where(BroadcastRun.id == run_id)).scalar() or 1
+
+
+def save_broadcast_messages(run_id: int, messages: Dict[str, str]) -> None:
+    """Сохраняет тексты прогона по городам, уже сохранённые не перезаписываются"""
+    with SessionLocal() as session:
+        known = set(session.execute(
+            select(BroadcastMessage.key).where(BroadcastMessage.run_id == run_id)
+        ).scalars())
+        for key, message in messages.items():
+            if key not in known:
+                session.add(BroadcastMessage(run_id=run_id, key=key, text=message))
+        try:
+            session.commit()
+        except IntegrityError:
+            # Тот же город одновременно сохранил другой процесс
+            session.rollback()
+
+
+def get_broadcast_messages(run_id: int) -> Dict[str, str]:
+    """Возвращает сохранённые тексты прогона по нормализованному городу"""
+    with SessionLocal() as session:
+        stmt = select(BroadcastMessage.key, BroadcastMessage.text).where(BroadcastMessage.run_id == run_id)
+        return dict(session.execute(stmt).all())
+
+
+def get_unfinished_runs() -> List[int]:
+    """Возвращает id незавершённых прогонов рассылки, старые первыми"""
+    with SessionLocal() as session:
+        stmt = select(BroadcastRun.id).where(BroadcastRun.finished_at == None).order_by(BroadcastRun.id)
+        return list(session.execute(stmt).scalars())
+
+
+def claim_deliveries(run_id: int, shard: int, limit: int, claim_timeout: float) -> List[Tuple[int, int, str]]:
+    """
+    Забирает в отправку до limit строк шарда прогона и возвращает (id строки, chat_id, city).
+
+    Берутся ожидающие строки, срок повтора которых наступил, а также строки,
+    забранные больше claim_timeout секунд назад и не завершённые —
+    их владелец, скорее всего, упал посреди отправки.
+    """
+    now = datetime.now()
+    claimable = and_(
+        Delivery.run_id == run_id,
+        Delivery.shard == shard,
+        or_(
+            and_(Delivery.status == DELIVERY_PENDING, Delivery.next_attempt_at <= now),
+            and_(Delivery.status == DELIVERY_SENDING, Delivery.claimed_at < now - timedelta(seconds=claim_timeout)),
+        ),
+    )
+    token = uuid.uuid4().hex
+    with SessionLocal() as session:
+        ready = select(Delivery.id).where(claimable).order_by(Delivery.id).limit(limit)
+        session.execute(
+            update(Delivery)
+            .where(Delivery.id.in_(ready), claimable)
+            .values(
+                status=DELIVERY_SENDING,
+                claim_token=token,
+                claimed_at=now,
+                attempts=Delivery.attempts + 1,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        session.commit()
+        # Условия на прогон, шард и статус позволяют найти забранные строки по индексу шарда
+        stmt = select(Delivery.id, Delivery.chat_id, Delivery.city).where(
+            Delivery.run_id == run_id,
+            Delivery.shard == shard,
+            Delivery.status == DELIVERY_SENDING,
+            Delivery.claim_token == token,
+        )
+        return [(delivery_id, chat_id, city) for delivery_id, chat_id, city in session.execute(stmt)]
+
+
+def complete_deliveries(delivery_ids: List[int]) -> int:
+    """Отмечает строки очереди доставленными"""
+    updated = 0
+    now = datetime.now()
+    for start in range(0, len(delivery_ids), 500):
+        chunk = delivery_ids[start:start + 500]
+        with SessionLocal() as session:
+            result = session.execute(
+                update(Delivery)
+                .where(Delivery.id.in_(chunk))
+                .values(status=DELIVERY_DONE, delivered_at=now, claim_token=None, last_error=None)
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+            updated += result.rowcount
+    return updated
+
+
+def reschedule_deliveries(
+    failures: List[Tuple[int, str, bool]],
+    max_attempts: int,
+    backoff: float,
+) -> int:
+    """
+    Обрабатывает неудачные отправки: (id строки, текст ошибки, постоянная ли ошибка).
+    Постоянные ошибки и строки, исчерпавшие max_attempts, помечаются failed,
+    остальные возвращаются в очередь с экспоненциальной задержкой backoff * 2**(attempts - 1).
+    Возвращает число строк, отправленных на повтор.
+    """
+    if not failures:
+        return 0
+    retried = 0
+    now = datetime.now()
+    with SessionLocal() as session:
+        attempts = dict(session.execute(
+            select(Delivery.id, Delivery.attempts).where(Delivery.id.in_([failure[0] for failure in failures]))
+        ).all())
+        for delivery_id, error, permanent in failures:
+            made = attempts.get(delivery_id, max_attempts)
+            values: Dict[str, Any] = {'claim_token': None, 'last_error': error[:500]}
+            if permanent or made >= max_attempts:
+                values['status'] = DELIVERY_FAILED
+            else:
+                values['status'] = DELIVERY_PENDING
+                values['next_attempt_at'] = now + timedelta(seconds=backoff * 2 ** (made - 1))
+                retried += 1
+            session.execute(update(Delivery).where(Delivery.id == delivery_id).values(**values))
+        session.commit()
+    return retried
+
+
+def finish_broadcast_run(run_id: int) -> bool:
+    """Закрывает прогон, если в нём не осталось ожидающих и отправляемых строк"""
+    with SessionLocal() as session:
+        remaining = session.execute(
+            select(func.count())
+            .select_from(Delivery)
+            .where(Delivery.run_id == run_id, Delivery.status.in_([DELIVERY_PENDING, DELIVERY_SENDING]))
+        ).scalar()
+        if remaining:
+            return False
+        session.execute(
+            update(BroadcastRun)
+            .where(BroadcastRun.id == run_id, BroadcastRun.finished_at == None)
+            .values(finished_at=datetime.now())
+        )
+        session.commit()
+        return True
+
+
+def expire_broadcast_runs(max_age: float, retention: float) -> Tuple[int, int]:
+    """
+    Закрывает прогоны старше max_age секунд: недоставленные строки помечаются failed,
+    чтобы, например, вчерашний отчёт не ушёл на следующий день.
+    Завершённые прогоны старше retention секунд удаляются вместе со строками очереди и текстами.
+    Возвращает (число закрытых прогонов, число удалённых прогонов).
+    """
+    now = datetime.now()
+    cutoff = now - timedelta(seconds=max_age)
+    with SessionLocal() as session:
+        run_ids = list(session.execute(
+            select(BroadcastRun.id).where(BroadcastRun.finished_at == None, BroadcastRun.created_at < cutoff)
+        ).scalars())
+        if run_ids:
+            session.execute(
+                update(Delivery)
+                .where(Delivery.run_id.in_(run_ids), Delivery.status.in_([DELIVERY_PENDING, DELIVERY_SENDING]))
+                .values(status=DELIVERY_FAILED, claim_token=None, last_error='expired')
+                .execution_options(synchronize_session=False)
+            )
+            session.execute(
+                update(BroadcastRun).where(BroadcastRun.id.in_(run_ids)).values(finished_at=now)
+            )
+
+        old_ids = list(session.execute(
+            select(BroadcastRun.id).where(
+                BroadcastRun.finished_at != None,
+                BroadcastRun.created_at < now - timedelta(seconds=retention),
+            )
+        ).scalars())
+        if old_ids:
+            session.execute(delete(Delivery).where(Delivery.run_id.in_(old_ids)))
+            session.execute(delete(BroadcastMessage).where(BroadcastMessage.run_id.in_(old_ids)))
+            session.execute(delete(BroadcastRun).where(BroadcastRun.id.in_(old_ids)))
+        session.commit()
+        return len(run_ids), len(old_ids)
+
+
+def get_broadcast_stats(run_id: int) -> Dict[str, Any]:
+    """
+    Статистика прогона рассылки:
+    - total / pending / sending / done / failed: число строк по статусам
+    - retries: сколько попыток отправки сверх первой было сделано
+    - created_at / finished_at: время создания и завершения прогона
+    """
+    with SessionLocal() as session:
+        run = session.get(BroadcastRun, run_id)
+        if run is None:
+            return {}
+        counts = dict(session.execute(
+            select(Delivery.status, func.count()).where(Delivery.run_id == run_id).group_by(Delivery.status)
+        ).all())
+        retries = session.execute(
+            select(func.coalesce(func.sum(Delivery.attempts - 1), 0))
+            .where(Delivery.run_id == run_id, Delivery.attempts > 1)
+        ).scalar()
+        return {
+            'run_id': run.id,
+            'key': run.key,
+            'shards': run.shards,
+            'total': sum(counts.values()),
+            'pending': counts.get(DELIVERY_PENDING, 0),
+            'sending': counts.get(DELIVERY_SENDING, 0),
+            'done': counts.get(DELIVERY_DONE, 0),
+            'failed': counts.get(DELIVERY_FAILED, 0),
+            'retries': retries,
+            'created_at': run.created_at,
+            'finished_at': run.finished_at,
+        }
+
+
+def insert_ignore(model: Any) -> Optional[Insert]:
+    """
+    INSERT, пропускающий строки с уже существующим ключом, в синтаксисе используемой базы.
+    None, если база такого INSERT не поддерживает.
+    """
+    dialect = engine.dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(model).on_conflict_do_nothing()
+    if dialect == 'sqlite':
+        return sqlite.insert(model).on_conflict_do_nothing()
+    if dialect in ('mysql', 'mariadb'):
+        return insert(model).prefix_with('IGNORE')
+    return None
+
+
+def save_samples(rows: List[Tuple[str, int, int, float]]) -> int:
+    """Записывает замеры (город, метрика, unix-время, значение) одним запросом, дубли пропускаются"""
+    values = [{'city': city, 'metric': metric, 'ts': ts, 'value': value} for city, metric, ts, value in rows]
+    stmt = insert_ignore(CitySample)
+    with SessionLocal() as session:
+        if stmt is not None:
+            session.execute(stmt, values)
+        else:
+            # Прочие базы: строки вставляются по одной, дубль откатывается до точки сохранения
+            for row in values:
+                try:
+                    with session.begin_nested():
+                        session.execute(insert(CitySample), [row])
+                except IntegrityError:
+                    pass
+        session.commit()
+    return len(rows)
+
+
+def get_sample_stats(city: str, metric: int, ranges: List[Tuple[int, int]]) -> Tuple[Optional[float], int]:
+    """Среднее и число замеров города в интервалах [начало, конец) unix-времени"""
+    if not ranges:
+        return None, 0
+    with SessionLocal() as session:
+        average, count = session.execute(
+            select(func.avg(CitySample.value), func.count())
+            .where(
+                CitySample.city == city,
+                CitySample.metric == metric,
+                or_(*[and_(CitySample.ts >= start, CitySample.ts < end) for start, end in ranges]),
+            )
+        ).one()
+        return average, count
+
+
+def prune_samples(max_age: float) -> int:
+    """Удаляет замеры старше max_age секунд, возвращает число удалённых строк"""
+    cutoff = int(time.time() - max_age)
+    with SessionLocal() as session:
+        result = session.execute(delete(CitySample).where(CitySample.ts < cutoff))
+        session.commit()
+        return result.rowcount
+
+
+def acquire_lease(name: str, owner: str, ttl: float) -> bool:
+    """
+    Захватывает или продлевает аренду на ttl секунд.
+
+    Успешно, если аренды ещё нет, она уже принадлежит owner или истекла.
+    Проверка и захват делаются одним UPDATE с условием, поэтому из нескольких
+    процессов, работающих с одной базой, аренду получит только один.
+    """
+    now = datetime.now()
+    expires_at = now + timedelta(seconds=ttl)
+    with SessionLocal() as session:
+        result = session.execute(
+            update(Lease)
+            .where(Lease.name == name, or_(Lease.owner == owner, Lease.expires_at < now))
+            .values(owner=owner, expires_at=expires_at)
+        )
+        if result.rowcount:
+            session.commit()
+            return True
+        session.add(Lease(name=name, owner=owner, expires_at=expires_at))
+        try:
+            session.commit()
+            return True
+        except IntegrityError:
+            # Аренда есть и принадлежит другому процессу
+            session.rollback()
+            return False
+
+
+def get_lease_owners(prefix: str) -> List[str]:
+    """Возвращает владельцев действующих аренд, имя которых начинается с prefix"""
+    with SessionLocal() as session:
+        stmt = select(Lease.owner).where(Lease.name.startswith(prefix), Lease.expires_at >= datetime.now())
+        return list(session.execute(stmt).scalars())
+
+
+def release_lease(name: str, owner: str) -> None:
+    """Освобождает аренду, если она принадлежит owner"""
+    with SessionLocal() as session:
+        session.execute(delete(Lease).where(Lease.name == name, Lease.owner == owner))
+        session.commit()
+
+
+def take_quota(name: str, windows: List[Tuple[str, int, int]]) -> Optional[str]:
+    """
+    Занимает по одному запросу во всех окнах квоты name.
+
+    windows — список (окно, номер периода, лимит), нулевой лимит означает отсутствие ограничения.
+    Окно, период которого сменился, начинает счёт заново. Каждое окно проверяется
+    и увеличивается одним UPDATE с условием, а все окна — в одной транзакции,
+    поэтому процессы, работающие с одной базой, делят общий лимит.
+    Возвращает None при успехе или имя окна, в котором квота исчерпана.
+    """
+    with SessionLocal() as session:
+        for window, period, limit in windows:
+            key = (QuotaUsage.name == name, QuotaUsage.window == window)
+            result = session.execute(
+                update(QuotaUsage).where(*key, QuotaUsage.period < period).values(period=period, used=1)
+            )
+            if result.rowcount:
+                continue
+            conditions = [*key, QuotaUsage.period == period]
+            if limit:
+                conditions.append(QuotaUsage.used < limit)
+            result = session.execute(update(QuotaUsage).where(*conditions).values(used=QuotaUsage.used + 1))
+            if result.rowcount:
+                continue
+            if session.get(QuotaUsage, (name, window)) is not None:
+                session.rollback()
+                return window
+            session.add(QuotaUsage(name=name, window=window, period=period, used=1))
+            try:
+                session.flush()
+            except IntegrityError:
+                # Окно одновременно создал другой процесс: повторяем уже по существующей строке
+                session.rollback()
+                return take_quota(name, windows)
+        session.commit()
+        return None
+
+
+def get_quota_usage(name: str, windows: List[Tuple[str, int]]) -> Dict[str, int]:
+    """Возвращает число занятых запросов в текущем периоде каждого окна квоты name"""
+    periods = dict(windows)
+    with SessionLocal() as session:
+        rows = session.execute(
+            select(QuotaUsage.window, QuotaUsage.period, QuotaUsage.used).where(QuotaUsage.name == name)
+        ).all()
+    usage = {window: 0 for window in periods}
+    for window, period, used in rows:
+        if periods.get(window) == period:
+            usage[window] = used
+    return usage
+
+
+def migrate_sharding(connection: Connection) -> None:
+    """Шарды рассылки: новые колонки и индекс, существующие прогоны считаются одним шардом"""
+    Base.metadata.create_all(connection, tables=[BroadcastMessage.__table__, Lease.__table__])
+    add_missing_columns(connection, BroadcastRun.__table__)
+    add_missing_columns(connection, Delivery.__table__)
+    connection.execute(update(BroadcastRun).where(BroadcastRun.shards == None).values(shards=1))
+    connection.execute(update(Delivery).where(Delivery.shard == None).values(shard=0))
+    connection.execute(text('DROP INDEX IF EXISTS ix_deliveries_claim'))
+    deliveries_claim_index.create(connection, checkfirst=True)
+
+
+class SchemaVersion(Base):
+    """Номер последней применённой миграции схемы"""
+    __tablename__ = 'schema_version'
+
+    version: Mapped[int] = mapped_column(Integer, primary_key=True)
+
+
+def add_missing_columns(connection: Connection, table: Table) -> None:
+    """Добавляет в существующую таблицу колонки, появившиеся в модели"""
+    inspector = inspect(connection)
+    if not inspector.has_table(table.name):
+        return
+    existing = {column['name'] for column in inspector.get_columns(table.name)}
+    for column in table.columns:
+        if column.name not in existing:
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+
+# Миграции схемы: (версия, описание, функция). Новые миграции добавляются в конец.
+# Первая миграция создаёт все недостающие таблицы целиком, поэтому остальные
+# должны спокойно отрабатывать на уже актуальной схеме.
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, 'initial schema', lambda connection: Base.metadata.create_all(connection)),
+    (2, 'chat city id and coordinates', lambda connection: add_missing_columns(connection, Chat.__table__)),
+    (3, 'report index on chats', lambda connection: chats_report_index.create(connection, checkfirst=True)),
+    (4, 'delivery outbox', lambda connection: Base.metadata.create_all(
+        connection, tables=[BroadcastRun.__table__, Delivery.__table__]
+    )),
+    (5, 'broadcast shards and leases', migrate_sharding),
+    (6, 'city samples', lambda connection: Base.metadata.create_all(connection, tables=[CitySample.__table__])),
+    (7, 'shared quota usage', lambda connection: Base.metadata.create_all(connection, tables=[QuotaUsage.__table__])),
+]
+
+
+def get_schema_version(connection: Connection) -> int:
+    if not inspect(connection).has_table(SchemaVersion.__tablename__):
+        return 0
+    version = connection.execute(select(func.max(SchemaVersion.version))).scalar()
+    return version or 0
+
+
+def run_migrations() -> int:
+    """
+    Приводит схему базы к актуальной версии, применяя недостающие миграции по порядку.
+    Возвращает номер версии схемы после обновления.
+    """
+    with engine.begin() as connection:
+        SchemaVersion.__table__.create(connection, checkfirst=True)
+        version = get_schema_version(connection)
+        for number, description, migrate in MIGRATIONS:
+            if number <= version:
+                continue
+            migrate(connection)
+            connection.execute(insert(SchemaVersion).values(version=number))
+            logger.info("Applied migration %d: %s", number, description)
+            version = number
+    return version
+
+
+def get_unresolved_cities() -> List[str]:
+    """Возвращает города чатов, для которых ещё не сохранён id города"""
+    with SessionLocal() as session:
+        stmt = select(Chat.city).where(Chat.city_id == None).distinct()
+        return list(session.execute(stmt).scalars())
+
+
+def set_city_location(city_name: str, city_id: int, lat: float, lon: float) -> int:
+    """Проставляет id и координаты всем чатам с указанным городом"""
+    with SessionLocal() as session:
+        result = session.execute(
+            update(Chat)
+            .where(Chat.city == city_name, Chat.city_id == None)
+            .values(city_id=city_id, lat=lat, lon=lon)
+        )
+        session.commit()
+        return result.rowcount
+
+
+def backfill_city_locations() -> None:
+    """Определяет id и координаты городов у чатов, сохранённых до их появления"""
+    from services.quota import BATCH
+    from services.weather import resolve_city
+
+    for city_name in get_unresolved_cities():
+        place = resolve_city(city_name, BATCH)
+        if place and place['city_id'] is not None:
+            updated = set_city_location(city_name, place['city_id'], place['lat'], place['lon'])
+            print(f"{city_name}: city_id={place['city_id']} ({updated} чатов)")
+        else:
+            print(f"{city_name}: не удалось определить город")
+
 
 if __name__ == '__main__':
-    Base.metadata.create_all(engine)
+    run_migrations()
+    backfill_city_locations()
@@ -0,0 +1,103 @@
+"""Тексты ответов бота, общие для синхронного и асинхронного запуска"""
+
+WELCOME = (
+    "👋 Привет! Я информационный бот.\n\n"
+    "📋 Что я умею:\n"
+    "• 🌤 Ежедневная утренняя рассылка с погодой и пробками\n"
+    "• 🌡 Текущая погода по команде /weather\n"
+    "• 🚗 Текущие пробки по команде /traffic\n"
+    "• 🏙 Выбор вашего города: /set_city\n"
+    "• ⏸ Управление рассылкой: /stop и /resume\n\n"
+    "📍 Город по умолчанию: Москва\n"
+    "🕐 Рассылка приходит каждое утро в 7:00 (по Мск)\n\n"
+    "Для изменения города используйте:\n"
+    "/set_city Название"
+)
+
+SAVE_FAILED = "❌ Не удалось сохранить данные. Попробуйте позже."
+
+ALREADY_ACTIVE = (
+    "✅ Бот уже активен!\n"
+    "Доступные команды:\n"
+    "/set_city — изменить город\n"
+    "/weather — текущая погода\n"
+    "/traffic — текущие пробки\n"
+    "/stop — остановить рассылку\n"
+    "/resume — возобновить рассылку"
+)
+
+START_FAILED = "⚠️ Что-то пошло не так при активации. Админу отправлен отчёт."
+
+SET_CITY_USAGE = (
+    "📌 Укажите город после команды:\n"
+    "/set_city Москва\n"
+    "/set_city Krasnodar"
+)
+
+EMPTY_CITY = "❌ Название города не может быть пустым."
+
+SET_CITY_FAILED = "⚠️ Не удалось проверить город. Попробуйте позже."
+
+NOT_STARTED = "❌ Сначала активируйте бота командой /start"
+
+NOT_ACTIVATED = (
+    "❌ Бот не активирован.\n"
+    "Сначала активируйте бота командой /start"
+)
+
+REPORTS_STOPPED = (
+    "⏸ Ежедневная рассылка остановлена.\n\n"
+    "Бот остаётся активным, вы можете:\n"
+    "• /weather — узнать текущую погоду\n"
+    "• /set_city — изменить город\n"
+    "• /resume — возобновить рассылку"
+)
+
+STOP_FAILED = "⚠️ Не удалось остановить рассылку. Попробуйте позже."
+
+REPORTS_RESUMED = (
+    "✅ Ежедневная рассылка возобновлена!\n\n"
+    "🕐 Отчёт будет приходить каждое утро в 7:00 (по Мск)\n"
+    "Для остановки используйте /stop"
+)
+
+RESUME_FAILED = "⚠️ Не удалось возобновить рассылку. Попробуйте позже."
+
+WEATHER_FAILED = "❌ Не удалось получить данные о погоде. Попробуйте позже."
+
+TRAFFIC_FAILED = "❌ Не удалось получить данные о пробках. Попробуйте позже."
+TOO_MANY_REQUESTS = "⏳ Слишком много запросов. Попробуйте через минуту."
+
+
+def searching_city(city_name: str) -> str:
+    return f"🔍 Ищу город «{city_name}»..."
+
+
+def city_not_found(city_name: str) -> str:
+    return (
+        f"❌ Город «{city_name}» не найден.\n"
+        "Попробуйте:\n"
+        "• Проверить орфографию\n"
+        "• Использовать полное название (например: Санкт-Петербург)\n"
+        "• Написать на русском или английском"
+    )
+
+
+def city_saved(city_name: str) -> str:
+    return f"✅ Отлично! Теперь я буду присылать данные для: {city_name}"
+
+
+def weather_text(weather: dict) -> str:
+    return (
+        f'🌡 В городе {weather["city"]}: {weather["temp"]}°C\n'
+        f'🤔 Ощущается как {weather["feels_like"]}°C\n'
+        f'☁️ {weather["description"]}'
+    )
+
+
+def traffic_text(city: str, traffic: dict) -> str:
+    return (
+        f'🚗 Пробки в городе {city.capitalize()}\n'
+        f'📊 Уровень: {traffic["level"]}/10\n'
+        f'📝 {traffic["description"]}'
+    )
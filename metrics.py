@@ -0,0 +1,406 @@
+"""
+Встроенные метрики бота в формате Prometheus.
+
+- Counter и Histogram с метками, общий реестр REGISTRY
+- готовые метрики внешних запросов, базы, этапов отчёта и обработчиков команд
+- статистика кэшей через register_cache
+- HTTP-эндпоинт /metrics (start_metrics_server) и семплирующий профайлер /debug/profile
+"""
+import asyncio
+import functools
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter as StackCounter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм по умолчанию, сек
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class Metric:
+    """Общая часть метрик: имя, описание и имена меток"""
+
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(Metric):
+    """Монотонно растущий счётчик"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: Any) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {value}')
+        return lines
+
+
+class Histogram(Metric):
+    """Гистограмма значений (обычно длительностей в секундах) с фиксированными корзинами"""
+
+    kind = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # метки -> [счётчики корзин..., сумма, количество]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: Any) -> int:
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return int(state[-1]) if state else 0
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, state):
+                    cumulative += count
+                    labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                    lines.append(f'{self.name}_bucket{labels} {cumulative}')
+                labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+                lines.append(f'{self.name}_bucket{labels} {state[-1]}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {state[-2]}')
+                lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {state[-1]}')
+        return lines
+
+
+class Registry:
+    """Реестр метрик и функций, которые добавляют строки при каждом запросе /metrics"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable[[], List[str]]] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'Метрика {metric.name} уже зарегистрирована')
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], List[str]]) -> None:
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collector in collectors:
+            try:
+                lines.extend(collector())
+            except Exception as e:
+                logger.warning("Metrics collector failed: %s", e)
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+UPSTREAM_SECONDS = REGISTRY.histogram(
+    'bot_upstream_request_seconds', 'Длительность запросов к внешним сервисам', ['service', 'endpoint']
+)
+UPSTREAM_ERRORS = REGISTRY.counter(
+    'bot_upstream_errors_total', 'Ошибки запросов к внешним сервисам', ['service', 'endpoint', 'reason']
+)
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    'bot_db_query_seconds', 'Длительность запросов к базе', ['operation'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+DB_ERRORS = REGISTRY.counter('bot_db_errors_total', 'Ошибки запросов к базе', ['operation'])
+REPORT_STAGE_SECONDS = REGISTRY.histogram(
+    'bot_report_stage_seconds', 'Длительность этапов утреннего отчёта', ['stage'],
+    buckets=(0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0),
+)
+BROADCAST_MESSAGES = REGISTRY.counter(
+    'bot_broadcast_messages_total', 'Сообщения рассылки по результату отправки', ['result']
+)
+HANDLER_SECONDS = REGISTRY.histogram(
+    'bot_handler_seconds', 'Длительность обработки команд', ['command']
+)
+HANDLER_ERRORS = REGISTRY.counter(
+    'bot_handler_errors_total', 'Необработанные исключения в обработчиках команд', ['command']
+)
+DISPATCH_UPDATES = REGISTRY.counter(
+    'bot_dispatcher_updates_total', 'Обновления диспетчера команд: приняты, отброшены, упали', ['result']
+)
+DISPATCH_QUEUE_WAIT = REGISTRY.histogram(
+    'bot_dispatcher_queue_wait_seconds', 'Время ожидания обновления в очереди диспетчера до начала обработки'
+)
+LOG_RECORDS_DROPPED = REGISTRY.counter(
+    'bot_log_records_dropped_total', 'Записи журнала ошибок, не попавшие в файл', ['reason']
+)
+TRAFFIC_FALLBACKS = REGISTRY.counter(
+    'bot_traffic_fallback_total', 'Оценки пробок по времени суток вместо OSRM', ['reason']
+)
+
+
+def track_handler(command: str) -> Callable:
+    """Декоратор обработчика команды: длительность и необработанные исключения"""
+    def decorator(handler: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(handler):
+            @functools.wraps(handler)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await handler(*args, **kwargs)
+                except Exception:
+                    HANDLER_ERRORS.inc(command=command)
+                    raise
+                finally:
+                    HANDLER_SECONDS.observe(time.perf_counter() - started, command=command)
+            return async_wrapper
+
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return handler(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(command=command)
+                raise
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - started, command=command)
+        return wrapper
+    return decorator
+
+
+# Кэши, статистика которых публикуется в /metrics: имя -> объект с методом stats()
+_caches: Dict[str, Any] = {}
+
+# Счётчики из TTLCache.stats(), публикуемые как bot_cache_<ключ>_total
+CACHE_COUNTERS = ('hits', 'stale_hits', 'misses', 'evictions', 'loads', 'coalesced', 'wait_timeouts')
+
+
+def register_cache(name: str, cache: Any) -> None:
+    """Публикует счётчики кэша (объекта с методом stats(), например TTLCache)"""
+    _caches[name] = cache
+
+
+def _collect_caches() -> List[str]:
+    # Строки одной метрики в формате Prometheus должны идти подряд, поэтому группируем по метрике
+    stats = {name: cache.stats() for name, cache in sorted(_caches.items())}
+    lines = ['# HELP bot_cache_size Записей в кэше', '# TYPE bot_cache_size gauge']
+    lines += [f'bot_cache_size{{cache="{name}"}} {values["size"]}' for name, values in stats.items()]
+    for key in CACHE_COUNTERS:
+        lines += [f'# HELP bot_cache_{key}_total Счётчик {key} кэша', f'# TYPE bot_cache_{key}_total counter']
+        lines += [
+            f'bot_cache_{key}_total{{cache="{name}"}} {values.get(key, 0)}' for name, values in stats.items()
+        ]
+    lines += ['# HELP bot_cache_hit_ratio Доля обращений, обслуженных кэшем', '# TYPE bot_cache_hit_ratio gauge']
+    for name, values in stats.items():
+        hits = values['hits'] + values['stale_hits']
+        lookups = hits + values['misses']
+        lines.append(f'bot_cache_hit_ratio{{cache="{name}"}} {hits / lookups if lookups else 0.0:.4f}')
+    return lines
+
+
+REGISTRY.add_collector(_collect_caches)
+
+
+class SamplingProfiler:
+    """
+    Семплирующий профайлер: каждые interval секунд снимает стеки всех потоков.
+    Результат — свёрнутые стеки (формат flamegraph.pl / speedscope): «a;b;c количество».
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: StackCounter = StackCounter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                    frame = frame.f_back
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def collapsed(self) -> str:
+        return '\n'.join(f'{stack} {count}' for stack, count in self.samples.most_common()) + '\n'
+
+
+_profile_lock = threading.Lock()
+
+
+def profile(seconds: float, interval: float = 0.01) -> str:
+    """Профилирует процесс seconds секунд и возвращает свёрнутые стеки; одновременно — один замер"""
+    if not _profile_lock.acquire(blocking=False):
+        raise RuntimeError('Профайлер уже запущен')
+    try:
+        profiler = SamplingProfiler(interval)
+        profiler.start()
+        time.sleep(seconds)
+        profiler.stop()
+        return profiler.collapsed()
+    finally:
+        _profile_lock.release()
+
+
+def handle_request(path: str) -> Tuple[int, str, str]:
+    """
+    Отвечает на запросы к метрикам: возвращает (статус, content-type, тело).
+    /metrics — метрики Prometheus; /debug/profile?seconds=N — профиль,
+    если он включён через PROFILER_ENABLED.
+    """
+    parsed = urlsplit(path)
+    if parsed.path == '/metrics':
+        return 200, 'text/plain; version=0.0.4; charset=utf-8', REGISTRY.render()
+    if parsed.path == '/debug/profile' and Config.PROFILER_ENABLED:
+        query = parse_qs(parsed.query)
+        try:
+            seconds = float(query.get('seconds', ['10'])[0])
+            interval = float(query.get('interval', ['0.01'])[0])
+        except ValueError:
+            seconds = interval = math.nan
+        if not (math.isfinite(seconds) and math.isfinite(interval) and seconds > 0 and interval > 0):
+            return 400, 'text/plain; charset=utf-8', 'seconds and interval must be positive numbers\n'
+        seconds = min(seconds, 60)
+        interval = max(interval, 0.001)
+        try:
+            return 200, 'text/plain; charset=utf-8', profile(seconds, interval)
+        except RuntimeError as e:
+            return 409, 'text/plain; charset=utf-8', f'{e}\n'
+    return 404, 'text/plain; charset=utf-8', 'not found\n'
+
+
+def start_metrics_server(host: str, port: int) -> Optional[ThreadingHTTPServer]:
+    """Запускает в фоне HTTP-сервер метрик; None, если порт не задан или занят"""
+    if not port:
+        return None
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            status, content_type, body = handle_request(self.path)
+            payload = body.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        # Например, на машине уже работает другой процесс бота
+        logger.warning("Metrics server not started on %s:%d: %s", host, port, e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logger.info("Metrics server listening on http://%s:%d/metrics", host, port)
+    return server
@@ -0,0 +1,265 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from metrics import BROADCAST_MESSAGES
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Потокобезопасный token bucket: не больше rate операций в секунду"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._fixed_capacity = capacity is not None
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate: float) -> None:
+        """Меняет скорость; ёмкость, не заданная явно, следует за ней"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self.rate = rate
+            if not self._fixed_capacity:
+                self.capacity = rate
+                self._tokens = min(self._tokens, rate)
+
+    def pause(self, seconds: float) -> None:
+        """Останавливает выдачу токенов (например, после 429 от Telegram)"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+    def acquire(self) -> None:
+        """Блокирует поток, пока не освободится токен"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class ChatRateLimiter:
+    """Минимальный интервал между сообщениями в один групповой чат"""
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute
+        self._next_allowed: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, chat_id: int) -> None:
+        # У групп и каналов chat_id отрицательный, личные чаты не ограничиваем
+        if chat_id >= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_allowed.get(chat_id, now))
+            self._next_allowed[chat_id] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+# Чат недоступен навсегда: чат деактивируется
+PERMANENT = 'permanent'
+# Telegram отклонил само сообщение (например, слишком длинное): повтор бесполезен,
+# но чат остаётся активным
+REJECTED = 'rejected'
+TRANSIENT = 'transient'
+
+# Фрагменты описания ошибки 400, означающие, что чата больше нет
+CHAT_GONE_DESCRIPTIONS = (
+    'chat not found',
+    'group chat was deleted',
+    'user is deactivated',
+    'peer_id_invalid',
+)
+
+
+def error_parameters(e: Exception) -> Dict[str, Any]:
+    """Возвращает поле parameters из ответа Telegram с ошибкой"""
+    result_json = getattr(e, 'result_json', None) or {}
+    return result_json.get('parameters') or {}
+
+
+def classify_error(e: Exception) -> str:
+    """
+    Классифицирует ошибку отправки по ответу Telegram.
+    403 (бота заблокировали или исключили) и 400 об удалённом или не найденном чате —
+    постоянные, прочие 400 — отклонённое сообщение. Сетевые ошибки, 429 и 5xx временные.
+    """
+    error_code = getattr(e, 'error_code', None)
+    if error_code == 403:
+        return PERMANENT
+    if error_code == 400:
+        description = (getattr(e, 'description', None) or '').lower()
+        if any(fragment in description for fragment in CHAT_GONE_DESCRIPTIONS):
+            return PERMANENT
+        return REJECTED
+    return TRANSIENT
+
+
+def get_migrate_to_chat_id(e: Exception) -> Optional[int]:
+    """Возвращает новый chat_id группы, ставшей супергруппой, иначе None"""
+    if getattr(e, 'error_code', None) != 400:
+        return None
+    migrate_to_chat_id = error_parameters(e).get('migrate_to_chat_id')
+    return int(migrate_to_chat_id) if migrate_to_chat_id else None
+
+
+def get_retry_after(e: Exception) -> Optional[int]:
+    """Возвращает retry_after из ответа Telegram с кодом 429, иначе None"""
+    if getattr(e, 'error_code', None) != 429:
+        return None
+    return int(error_parameters(e).get('retry_after', 1))
+
+
+class Broadcaster:
+    """
+    Параллельная рассылка сообщений через пул потоков.
+
+    - глобальный token bucket ограничивает общую скорость (лимит Telegram ~30 msg/s);
+      если задан peers, перед каждым запуском rate делится на число отправляющих процессов
+    - для групповых чатов соблюдается отдельный лимит сообщений в минуту
+    - на 429 рассылка приостанавливается на retry_after и сообщение отправляется повторно
+    - если группа стала супергруппой, вызывается on_migrate(старый id, новый id)
+      и сообщение сразу отправляется по новому id
+    - прочие временные ошибки повторяются с экспоненциальной задержкой,
+      постоянные сразу передаются в on_failure
+    """
+
+    def __init__(
+        self,
+        send: Callable[[int, str], Any],
+        workers: int = 8,
+        rate: float = 30,
+        group_rate: float = 20,
+        max_retries: int = 3,
+        on_failure: Optional[Callable[[int, Exception], None]] = None,
+        peers: Optional[Callable[[], int]] = None,
+        on_migrate: Optional[Callable[[int, int], None]] = None,
+    ):
+        self.send = send
+        self.workers = workers
+        self.rate = rate
+        self.peers = peers
+        self.bucket = TokenBucket(rate)
+        self.chat_limiter = ChatRateLimiter(group_rate)
+        self.max_retries = max_retries
+        self.on_failure = on_failure
+        self.on_migrate = on_migrate
+        self._stats_lock = threading.Lock()
+
+    def _deliver(
+        self,
+        chat_id: int,
+        text: str,
+        stats: Dict[str, Any],
+        on_success: Optional[Callable[[int], None]],
+        on_failure: Optional[Callable[[int, Exception], None]],
+    ) -> None:
+        # Колбэки получают исходный chat_id, даже если отправка ушла по новому id
+        target = chat_id
+        attempt = 0
+        while True:
+            self.chat_limiter.acquire(target)
+            self.bucket.acquire()
+            try:
+                self.send(target, text)
+                with self._stats_lock:
+                    stats['sent'] += 1
+                BROADCAST_MESSAGES.inc(result='sent')
+                if on_success:
+                    on_success(chat_id)
+                return
+            except Exception as e:
+                migrate_to_chat_id = get_migrate_to_chat_id(e)
+                if migrate_to_chat_id is not None and target != migrate_to_chat_id:
+                    if self.on_migrate:
+                        self.on_migrate(target, migrate_to_chat_id)
+                    target = migrate_to_chat_id
+                    with self._stats_lock:
+                        stats['migrated'] += 1
+                    BROADCAST_MESSAGES.inc(result='migrated')
+                    # Повтор по новому id не расходует попытку
+                    continue
+                kind = classify_error(e)
+                if kind != TRANSIENT or attempt == self.max_retries:
+                    with self._stats_lock:
+                        stats['failed'] += 1
+                        stats[f'failed_{kind}'] += 1
+                    BROADCAST_MESSAGES.inc(result=f'failed_{kind}')
+                    if self.on_failure:
+                        self.on_failure(chat_id, e)
+                    if on_failure:
+                        on_failure(chat_id, e)
+                    return
+                with self._stats_lock:
+                    stats['retried'] += 1
+                BROADCAST_MESSAGES.inc(result='retried')
+                retry_after = get_retry_after(e)
+                if retry_after is not None:
+                    # Flood control в Telegram действует на всего бота, поэтому ждут все потоки
+                    self.bucket.pause(retry_after)
+                else:
+                    time.sleep(2 ** attempt)
+                attempt += 1
+
+    def run(
+        self,
+        messages: Iterable[Tuple[int, str]],
+        on_success: Optional[Callable[[int], None]] = None,
+        on_failure: Optional[Callable[[int, Exception], None]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Отправляет все пары (chat_id, текст) и возвращает статистику рассылки.
+        on_success и on_failure вызываются для каждого сообщения этого запуска
+        (on_failure — в дополнение к общему обработчику из конструктора).
+        """
+        stats = {
+            'sent': 0, 'failed': 0, 'failed_permanent': 0, 'failed_rejected': 0, 'failed_transient': 0,
+            'retried': 0, 'migrated': 0,
+        }
+        if self.peers is not None:
+            # Лимит Telegram общий для бота, поэтому процессы делят его поровну
+            self.bucket.set_rate(self.rate / max(1, self.peers()))
+        # Не даём очереди задач разрастись: не больше двух задач на поток
+        slots = threading.BoundedSemaphore(self.workers * 2)
+
+        def task(chat_id: int, text: str) -> None:
+            try:
+                self._deliver(chat_id, text, stats, on_success, on_failure)
+            finally:
+                slots.release()
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='broadcast') as pool:
+            for chat_id, text in messages:
+                slots.acquire()
+                pool.submit(task, chat_id, text)
+
+        duration = time.monotonic() - started
+        stats['duration'] = duration
+        stats['throughput'] = stats['sent'] / duration if duration > 0 else 0.0
+        logger.info(
+            "Broadcast finished: sent=%d failed=%d (permanent=%d, rejected=%d, transient=%d) "
+            "retried=%d migrated=%d in %.2fs (%.1f msg/s)",
+            stats['sent'], stats['failed'], stats['failed_permanent'], stats['failed_rejected'],
+            stats['failed_transient'], stats['retried'], stats['migrated'], duration, stats['throughput']
+        )
+        return stats
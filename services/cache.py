@@ -0,0 +1,206 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from services.singleflight import SingleFlight
+
+FRESH = 'fresh'
+STALE = 'stale'
+MISS = 'miss'
+
+# Фоновые обновления устаревших записей всех кэшей выполняет общий пул:
+# при массовом устаревании число потоков не растёт, лишние обновления ждут в очереди
+REFRESH_WORKERS = 4
+_refresh_pool: Optional[ThreadPoolExecutor] = None
+_refresh_pool_lock = threading.Lock()
+
+
+def get_refresh_pool() -> ThreadPoolExecutor:
+    global _refresh_pool
+    with _refresh_pool_lock:
+        if _refresh_pool is None:
+            _refresh_pool = ThreadPoolExecutor(max_workers=REFRESH_WORKERS, thread_name_prefix='cache-refresh')
+        return _refresh_pool
+
+
+class TTLCache:
+    """
+    Потокобезопасный кэш с ограничением размера (LRU) и временем жизни записей.
+
+    Запись считается свежей ttl секунд, затем ещё stale_ttl секунд отдаётся
+    как устаревшая (stale-while-revalidate), после чего удаляется.
+    ttl=None отключает устаревание — остаётся обычный LRU-кэш.
+    Одновременные промахи по одному ключу загружаются один раз; остальные вызовы
+    ждут результата не дольше wait_timeout секунд (None — без ограничения).
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float], stale_ttl: float = 0, wait_timeout: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._flight = SingleFlight(wait_timeout)
+        self._data: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self._refreshing = set()
+        self._tasks = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, key: Hashable) -> Tuple[Any, str]:
+        """Возвращает (значение, состояние), где состояние — FRESH, STALE или MISS"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, MISS
+            value, stored_at = entry
+            age = time.monotonic() - stored_at
+            if self.ttl is None or age < self.ttl:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value, FRESH
+            if age < self.ttl + self.stale_ttl:
+                self._data.move_to_end(key)
+                self.stale_hits += 1
+                return value, STALE
+            del self._data[key]
+            self.misses += 1
+            return None, MISS
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Возвращает значение (свежее или устаревшее) либо default"""
+        value, state = self.lookup(key)
+        return default if state == MISS else value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def get_or_load(
+        self,
+        key: Hashable,
+        loader: Callable[[], Any],
+        cacheable: Callable[[Any], bool] = lambda value: True,
+        flight_key: Optional[Hashable] = None,
+    ) -> Any:
+        """
+        Возвращает значение из кэша или загружает его через loader.
+        Устаревшее значение отдаётся сразу, а обновление запускается в фоне.
+        Результат сохраняется, только если cacheable(result) истинно.
+        Загрузки объединяются по flight_key (по умолчанию — ключ кэша): так вызовы,
+        которые нельзя заставлять ждать друг друга, загружают значение раздельно.
+        Если ожидание чужой загрузки превысило wait_timeout, выбрасывает FlightTimeoutError.
+        """
+        value, state = self.lookup(key)
+        if state == FRESH:
+            return value
+        if state == STALE:
+            self._refresh_in_background(key, loader, cacheable)
+            return value
+
+        def load() -> Any:
+            value = loader()
+            if cacheable(value):
+                self.set(key, value)
+            return value
+
+        return self._flight.do(key if flight_key is None else flight_key, load)
+
+    async def get_or_load_async(
+        self,
+        key: Hashable,
+        loader: Callable[[], Awaitable[Any]],
+        cacheable: Callable[[Any], bool] = lambda value: True,
+        flight_key: Optional[Hashable] = None,
+    ) -> Any:
+        """Асинхронная версия get_or_load: loader возвращает корутину"""
+        value, state = self.lookup(key)
+        if state == FRESH:
+            return value
+        if state == STALE:
+            self._refresh_in_task(key, loader, cacheable)
+            return value
+
+        async def load() -> Any:
+            value = await loader()
+            if cacheable(value):
+                self.set(key, value)
+            return value
+
+        return await self._flight.do_async(key if flight_key is None else flight_key, load)
+
+    def _refresh_in_task(self, key: Hashable, loader: Callable[[], Awaitable[Any]], cacheable: Callable[[Any], bool]) -> None:
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        async def refresh() -> None:
+            try:
+                value = await loader()
+                if cacheable(value):
+                    self.set(key, value)
+            except Exception:
+                pass
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+                self._tasks.discard(task)
+
+        task = asyncio.get_running_loop().create_task(refresh())
+        # Держим ссылку на задачу, чтобы её не собрал сборщик мусора
+        self._tasks.add(task)
+
+    def _refresh_in_background(self, key: Hashable, loader: Callable[[], Any], cacheable: Callable[[Any], bool]) -> None:
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh() -> None:
+            try:
+                value = loader()
+                if cacheable(value):
+                    self.set(key, value)
+            except Exception:
+                pass
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        get_refresh_pool().submit(refresh)
+
+    def stats(self) -> Dict[str, int]:
+        """Счётчики попаданий и промахов"""
+        flight = self._flight.stats()
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'loads': flight['executed'],
+                'coalesced': flight['shared'],
+                'wait_timeouts': flight['timeouts'],
+            }
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -0,0 +1,15 @@
+import re
+
+_SEPARATORS = re.compile(r"[\s\-‐‑–—_]+")
+
+
+def normalize_city(city_name: str) -> str:
+    """
+    Приводит название города к единому ключу.
+    Используется для группировки чатов и ключей кэшей:
+    «Ростов-на-Дону», «ростов на дону» и « Ростов-На-Дону » дают один ключ.
+    """
+    if not city_name:
+        return ""
+    name = city_name.strip().lower().replace("ё", "е")
+    return _SEPARATORS.sub(" ", name).strip()
@@ -0,0 +1,106 @@
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import logging
+import socket
+import threading
+import uuid
+from typing import Callable, Optional
+
+from config import Config
+from database import acquire_lease, get_lease_owners, log_exception, release_lease
+
+logger = logging.getLogger(__name__)
+
+# Имя текущего процесса в арендах
+NODE_ID = Config.NODE_ID or f"{socket.gethostname()}:{os.getpid()}"
+
+# Префикс аренд шардов рассылки
+SHARD_LEASE_PREFIX = 'broadcast:'
+
+
+def shard_lease_owner() -> str:
+    """
+    Владелец аренды шарда для одной отправки: имя процесса и случайный токен.
+    Две отправки внутри одного процесса (например, отчёт и досылка) получают
+    разных владельцев, поэтому не заберут один шард и не освободят чужую аренду.
+    """
+    return f"{NODE_ID}/{uuid.uuid4().hex}"
+
+
+def count_sending_nodes() -> int:
+    """Число процессов, которые сейчас держат аренды шардов рассылки (не меньше 1)"""
+    try:
+        owners = get_lease_owners(SHARD_LEASE_PREFIX)
+    except Exception as e:
+        log_exception(e)
+        return 1
+    return max(1, len({owner.rsplit('/', 1)[0] for owner in owners}))
+
+
+class LeaderElection:
+    """
+    Выбор лидера через аренду в базе.
+
+    Каждый процесс периодически пытается захватить или продлить аренду name.
+    Получивший её вызывает on_elected, потерявший — on_demoted. Если лидер
+    перестал продлевать аренду (процесс упал), через ttl секунд её забирает другой.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ttl: float,
+        on_elected: Callable[[], None],
+        on_demoted: Callable[[], None],
+        owner: Optional[str] = None,
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.owner = owner or NODE_ID
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.is_leader = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _check(self) -> None:
+        try:
+            leader = acquire_lease(self.name, self.owner, self.ttl)
+        except Exception as e:
+            # Без доступа к базе аренду продлить нельзя — считаем, что лидерство потеряно
+            log_exception(e, lease=self.name)
+            leader = False
+
+        if leader and not self.is_leader:
+            self.is_leader = True
+            logger.info("%s became leader of %s", self.owner, self.name)
+            self.on_elected()
+        elif not leader and self.is_leader:
+            self.is_leader = False
+            logger.info("%s lost leadership of %s", self.owner, self.name)
+            self.on_demoted()
+
+    def _run(self) -> None:
+        # Продлеваем аренду заранее, с запасом на медленную базу
+        while not self._stop.wait(self.ttl / 3):
+            self._check()
+
+    def start(self) -> None:
+        self._check()
+        self._thread = threading.Thread(target=self._run, name=f'leader-{self.name}', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Останавливает выборы и освобождает аренду, чтобы лидером сразу стал другой процесс"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        if self.is_leader:
+            self.is_leader = False
+            self.on_demoted()
+            try:
+                release_lease(self.name, self.owner)
+            except Exception as e:
+                log_exception(e, lease=self.name)
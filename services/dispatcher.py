@@ -0,0 +1,116 @@
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Hashable, List, Tuple
+
+from database import log_exception
+from metrics import DISPATCH_QUEUE_WAIT, DISPATCH_UPDATES, REGISTRY
+
+logger = logging.getLogger(__name__)
+
+
+class ChatDispatcher:
+    """
+    Пул обработчиков с сохранением порядка внутри чата.
+
+    Задачи одного чата выполняются строго по очереди, задачи разных чатов — параллельно
+    в workers потоках. Медленная команда занимает один поток и задерживает только свой чат.
+    Чаты с несколькими задачами обслуживаются по кругу, поэтому активный чат не вытесняет остальные.
+    Всего в очереди не больше queue_size задач; новые задачи сверх лимита отбрасываются.
+    """
+
+    def __init__(self, handle: Callable[[Any], None], workers: int, queue_size: int, name: str = 'dispatcher'):
+        self.handle = handle
+        self.workers = workers
+        self.queue_size = queue_size
+        self.name = name
+        # chat -> задачи в порядке поступления: (время постановки, задача).
+        # Чат есть в словаре, пока он стоит в _ready или его задачу выполняет поток.
+        self._pending: Dict[Hashable, Deque[Tuple[float, Any]]] = {}
+        self._ready: "queue.Queue[Hashable]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self.size = 0
+        self.shed = 0
+        REGISTRY.add_collector(self._collect)
+
+    def submit(self, chat: Hashable, task: Any) -> bool:
+        """Ставит задачу в очередь чата; False, если очередь заполнена и задача отброшена"""
+        self._ensure_started()
+        with self._lock:
+            if self.size >= self.queue_size:
+                self.shed += 1
+                DISPATCH_UPDATES.inc(result='shed')
+                return False
+            self.size += 1
+            entry = (time.monotonic(), task)
+            tasks = self._pending.get(chat)
+            if tasks is None:
+                self._pending[chat] = deque([entry])
+                self._ready.put(chat)
+            else:
+                # Чат уже в работе: задача выполнится после предыдущих
+                tasks.append(entry)
+        DISPATCH_UPDATES.inc(result='accepted')
+        return True
+
+    def _worker(self) -> None:
+        while True:
+            chat = self._ready.get()
+            with self._lock:
+                enqueued_at, task = self._pending[chat][0]
+            DISPATCH_QUEUE_WAIT.observe(time.monotonic() - enqueued_at)
+            try:
+                self.handle(task)
+            except Exception as e:
+                DISPATCH_UPDATES.inc(result='failed')
+                log_exception(e, chat_id=chat)
+            finally:
+                with self._lock:
+                    tasks = self._pending[chat]
+                    tasks.popleft()
+                    self.size -= 1
+                    if tasks:
+                        self._ready.put(chat)
+                    else:
+                        del self._pending[chat]
+
+    def _ensure_started(self) -> None:
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for number in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f'{self.name}-{number}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            logger.info("Dispatcher %s started: %d workers, queue %d", self.name, self.workers, self.queue_size)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'queued': self.size,
+                'chats': len(self._pending),
+                'capacity': self.queue_size,
+                'workers': self.workers,
+                'shed': self.shed,
+            }
+
+    def _collect(self) -> List[str]:
+        stats = self.stats()
+        label = f'{{dispatcher="{self.name}"}}'
+        return [
+            '# HELP bot_dispatcher_queue_depth Задач в очереди диспетчера',
+            '# TYPE bot_dispatcher_queue_depth gauge',
+            f'bot_dispatcher_queue_depth{label} {stats["queued"]}',
+            '# HELP bot_dispatcher_busy_chats Чатов с задачами в очереди или в работе',
+            '# TYPE bot_dispatcher_busy_chats gauge',
+            f'bot_dispatcher_busy_chats{label} {stats["chats"]}',
+        ]
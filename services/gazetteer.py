@@ -0,0 +1,190 @@
+"""
+Офлайн-справочник городов.
+
+Данные лежат в services/data/cities.tsv (id, name, alternatenames, lat, lon, population)
+и загружаются при первом обращении. Поиск идёт по индексу нормализованных названий:
+кириллица транслитерируется в латиницу, ё приравнивается к е, дефисы — к пробелам,
+поэтому «Ростов-на-Дону», «ростов на дону» и «Rostov-na-Donu» дают один ключ.
+
+В репозитории лежит базовый набор крупных городов с пустым id: id OpenWeatherMap
+для них определяется запросом погоды по координатам. Полный справочник с id
+собирается из выгрузки GeoNames (например, cities15000.txt):
+    python services/gazetteer.py build cities15000.txt [RU,BY,KZ ...]
+Замер скорости загрузки и поиска:
+    python services/gazetteer.py bench
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import bisect
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+from services.cities import normalize_city
+
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), 'data', 'cities.tsv')
+
+_TRANSLIT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh',
+    'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o',
+    'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts',
+    'ч': 'ch', 'ш': 'sh', 'щ': 'shch', 'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu',
+    'я': 'ya', 'і': 'i', 'ї': 'yi', 'є': 'ye', 'ґ': 'g', "'": '', '’': '',
+}
+
+# Разные системы транслитерации пишут одни и те же звуки по-разному
+# (Yekaterinburg / Ekaterinburg, Nizhniy / Nizhny, Oryol / Orel), сводим их к одному виду
+_FOLDS = [('iy', 'y'), ('yy', 'y'), ('kh', 'h'), ('ye', 'e'), ('yo', 'e')]
+
+
+class Place(NamedTuple):
+    """Город из справочника"""
+    city_id: Optional[int]
+    name: str
+    lat: float
+    lon: float
+    population: int
+
+
+def make_key(name: str) -> str:
+    """Строит ключ индекса: нормализация, транслитерация и выравнивание вариантов написания"""
+    key = ''.join(_TRANSLIT.get(char, char) for char in normalize_city(name))
+    for variant, replacement in _FOLDS:
+        key = key.replace(variant, replacement)
+    return key
+
+
+class Gazetteer:
+    """Индекс городов по нормализованным названиям с поиском по префиксу"""
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        self._index: Dict[str, Place] = {}
+        self._keys: List[str] = []
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            index: Dict[str, Place] = {}
+            with open(self.path, encoding='utf-8') as f:
+                next(f)  # заголовок
+                for line in f:
+                    city_id, name, alternatenames, lat, lon, population = line.rstrip('\n').split('\t')
+                    place = Place(int(city_id) if city_id else None, name, float(lat), float(lon), int(population or 0))
+                    for variant in [name, *alternatenames.split(',')]:
+                        key = make_key(variant)
+                        if not key:
+                            continue
+                        # При совпадении названий выбираем более крупный город
+                        known = index.get(key)
+                        if known is None or known.population < place.population:
+                            index[key] = place
+            self._index = index
+            self._keys = sorted(index)
+            self._loaded = True
+
+    def lookup(self, name: str) -> Optional[Place]:
+        """Ищет город по точному (после нормализации) названию"""
+        self._ensure_loaded()
+        return self._index.get(make_key(name))
+
+    def search_prefix(self, prefix: str, limit: int = 10) -> List[Place]:
+        """Возвращает города, название которых начинается с prefix, крупные первыми"""
+        self._ensure_loaded()
+        key = make_key(prefix)
+        if not key:
+            return []
+        start = bisect.bisect_left(self._keys, key)
+        found = {}
+        for candidate in self._keys[start:]:
+            if not candidate.startswith(key):
+                break
+            place = self._index[candidate]
+            found[(place.name, place.lat, place.lon)] = place
+        return sorted(found.values(), key=lambda place: -place.population)[:limit]
+
+    def __len__(self) -> int:
+        self._ensure_loaded()
+        return len(self._index)
+
+
+_gazetteer = Gazetteer()
+
+
+def lookup_city(name: str) -> Optional[Place]:
+    """Ищет город в общем справочнике"""
+    if not name:
+        return None
+    return _gazetteer.lookup(name)
+
+
+def search_cities(prefix: str, limit: int = 10) -> List[Place]:
+    """Поиск городов по началу названия в общем справочнике"""
+    return _gazetteer.search_prefix(prefix, limit)
+
+
+def build(source: str, target: str = DEFAULT_PATH, countries: Optional[List[str]] = None) -> int:
+    """
+    Собирает справочник из выгрузки GeoNames citiesNNNN.txt.
+    id города в GeoNames совпадает с id города в OpenWeatherMap.
+    Из альтернативных названий сохраняются только кириллические и латинские.
+    """
+    def is_cyrillic(text: str) -> bool:
+        return any('а' <= char.lower() <= 'я' or char in 'ёЁ' for char in text)
+
+    def is_useful(text: str) -> bool:
+        return all(char.isascii() or is_cyrillic(char) or not char.isalpha() for char in text)
+
+    count = 0
+    with open(source, encoding='utf-8') as src, open(target, 'w', encoding='utf-8') as dst:
+        dst.write('id\tname\talternatenames\tlat\tlon\tpopulation\n')
+        for line in src:
+            fields = line.rstrip('\n').split('\t')
+            if countries and fields[8] not in countries:
+                continue
+            alternates = [name for name in fields[3].split(',') if name and is_useful(name)]
+            russian = next((name for name in alternates if is_cyrillic(name)), fields[1])
+            names = list(dict.fromkeys([fields[1], fields[2], *alternates]))
+            names = [name for name in names if name != russian]
+            dst.write(f"{fields[0]}\t{russian}\t{','.join(names)}\t{fields[4]}\t{fields[5]}\t{fields[14] or 0}\n")
+            count += 1
+    return count
+
+
+def benchmark() -> None:
+    """Замеряет загрузку справочника и скорость поиска"""
+    gazetteer = Gazetteer()
+    started = time.perf_counter()
+    size = len(gazetteer)
+    print(f"Загрузка: {(time.perf_counter() - started) * 1000:.1f} мс, ключей: {size}")
+
+    queries = ['Москва', 'moskva', 'Ростов на Дону', 'Екатеринбург', 'Yekaterinburg', 'Орел', 'Unknown']
+    rounds = 100000
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for query in queries:
+            gazetteer.lookup(query)
+    elapsed = time.perf_counter() - started
+    print(f"Точный поиск: {elapsed / (rounds * len(queries)) * 1e6:.2f} мкс на запрос")
+
+    rounds = 10000
+    started = time.perf_counter()
+    for _ in range(rounds):
+        gazetteer.search_prefix('ново')
+    elapsed = time.perf_counter() - started
+    print(f"Поиск по префиксу: {elapsed / rounds * 1e6:.2f} мкс на запрос")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 3 and sys.argv[1] == 'build':
+        country_codes = sys.argv[3].split(',') if len(sys.argv) > 3 else None
+        print(f"Записано городов: {build(sys.argv[2], countries=country_codes)}")
+    else:
+        benchmark()
@@ -0,0 +1,286 @@
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import asyncio
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import Config
+from metrics import UPSTREAM_ERRORS, UPSTREAM_SECONDS
+
+# Имена внешних сервисов: у каждого свой пул соединений и свой circuit breaker
+OPENWEATHERMAP = 'openweathermap'
+OSRM = 'osrm'
+TELEGRAM = 'telegram'
+
+# Ответы, после которых запрос имеет смысл повторить
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Запрос не выполнялся: сервис недавно отвечал ошибками"""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker для внешнего сервиса.
+
+    После failure_threshold ошибок подряд цепь размыкается, и запросы сразу
+    завершаются CircuitOpenError. Через reset_timeout секунд пропускается один
+    пробный запрос: при успехе цепь замыкается, при ошибке снова размыкается.
+    Если исход пробного запроса так и не был записан, ещё через reset_timeout
+    секунд пропускается следующий пробный запрос.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            now = time.monotonic()
+            if now - self.opened_at < self.reset_timeout:
+                return False
+            # Из OPEN — первый пробный запрос, из HALF_OPEN — замена зависшему
+            self.state = self.HALF_OPEN
+            self.opened_at = now
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_sessions: Dict[str, requests.Session] = {}
+_registry_lock = threading.Lock()
+_async_session: Optional[aiohttp.ClientSession] = None
+
+
+def get_breaker(service: str) -> CircuitBreaker:
+    with _registry_lock:
+        if service not in _breakers:
+            _breakers[service] = CircuitBreaker(
+                service,
+                failure_threshold=Config.BREAKER_FAILURE_THRESHOLD,
+                reset_timeout=Config.BREAKER_RESET_TIMEOUT,
+            )
+        return _breakers[service]
+
+
+def get_session(service: str) -> requests.Session:
+    """
+    Возвращает HTTP-сессию сервиса с keep-alive.
+    Соединения переиспользуются, пул ведётся отдельно для каждого хоста.
+    """
+    with _registry_lock:
+        if service not in _sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=Config.HTTP_POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[service] = session
+        return _sessions[service]
+
+
+def backoff_delay(attempt: int) -> float:
+    """Экспоненциальная задержка перед повтором со случайным разбросом (full jitter)"""
+    return random.uniform(0, Config.HTTP_RETRY_BACKOFF * (2 ** attempt))
+
+
+def record_attempt(service: str, endpoint: str, started: float, reason: Optional[str] = None) -> None:
+    """Записывает в метрики длительность попытки запроса и причину ошибки, если она была"""
+    UPSTREAM_SECONDS.observe(time.perf_counter() - started, service=service, endpoint=endpoint)
+    if reason:
+        UPSTREAM_ERRORS.inc(service=service, endpoint=endpoint, reason=reason)
+
+
+def start_attempt(breaker: CircuitBreaker, attempt: int, before_attempt: Optional[Callable[[], None]]) -> None:
+    """
+    Вызывает before_attempt перед попыткой запроса.
+    Если повтор не состоялся, засчитывает ошибку предыдущей попытки,
+    которая иначе осталась бы без исхода в circuit breaker.
+    """
+    if before_attempt is None:
+        return
+    try:
+        before_attempt()
+    except BaseException:
+        if attempt:
+            breaker.record_failure()
+        raise
+
+
+def get(
+    service: str,
+    url: str,
+    params: Optional[Dict[str, Any]] = None,
+    read_timeout: Optional[float] = None,
+    endpoint: str = 'other',
+    before_attempt: Optional[Callable[[], None]] = None,
+) -> requests.Response:
+    """
+    Выполняет GET-запрос к внешнему сервису через общий пул соединений.
+
+    Сетевые ошибки и ответы из RETRY_STATUSES повторяются не более HTTP_RETRIES раз,
+    любое другое исключение сразу засчитывается circuit breaker как ошибка.
+    Если circuit breaker сервиса разомкнут, сразу выбрасывает CircuitOpenError.
+    Каждая попытка попадает в метрики с меткой endpoint.
+    before_attempt вызывается перед каждой попыткой, включая повторы (например, чтобы
+    списать квоту); выброшенное им исключение прерывает запрос.
+    """
+    breaker = get_breaker(service)
+    if not breaker.allow():
+        UPSTREAM_ERRORS.inc(service=service, endpoint=endpoint, reason='circuit_open')
+        raise CircuitOpenError(service)
+
+    timeout = (Config.HTTP_CONNECT_TIMEOUT, read_timeout or Config.HTTP_READ_TIMEOUT)
+    for attempt in range(Config.HTTP_RETRIES + 1):
+        last_attempt = attempt == Config.HTTP_RETRIES
+        start_attempt(breaker, attempt, before_attempt)
+        started = time.perf_counter()
+        try:
+            response = get_session(service).get(url, params=params, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            record_attempt(service, endpoint, started, type(e).__name__)
+            if last_attempt:
+                breaker.record_failure()
+                raise
+        except BaseException as e:
+            record_attempt(service, endpoint, started, type(e).__name__)
+            breaker.record_failure()
+            raise
+        else:
+            record_attempt(
+                service, endpoint, started,
+                f'http_{response.status_code}' if response.status_code >= 400 else None,
+            )
+            if response.status_code not in RETRY_STATUSES:
+                breaker.record_success()
+                return response
+            if last_attempt:
+                breaker.record_failure()
+                return response
+        time.sleep(backoff_delay(attempt))
+
+
+def get_async_session() -> aiohttp.ClientSession:
+    """
+    Возвращает общий асинхронный HTTP-клиент с пулом соединений.
+    Создаётся при первом обращении внутри работающего event loop.
+    """
+    global _async_session
+    if _async_session is None or _async_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=Config.HTTP_POOL_SIZE,
+            limit_per_host=Config.HTTP_POOL_SIZE,
+            ttl_dns_cache=300,
+        )
+        _async_session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(
+                total=None,
+                sock_connect=Config.HTTP_CONNECT_TIMEOUT,
+                sock_read=Config.HTTP_READ_TIMEOUT,
+            ),
+        )
+    return _async_session
+
+
+async def async_get_json(
+    service: str,
+    url: str,
+    params: Optional[Dict[str, Any]] = None,
+    endpoint: str = 'other',
+    before_attempt: Optional[Callable[[], None]] = None,
+) -> Tuple[int, Any]:
+    """
+    Асинхронная версия get: возвращает (статус, разобранный JSON).
+    Повторы, circuit breaker, before_attempt и метрики работают так же, как в синхронной версии.
+    """
+    breaker = get_breaker(service)
+    if not breaker.allow():
+        UPSTREAM_ERRORS.inc(service=service, endpoint=endpoint, reason='circuit_open')
+        raise CircuitOpenError(service)
+
+    for attempt in range(Config.HTTP_RETRIES + 1):
+        last_attempt = attempt == Config.HTTP_RETRIES
+        start_attempt(breaker, attempt, before_attempt)
+        started = time.perf_counter()
+        try:
+            async with get_async_session().get(url, params=params) as response:
+                status = response.status
+                data = await response.json(content_type=None) if status == 200 else None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            record_attempt(service, endpoint, started, type(e).__name__)
+            if last_attempt:
+                breaker.record_failure()
+                raise
+        except BaseException as e:
+            # Битый JSON, отмена задачи и прочее не должны оставить пробный запрос без исхода
+            record_attempt(service, endpoint, started, type(e).__name__)
+            breaker.record_failure()
+            raise
+        else:
+            record_attempt(service, endpoint, started, f'http_{status}' if status >= 400 else None)
+            if status not in RETRY_STATUSES:
+                breaker.record_success()
+                return status, data
+            if last_attempt:
+                breaker.record_failure()
+                return status, data
+        await asyncio.sleep(backoff_delay(attempt))
+
+
+def telegram_request(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Отправитель запросов к Bot API для telebot (apihelper.CUSTOM_REQUEST_SENDER):
+    запросы идут через общий пул соединений и попадают в метрики по имени метода.
+    Повторы и разбор ошибок остаются за telebot и рассыльщиком.
+    """
+    endpoint = url.rsplit('/', 1)[-1]
+    started = time.perf_counter()
+    try:
+        response = get_session(TELEGRAM).request(method, url, **kwargs)
+    except requests.RequestException as e:
+        record_attempt(TELEGRAM, endpoint, started, type(e).__name__)
+        raise
+    record_attempt(
+        TELEGRAM, endpoint, started,
+        f'http_{response.status_code}' if response.status_code >= 400 else None,
+    )
+    return response
+
+
+async def close_async_session() -> None:
+    """Закрывает общий асинхронный HTTP-клиент"""
+    global _async_session
+    if _async_session is not None and not _async_session.closed:
+        await _async_session.close()
+    _async_session = None
@@ -0,0 +1,186 @@
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Dict, Hashable, List, Tuple
+
+from config import Config
+from database import get_quota_usage, log_exception, take_quota
+from metrics import REGISTRY
+
+# Классы приоритета запросов к внешнему API
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+
+
+class QuotaExceededError(Exception):
+    """Бюджет запросов к внешнему API исчерпан"""
+
+
+class QuotaManager:
+    """
+    Бюджет запросов к внешнему API на минуту и на сутки.
+
+    Счётчики хранятся в базе, поэтому все процессы и узлы, работающие с одной базой,
+    делят общий лимит. Окна фиксированные: календарная минута и календарные сутки.
+    Интерактивные запросы (команды пользователей) могут использовать всю минутную квоту
+    и не ждут: если квота исчерпана, запрос сразу отклоняется.
+    Пакетные запросы (рассылка, предзагрузка) используют не больше batch_share квоты,
+    оставляя запас для пользователей, и при нехватке ждут освобождения окна.
+    Нулевой per_minute или per_day означает отсутствие соответствующего ограничения.
+    """
+
+    def __init__(self, name: str, per_minute: int, per_day: int, batch_share: float = 0.75):
+        self.name = name
+        self.per_minute = per_minute
+        self.per_day = per_day
+        self.batch_limit = max(1, int(per_minute * batch_share))
+        self._lock = threading.Lock()
+        self.granted = {INTERACTIVE: 0, BATCH: 0}
+        self.rejected = {INTERACTIVE: 0, BATCH: 0}
+        self.waited = 0.0
+
+    @staticmethod
+    def _periods() -> Tuple[int, int]:
+        """Номера текущей минуты и текущих суток"""
+        return int(time.time() // 60), date.today().toordinal()
+
+    def _try_acquire(self, priority: str) -> float:
+        """Занимает квоту; возвращает 0 при успехе или время до освобождения окна"""
+        minute, day = self._periods()
+        limit = self.per_minute if priority == INTERACTIVE else self.batch_limit
+        try:
+            full = take_quota(self.name, [
+                ('day', day, self.per_day),
+                ('minute', minute, limit if self.per_minute else 0),
+            ])
+        except Exception as e:
+            # Без базы квоту не проверить; не отказываем пользователям из-за этого
+            log_exception(e, quota=self.name)
+            full = None
+
+        if full == 'day':
+            return -1
+        if full == 'minute':
+            return 60 - time.time() % 60
+        with self._lock:
+            self.granted[priority] += 1
+        return 0
+
+    def acquire(self, priority: str = INTERACTIVE, timeout: float = 0) -> bool:
+        """
+        Пытается занять один запрос из бюджета.
+        Ждёт не дольше timeout секунд; при исчерпанной суточной квоте не ждёт.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = self._try_acquire(priority)
+            if wait == 0:
+                return True
+            with self._lock:
+                if wait < 0 or time.monotonic() + wait > deadline:
+                    self.rejected[priority] += 1
+                    return False
+                self.waited += wait
+            time.sleep(wait)
+
+    def stats(self) -> Dict[str, int]:
+        """Счётчики использования квоты: занятые запросы общие, остальные — этого процесса"""
+        minute, day = self._periods()
+        usage = get_quota_usage(self.name, [('minute', minute), ('day', day)])
+        with self._lock:
+            return {
+                'minute_used': usage['minute'],
+                'minute_limit': self.per_minute,
+                'day_used': usage['day'],
+                'day_limit': self.per_day,
+                'granted_interactive': self.granted[INTERACTIVE],
+                'granted_batch': self.granted[BATCH],
+                'rejected_interactive': self.rejected[INTERACTIVE],
+                'rejected_batch': self.rejected[BATCH],
+                'waited_seconds': round(self.waited, 3),
+            }
+
+
+class ChatThrottle:
+    """
+    Ограничение частоты команд от одного чата: не больше limit команд за window секунд.
+    Хранит ограниченное число чатов, самые давние вытесняются.
+    """
+
+    def __init__(self, limit: int, window: float, maxsize: int = 100000):
+        self.limit = limit
+        self.window = window
+        self.maxsize = maxsize
+        self._windows: "OrderedDict[Hashable, list]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.throttled = 0
+
+    def allow(self, chat_id: Hashable) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            entry = self._windows.get(chat_id)
+            if entry is None or now - entry[0] >= self.window:
+                entry = [now, 0]
+            self._windows[chat_id] = entry
+            self._windows.move_to_end(chat_id)
+            while len(self._windows) > self.maxsize:
+                self._windows.popitem(last=False)
+
+            if entry[1] >= self.limit:
+                self.throttled += 1
+                return False
+            entry[1] += 1
+            return True
+
+
+# Общий бюджет запросов к OpenWeatherMap
+owm_quota = QuotaManager(
+    'openweathermap',
+    per_minute=Config.OWM_CALLS_PER_MINUTE,
+    per_day=Config.OWM_CALLS_PER_DAY,
+    batch_share=Config.OWM_BATCH_SHARE,
+)
+
+# Ограничение частоты команд, обращающихся к внешним сервисам
+command_throttle = ChatThrottle(limit=Config.COMMAND_RATE_LIMIT, window=Config.COMMAND_RATE_WINDOW)
+
+
+def _collect_quota() -> List[str]:
+    stats = owm_quota.stats()
+    label = 'quota="openweathermap"'
+    lines = [
+        '# HELP bot_quota_used Запросов, использованных в текущем окне квоты',
+        '# TYPE bot_quota_used gauge',
+        f'bot_quota_used{{{label},window="minute"}} {stats["minute_used"]}',
+        f'bot_quota_used{{{label},window="day"}} {stats["day_used"]}',
+        '# HELP bot_quota_limit Лимит квоты в окне, 0 — без ограничения',
+        '# TYPE bot_quota_limit gauge',
+        f'bot_quota_limit{{{label},window="minute"}} {stats["minute_limit"]}',
+        f'bot_quota_limit{{{label},window="day"}} {stats["day_limit"]}',
+    ]
+    for result, documentation in (('granted', 'Запросы, получившие квоту'), ('rejected', 'Запросы, не получившие квоту')):
+        lines += [
+            f'# HELP bot_quota_{result}_total {documentation}',
+            f'# TYPE bot_quota_{result}_total counter',
+        ]
+        lines += [
+            f'bot_quota_{result}_total{{{label},priority="{priority}"}} {stats[f"{result}_{priority}"]}'
+            for priority in (INTERACTIVE, BATCH)
+        ]
+    lines += [
+        '# HELP bot_quota_wait_seconds_total Суммарное ожидание квоты пакетными запросами',
+        '# TYPE bot_quota_wait_seconds_total counter',
+        f'bot_quota_wait_seconds_total{{{label}}} {stats["waited_seconds"]}',
+        '# HELP bot_command_throttled_total Команды, отклонённые ограничением частоты',
+        '# TYPE bot_command_throttled_total counter',
+        f'bot_command_throttled_total {command_throttle.throttled}',
+    ]
+    return lines
+
+
+REGISTRY.add_collector(_collect_quota)
@@ -0,0 +1,354 @@
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from config import Config
+from metrics import REPORT_STAGE_SECONDS
+from database import (
+    acquire_lease, claim_deliveries, complete_deliveries, expire_broadcast_runs, finish_broadcast_run,
+    get_broadcast_messages, get_broadcast_stats, get_report_cities, get_run_shards, get_unfinished_runs,
+    log_exception, release_lease, reschedule_deliveries, save_broadcast_messages, start_broadcast_run,
+)
+from services.broadcast import TRANSIENT, classify_error
+from services.cities import normalize_city
+from services.cluster import SHARD_LEASE_PREFIX, shard_lease_owner
+from services.quota import BATCH
+from services.samples import SAMPLE_TEMP, SAMPLE_TRAFFIC, hourly_baseline, yesterday_value
+from services.weather import get_weather, get_weather_batch
+from services.traffic import get_traffic_level
+
+logger = logging.getLogger(__name__)
+
+# Город отчёта: (название для запросов и текста, id города в OpenWeatherMap)
+ReportCity = Tuple[str, Optional[int]]
+
+
+def collect_cities(cities: Iterable[Tuple[str, Optional[int]]]) -> Dict[str, ReportCity]:
+    """
+    Этап 1: сводит города подписчиков к нормализованным ключам.
+    Первое встреченное написание города используется для запросов и текста отчёта.
+    """
+    groups: Dict[str, ReportCity] = {}
+    for city, city_id in cities:
+        key = normalize_city(city)
+        known_city, known_id = groups.get(key, (city.strip(), None))
+        groups[key] = (known_city, known_id if known_id is not None else city_id)
+    return groups
+
+
+def fetch_city_data(cities: Dict[str, ReportCity]) -> Dict[str, Tuple[dict, dict]]:
+    """
+    Этап 2: получает погоду и пробки один раз на каждый город.
+    Погода для городов с известным id запрашивается пачками,
+    пробки — параллельно в PREFETCH_WORKERS потоках.
+    """
+    weather = get_weather_batch(cities)
+
+    def fetch(item: Tuple[str, ReportCity]) -> Tuple[str, Tuple[dict, dict]]:
+        key, (city, _) = item
+        try:
+            return key, (weather[key], get_traffic_level(city))
+        except Exception as e:
+            log_exception(e, city=city)
+            return key, ({'status': 500, 'exception': e}, {'status': 500, 'exception': e})
+
+    with ThreadPoolExecutor(max_workers=Config.PREFETCH_WORKERS, thread_name_prefix='report-fetch') as pool:
+        return dict(pool.map(fetch, cities.items()))
+
+
+def weather_trend_text(temp: float, yesterday: Optional[float]) -> Optional[str]:
+    """Сравнение температуры с тем же временем вчера"""
+    if yesterday is None:
+        return None
+    diff = round(temp - yesterday)
+    if diff == 0:
+        return "Так же, как вчера в это время"
+    return f"{'Теплее' if diff > 0 else 'Холоднее'}, чем вчера, на {abs(diff)}°"
+
+
+def traffic_trend_text(level: int, baseline: Optional[float]) -> Optional[str]:
+    """Сравнение уровня пробок с обычным для этого часа"""
+    if baseline is None:
+        return None
+    diff = level - baseline
+    if diff >= 1.5:
+        return f"Хуже, чем обычно в это время (обычно {round(baseline)}/10)"
+    if diff <= -1.5:
+        return f"Свободнее, чем обычно в это время (обычно {round(baseline)}/10)"
+    return "Как обычно в это время"
+
+
+def render_report(city: str, weather_data: dict, traffic_data: dict) -> str:
+    """
+    Этап 3: формирует текст утреннего отчёта для города.
+    Сравнения со вчерашним днём и с обычными пробками берутся из накопленных замеров.
+    """
+    key = normalize_city(city)
+
+    weather_text = "❌ Не удалось получить"
+    if weather_data['status'] == 200:
+        weather_text = (
+            f"{weather_data['temp']}°C (ощущается как {weather_data['feels_like']}°C)\n"
+            f"   {weather_data['description']}"
+        )
+        trend = weather_trend_text(weather_data['temp'], yesterday_value(key, SAMPLE_TEMP))
+        if trend:
+            weather_text += f"\n   {trend}"
+
+    traffic_text = "❌ Не удалось получить"
+    if traffic_data['status'] == 200:
+        traffic_text = (
+            f"Уровень: {traffic_data['level']}/10\n"
+            f"   {traffic_data['description']}"
+        )
+        trend = None
+        if not traffic_data.get('estimated'):
+            trend = traffic_trend_text(traffic_data['level'], hourly_baseline(key, SAMPLE_TRAFFIC))
+        if trend:
+            traffic_text += f"\n   {trend}"
+
+    return (
+        f"🌤 Утренний отчёт для {city}\n"
+        f"🕗 {datetime.now().strftime('%d.%m.%Y %H:%M')}\n\n"
+        f"🌡 Погода:\n{weather_text}\n\n"
+        f"🚗 Пробки:\n{traffic_text}\n\n"
+        f"Хорошего дня! ☀"
+    )
+
+
+def prefetch_report_data(workers: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Заранее загружает погоду и пробки для всех городов подписчиков,
+    чтобы к моменту рассылки данные уже лежали в кэшах.
+
+    Возвращает статистику: сколько городов прогрето и какие не удалось загрузить.
+    """
+    started = time.monotonic()
+    cities = collect_cities(get_report_cities())
+    # Города с известным id загружаются пачками и попадают в кэш погоды
+    get_weather_batch(cities)
+
+    def warm(item: Tuple[str, ReportCity]) -> Tuple[str, bool]:
+        key, (city, _) = item
+        try:
+            weather_data = get_weather(city, BATCH)
+            traffic_data = get_traffic_level(city)
+            return key, weather_data['status'] == 200 and traffic_data['status'] == 200
+        except Exception as e:
+            log_exception(e, city=city)
+            return key, False
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers or Config.PREFETCH_WORKERS, thread_name_prefix='prefetch') as pool:
+        for key, ok in pool.map(warm, cities.items()):
+            if not ok:
+                failed.append(cities[key][0])
+
+    stats = {
+        'cities': len(cities),
+        'warmed': len(cities) - len(failed),
+        'failed': failed,
+        'duration': time.monotonic() - started,
+    }
+    REPORT_STAGE_SECONDS.observe(stats['duration'], stage='prefetch')
+    logger.info(
+        "Report prefetch: warmed %d of %d cities in %.2fs, failed: %s",
+        stats['warmed'], stats['cities'], stats['duration'], ', '.join(failed) or '-'
+    )
+    return stats
+
+
+# Функция отправки: deliver(пары (chat_id, текст), on_success, on_failure), например Broadcaster.run
+Deliver = Callable[..., Any]
+
+
+def drain_shard(
+    run_id: int,
+    shard: int,
+    deliver: Deliver,
+    messages: Dict[str, str],
+    keep_alive: Callable[[], bool] = lambda: True,
+) -> Dict[str, int]:
+    """
+    Отправляет сообщения шарда прогона из очереди доставки, пока в нём есть готовые строки.
+
+    Строки забираются пачками по OUTBOX_BATCH_SIZE; после отправки пачки доставленные
+    отмечаются в базе, а неудачные возвращаются в очередь с задержкой или помечаются failed.
+    messages — уже готовые тексты по нормализованному городу, недостающие дорисовываются.
+    Перед каждой пачкой вызывается keep_alive; если он вернул False, отправка прекращается.
+    """
+    sent = failed = rescheduled = 0
+    while keep_alive():
+        rows = claim_deliveries(run_id, shard, Config.OUTBOX_BATCH_SIZE, Config.OUTBOX_CLAIM_TIMEOUT)
+        if not rows:
+            break
+
+        delivery_ids: Dict[int, int] = {}
+        batch = []
+        rendered = {}
+        for delivery_id, chat_id, city in rows:
+            key = normalize_city(city)
+            if key not in messages:
+                # Город появился уже после сбора — готовим отчёт для него отдельно
+                messages[key] = rendered[key] = render_report(
+                    city, get_weather(city, BATCH), get_traffic_level(city)
+                )
+            delivery_ids[chat_id] = delivery_id
+            batch.append((chat_id, messages[key]))
+        if rendered:
+            save_broadcast_messages(run_id, rendered)
+
+        delivered: List[int] = []
+        failures: List[Tuple[int, str, bool]] = []
+        deliver(
+            batch,
+            on_success=lambda chat_id: delivered.append(delivery_ids[chat_id]),
+            on_failure=lambda chat_id, e: failures.append(
+                (delivery_ids[chat_id], str(e), classify_error(e) != TRANSIENT)
+            ),
+        )
+        complete_deliveries(delivered)
+        rescheduled += reschedule_deliveries(failures, Config.OUTBOX_MAX_ATTEMPTS, Config.OUTBOX_RETRY_BACKOFF)
+        sent += len(delivered)
+        failed += len(failures)
+
+    return {'sent': sent, 'failed': failed, 'rescheduled': rescheduled}
+
+
+def drain_run(run_id: int, deliver: Deliver, messages: Optional[Dict[str, str]] = None) -> Dict[str, int]:
+    """
+    Отправляет прогон по шардам. Шард обрабатывается только под арендой,
+    поэтому любое число процессов может отправлять один прогон без дублей.
+    Аренда продлевается перед каждой пачкой; если процесс упал, через
+    SHARD_LEASE_TTL секунд шард заберёт другой процесс. Владелец аренды
+    уникален для каждой отправки, а не для процесса.
+    """
+    if messages is None:
+        messages = get_broadcast_messages(run_id)
+    totals = {'shards': 0, 'sent': 0, 'failed': 0, 'rescheduled': 0}
+
+    shards = list(range(get_run_shards(run_id)))
+    # Разные процессы начинают с разных шардов и меньше мешают друг другу
+    random.shuffle(shards)
+    for shard in shards:
+        lease = f"{SHARD_LEASE_PREFIX}{run_id}:{shard}"
+        owner = shard_lease_owner()
+        if not acquire_lease(lease, owner, Config.SHARD_LEASE_TTL):
+            continue
+        try:
+            result = drain_shard(
+                run_id, shard, deliver, messages,
+                keep_alive=lambda: acquire_lease(lease, owner, Config.SHARD_LEASE_TTL),
+            )
+        finally:
+            release_lease(lease, owner)
+        totals['shards'] += 1
+        for name in ('sent', 'failed', 'rescheduled'):
+            totals[name] += result[name]
+
+    finish_broadcast_run(run_id)
+    return totals
+
+
+def run_daily_report(deliver: Deliver) -> Dict[str, Any]:
+    """
+    Собирает утренний отчёт, ставит его в очередь доставки и отправляет через deliver.
+
+    Прогон создаётся один раз в день: если бот перезапустился посреди рассылки,
+    повторный вызов продолжит тот же прогон и не отправит отчёт второй раз.
+
+    Возвращает статистику прогона:
+    - chats / cities: число получателей и уникальных городов
+    - calls_saved: сколько запросов к погоде и пробкам сэкономлено группировкой
+    - timings: длительность каждого этапа в секундах
+    - run: состояние очереди доставки прогона (см. get_broadcast_stats)
+    """
+    timings = {}
+
+    started = time.monotonic()
+    cities = collect_cities(get_report_cities())
+    timings['collect'] = time.monotonic() - started
+
+    started = time.monotonic()
+    city_data = fetch_city_data(cities)
+    timings['fetch'] = time.monotonic() - started
+
+    started = time.monotonic()
+    messages = {
+        key: render_report(cities[key][0], weather_data, traffic_data)
+        for key, (weather_data, traffic_data) in city_data.items()
+    }
+    timings['render'] = time.monotonic() - started
+
+    started = time.monotonic()
+    run_id, created = start_broadcast_run(f"daily_report:{date.today().isoformat()}", Config.BROADCAST_SHARDS)
+    if created:
+        save_broadcast_messages(run_id, messages)
+    else:
+        # Досылаем те же тексты, что уже получили остальные чаты прогона;
+        # города без сохранённого текста drain_shard дорисует сам
+        logger.info("Daily report run %d already exists, resuming it", run_id)
+        messages = get_broadcast_messages(run_id)
+    timings['enqueue'] = time.monotonic() - started
+
+    started = time.monotonic()
+    drained = drain_run(run_id, deliver, messages)
+    timings['send'] = time.monotonic() - started
+
+    for stage, duration in timings.items():
+        REPORT_STAGE_SECONDS.observe(duration, stage=stage)
+
+    run_stats = get_broadcast_stats(run_id)
+    chats_count = run_stats.get('total', 0)
+    stats = {
+        'chats': chats_count,
+        'cities': len(cities),
+        # Раньше на каждый чат делалось 2 запроса: погода и пробки
+        'calls_saved': max(0, 2 * (chats_count - len(cities))),
+        'timings': timings,
+        'run': run_stats,
+    }
+    logger.info(
+        "Daily report: %d chats, %d cities, %d upstream calls saved, "
+        "collect=%.2fs fetch=%.2fs render=%.2fs enqueue=%.2fs send=%.2fs",
+        stats['chats'], stats['cities'], stats['calls_saved'],
+        timings['collect'], timings['fetch'], timings['render'], timings['enqueue'], timings['send']
+    )
+    logger.info(
+        "Daily report run %d: sent=%d failed=%d rescheduled=%d, outbox done=%d failed=%d pending=%d",
+        run_id, drained['sent'], drained['failed'], drained['rescheduled'],
+        run_stats.get('done', 0), run_stats.get('failed', 0), run_stats.get('pending', 0)
+    )
+    return stats
+
+
+def resume_broadcasts(deliver: Deliver) -> List[Dict[str, Any]]:
+    """
+    Досылает незавершённые прогоны: повторы, срок которых наступил,
+    и строки, брошенные упавшим процессом. Слишком старые прогоны закрываются,
+    а давно завершённые удаляются из базы.
+    Возвращает статистику каждого обработанного прогона.
+    """
+    expired, pruned = expire_broadcast_runs(Config.OUTBOX_RUN_TTL, Config.OUTBOX_RETENTION)
+    if expired:
+        logger.info("Expired %d unfinished broadcast runs", expired)
+    if pruned:
+        logger.info("Pruned %d finished broadcast runs", pruned)
+
+    results = []
+    for run_id in get_unfinished_runs():
+        drained = drain_run(run_id, deliver)
+        if drained['sent'] or drained['failed']:
+            logger.info(
+                "Broadcast run %d resumed: sent=%d failed=%d rescheduled=%d",
+                run_id, drained['sent'], drained['failed'], drained['rescheduled']
+            )
+        results.append(get_broadcast_stats(run_id))
+    return results
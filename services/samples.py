@@ -0,0 +1,86 @@
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import atexit
+import logging
+import time
+from datetime import date, datetime, time as dt_time, timedelta
+from typing import Optional
+
+from config import Config
+from database import SAMPLE_TEMP, SAMPLE_TRAFFIC, SampleBuffer, get_sample_stats, log_exception, prune_samples
+from services.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Замеры копятся в памяти и пишутся в базу пачками
+sample_buffer = SampleBuffer(max_size=Config.SAMPLES_BATCH_SIZE, flush_interval=Config.SAMPLES_FLUSH_INTERVAL)
+atexit.register(sample_buffer.flush)
+
+# Результаты агрегатных запросов: за несколько минут норма и вчерашние значения почти не меняются
+trend_cache = TTLCache(maxsize=10000, ttl=600)
+
+
+def record_weather(key: str, weather: dict) -> None:
+    """Сохраняет температуру из успешного ответа о погоде; key — нормализованное название города"""
+    if key and weather.get('status') == 200:
+        sample_buffer.add(key, SAMPLE_TEMP, weather['temp'])
+
+
+def record_traffic(key: str, traffic: dict) -> None:
+    """Сохраняет уровень пробок, полученный от OSRM (не оценку по времени суток)"""
+    if key and traffic.get('status') == 200:
+        sample_buffer.add(key, SAMPLE_TRAFFIC, traffic['level'])
+
+
+def yesterday_value(key: str, metric: int) -> Optional[float]:
+    """Среднее значение метрики вчера в это же время (± SAMPLES_YESTERDAY_WINDOW секунд)"""
+    window = Config.SAMPLES_YESTERDAY_WINDOW
+    center = int(time.time()) - 86400
+    # Ключ кэша меняется раз в окно, чтобы не пересчитывать значение для каждого чата
+    slot = center // window
+
+    def load() -> Optional[float]:
+        try:
+            average, count = get_sample_stats(key, metric, [(center - window, center + window)])
+        except Exception as e:
+            log_exception(e, city=key)
+            return None
+        return average if count else None
+
+    return trend_cache.get_or_load(('yesterday', key, metric, slot), load)
+
+
+def hourly_baseline(key: str, metric: int, hour: Optional[int] = None) -> Optional[float]:
+    """
+    Обычное значение метрики в этот час: среднее за тот же час в предыдущие
+    SAMPLES_BASELINE_DAYS дней. None, если замеров меньше SAMPLES_MIN_COUNT.
+    """
+    if hour is None:
+        hour = datetime.now().hour
+    today = date.today()
+
+    def load() -> Optional[float]:
+        start_of_hour = datetime.combine(today, dt_time(hour))
+        ranges = []
+        for days_ago in range(1, Config.SAMPLES_BASELINE_DAYS + 1):
+            start = int((start_of_hour - timedelta(days=days_ago)).timestamp())
+            ranges.append((start, start + 3600))
+        try:
+            average, count = get_sample_stats(key, metric, ranges)
+        except Exception as e:
+            log_exception(e, city=key)
+            return None
+        return average if count >= Config.SAMPLES_MIN_COUNT else None
+
+    return trend_cache.get_or_load(('baseline', key, metric, today, hour), load)
+
+
+def prune() -> int:
+    """Удаляет замеры старше SAMPLES_RETENTION_DAYS дней"""
+    removed = prune_samples(Config.SAMPLES_RETENTION_DAYS * 86400)
+    if removed:
+        logger.info("Pruned %d city samples", removed)
+    return removed
+
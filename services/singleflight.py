@@ -0,0 +1,102 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class FlightTimeoutError(Exception):
+    """Не дождались результата запроса, выполняемого другим вызовом"""
+
+
+class _Call:
+    """Выполняющийся запрос и его результат"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Объединение одновременных одинаковых запросов (single-flight).
+
+    Первый вызов с ключом выполняет функцию, а вызовы с тем же ключом,
+    пришедшие до её завершения, ждут и получают тот же результат (или ту же ошибку).
+    Ожидающие ждут не дольше timeout секунд, после чего получают FlightTimeoutError.
+    Синхронные (потоки) и асинхронные вызовы объединяются раздельно.
+    """
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.timeout = timeout
+        self._calls: Dict[Hashable, _Call] = {}
+        self._tasks: Dict[Hashable, "asyncio.Task"] = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.shared = 0
+        self.timeouts = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """Выполняет fn или присоединяется к уже выполняющемуся вызову с тем же ключом"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                self.shared += 1
+
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        elif not call.done.wait(self.timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise FlightTimeoutError(key)
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    async def do_async(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Асинхронная версия do: fn возвращает корутину"""
+        with self._lock:
+            task = self._tasks.get(key)
+            leader = task is None
+            if leader:
+                task = asyncio.get_running_loop().create_task(fn())
+                self._tasks[key] = task
+                task.add_done_callback(lambda _: self._forget_task(key, task))
+                self.executed += 1
+            else:
+                self.shared += 1
+
+        # shield: отмена или таймаут одного из вызовов не отменяет общий запрос
+        if leader:
+            return await asyncio.shield(task)
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), self.timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise FlightTimeoutError(key)
+
+    def _forget_task(self, key: Hashable, task: "asyncio.Task") -> None:
+        with self._lock:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+
+    def stats(self) -> Dict[str, int]:
+        """Сколько запросов выполнено и сколько вызовов получили чужой результат"""
+        with self._lock:
+            return {
+                'executed': self.executed,
+                'shared': self.shared,
+                'timeouts': self.timeouts,
+            }
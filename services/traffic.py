@@ -2,45 +2,75 @@ import sys
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
-import requests
+import asyncio
+import logging
+import math
+import statistics
 from datetime import datetime
-from typing import Optional, Tuple, Dict, Any
-
-# Координаты центров крупных городов (широта, долгота)
-CITY_COORDINATES = {
-    "москва": (55.7558, 37.6173),
-    "moscow": (55.7558, 37.6173),
-    "санкт-петербург": (59.9343, 30.3351),
-    "saint petersburg": (59.9343, 30.3351),
-    "новосибирск": (55.0084, 82.9357),
-    "yekaterinburg": (56.8389, 60.6057),
-    "екатеринбург": (56.8389, 60.6057),
-    "казань": (55.8304, 49.0661),
-    "нижний новгород": (56.3268, 44.0063),
-    "chelyabinsk": (55.1642, 61.4365),
-    "челябинск": (55.1642, 61.4365),
-    "самара": (53.1952, 50.1055),
-    "омск": (54.9886, 73.3242),
-    "ростов-на-дону": (47.2357, 39.7031),
-    "краснодар": (45.0395, 38.9491),
-    "ufa": (54.7386, 55.9722),
-    "уфа": (54.7386, 55.9722),
-}
-
-# OSRM API - бесплатный сервис маршрутизации
-OSRM_BASE_URL = "https://router.project-osrm.org/route/v1/driving"
+from typing import Optional, Tuple, Dict, Any, List
+
+from config import Config
+from database import get_cached_geocode
+from metrics import TRAFFIC_FALLBACKS, register_cache
+from services.cache import TTLCache
+from services.singleflight import FlightTimeoutError
+from services.cities import normalize_city
+from services.gazetteer import lookup_city
+from services import http
+from services.http import OSRM
+from services.samples import SAMPLE_TRAFFIC, hourly_baseline, record_traffic
+
+logger = logging.getLogger(__name__)
+
+# Расстояние от центра города до точек выборки маршрутов, км
+SAMPLE_RADIUS_KM = 5
+
+# Кэш уровня пробок по нормализованному названию города.
+# Пробки меняются быстро, поэтому время жизни короткое, а устаревшее значение
+# отдаётся, пока в фоне запрашивается новое.
+traffic_cache = TTLCache(
+    maxsize=Config.TRAFFIC_CACHE_SIZE,
+    ttl=Config.TRAFFIC_CACHE_TTL,
+    stale_ttl=Config.TRAFFIC_CACHE_STALE_TTL,
+    wait_timeout=Config.COALESCE_WAIT_TIMEOUT,
+)
+register_cache('traffic', traffic_cache)
 
 
 def get_city_coordinates(city_name: str) -> Optional[Tuple[float, float]]:
-    """Получает координаты города из словаря"""
-    city_lower = city_name.lower().strip()
-    return CITY_COORDINATES.get(city_lower)
+    """Получает координаты города из офлайн-справочника или из кэша геокодирования"""
+    place = lookup_city(city_name)
+    if place:
+        return place.lat, place.lon
+
+    cached = get_cached_geocode(normalize_city(city_name))
+    if cached and cached['found']:
+        return cached['lat'], cached['lon']
+    return None
 
 
 def get_traffic_level(city: str) -> Dict[str, Any]:
+    """
+    Получает уровень пробок для города с учётом кэша.
+    Одновременные запросы по одному городу объединяются в один запрос к OSRM.
+    Оценка по времени суток не кэшируется, чтобы следующий запрос снова попробовал OSRM.
+    """
+    try:
+        return traffic_cache.get_or_load(
+            normalize_city(city),
+            lambda: fetch_traffic_level(city),
+            cacheable=lambda result: result['status'] == 200 and not result.get('estimated')
+        )
+    except FlightTimeoutError:
+        TRAFFIC_FALLBACKS.inc(reason='wait_timeout')
+        return get_traffic_by_time_of_day(city)
+
+
+def fetch_traffic_level(city: str) -> Dict[str, Any]:
     """
     Получает уровень пробок используя OSRM API.
-    Сравнивает время движения по маршруту с оптимальным временем.
+    Сравнивает время движения по нескольким маршрутам через город
+    с оптимальным временем, все маршруты запрашиваются одним запросом table.
 
     Возвращает словарь с информацией о пробках:
     - level: уровень пробок (1-10 баллов)
@@ -49,63 +79,143 @@ def get_traffic_level(city: str) -> Dict[str, Any]:
     coords = get_city_coordinates(city)
     if not coords:
         # Если город не найден в базе, возвращаем оценку по времени суток
-        return get_traffic_by_time_of_day()
-
-    lat, lon = coords
-    # Создаем маршрут через город (из точки в точку с отступом от центра)
-    # Маршрут长约10км через центр города
-    offset = 0.1  # примерно 10км
-    start_lon = lon - offset
-    start_lat = lat
-    end_lon = lon + offset
-    end_lat = lat
-
-    url = f"{OSRM_BASE_URL}/{start_lon},{start_lat};{end_lon},{end_lat}"
-    params = {
-        "overview": "false",
-        "alternatives": "false"
-    }
+        TRAFFIC_FALLBACKS.inc(reason='no_coordinates')
+        return get_traffic_by_time_of_day(city)
 
+    url, params = build_table_request(*coords)
     try:
-        response = requests.get(url, params=params, timeout=10)
+        response = http.get(OSRM, url, params=params, endpoint='table')
         if response.status_code == 200:
-            data = response.json()
-            if data.get("routes"):
-                route = data["routes"][0]
-                duration = route["duration"]  # фактическое время в секундах
-                distance = route["distance"] / 1000  # расстояние в км
+            result = parse_table_response(response.json())
+            if result:
+                record_traffic(normalize_city(city), result)
+                return result
+        TRAFFIC_FALLBACKS.inc(reason='bad_response')
+        logger.warning("OSRM table for %s returned no data (HTTP %d)", city, response.status_code)
+    except Exception as e:
+        TRAFFIC_FALLBACKS.inc(reason='error')
+        logger.warning("OSRM table for %s failed: %r", city, e)
 
-                # Оптимальное время при скорости 60 км/ч
-                optimal_duration = (distance / 60) * 3600
+    # Если не удалось получить данные, возвращаем оценку по времени суток
+    return get_traffic_by_time_of_day(city)
 
-                # Коэффициент задержки
-                delay_ratio = duration / optimal_duration if optimal_duration > 0 else 1
 
-                # Преобразуем в баллы от 1 до 10
-                level = min(10, max(1, int((delay_ratio - 1) * 5 + 1)))
+async def async_get_traffic_level(city: str) -> Dict[str, Any]:
+    """Асинхронная версия get_traffic_level, использует тот же кэш"""
+    try:
+        return await traffic_cache.get_or_load_async(
+            normalize_city(city),
+            lambda: async_fetch_traffic_level(city),
+            cacheable=lambda result: result['status'] == 200 and not result.get('estimated')
+        )
+    except FlightTimeoutError:
+        TRAFFIC_FALLBACKS.inc(reason='wait_timeout')
+        return await asyncio.to_thread(get_traffic_by_time_of_day, city)
 
-                return {
-                    "status": 200,
-                    "level": level,
-                    "description": get_traffic_description(level)
-                }
 
+async def async_fetch_traffic_level(city: str) -> Dict[str, Any]:
+    """Асинхронная версия fetch_traffic_level через общий HTTP-клиент"""
+    coords = await asyncio.to_thread(get_city_coordinates, city)
+    if not coords:
+        TRAFFIC_FALLBACKS.inc(reason='no_coordinates')
+        return await asyncio.to_thread(get_traffic_by_time_of_day, city)
+
+    url, params = build_table_request(*coords)
+    try:
+        status, data = await http.async_get_json(OSRM, url, params=params, endpoint='table')
+        if status == 200:
+            result = parse_table_response(data)
+            if result:
+                record_traffic(normalize_city(city), result)
+                return result
+        TRAFFIC_FALLBACKS.inc(reason='bad_response')
+        logger.warning("OSRM table for %s returned no data (HTTP %d)", city, status)
     except Exception as e:
-        pass
+        TRAFFIC_FALLBACKS.inc(reason='error')
+        logger.warning("OSRM table for %s failed: %r", city, e)
 
-    # Если не удалось получить данные, возвращаем оценку по времени суток
-    return get_traffic_by_time_of_day()
+    return await asyncio.to_thread(get_traffic_by_time_of_day, city)
+
+
+def get_sample_points(lat: float, lon: float) -> List[Tuple[float, float]]:
+    """
+    Возвращает точки вокруг центра города для выборки маршрутов:
+    по одной на севере, юге, западе и востоке на расстоянии SAMPLE_RADIUS_KM.
+    """
+    lat_offset = SAMPLE_RADIUS_KM / 111.0
+    lon_offset = SAMPLE_RADIUS_KM / (111.0 * max(math.cos(math.radians(lat)), 0.1))
+    return [
+        (lat + lat_offset, lon),
+        (lat - lat_offset, lon),
+        (lat, lon - lon_offset),
+        (lat, lon + lon_offset),
+    ]
+
+
+def build_table_request(lat: float, lon: float) -> Tuple[str, Dict[str, str]]:
+    """
+    Строит запрос матрицы OSRM (table) между точками выборки.
+    Один запрос даёт время и расстояние для всех пар точек, то есть сразу
+    несколько маршрутов через город вместо одного.
+    """
+    points = get_sample_points(lat, lon)
+    coordinates = ";".join(f"{point_lon},{point_lat}" for point_lat, point_lon in points)
+    url = f"{Config.OSRM_BASE_URL}/table/v1/driving/{coordinates}"
+    params = {"annotations": "duration,distance"}
+    return url, params
+
+
+def parse_table_response(data: dict) -> Optional[Dict[str, Any]]:
+    """
+    Вычисляет уровень пробок по матрице OSRM, None — если маршрутов нет.
+    Для каждой пары точек сравнивает время в пути с оптимальным
+    и берёт медиану, чтобы один неудачный маршрут не искажал оценку.
+    """
+    durations = data.get("durations")
+    distances = data.get("distances")
+    if data.get("code", "Ok") != "Ok" or not durations or not distances:
+        return None
+
+    ratios = []
+    for i, row in enumerate(durations):
+        for j, duration in enumerate(row):
+            distance = distances[i][j]
+            if i == j or duration is None or not distance:
+                continue
+            # Оптимальное время при скорости 60 км/ч
+            optimal_duration = (distance / 1000 / 60) * 3600
+            ratios.append(duration / optimal_duration)
+    if not ratios:
+        return None
+
+    # Коэффициент задержки
+    delay_ratio = statistics.median(ratios)
+
+    # Преобразуем в баллы от 1 до 10
+    level = min(10, max(1, int((delay_ratio - 1) * 5 + 1)))
+
+    return {
+        "status": 200,
+        "level": level,
+        "description": get_traffic_description(level),
+        "routes": len(ratios),
+    }
 
 
-def get_traffic_by_time_of_day() -> Dict[str, Any]:
+def get_traffic_by_time_of_day(city: Optional[str] = None) -> Dict[str, Any]:
     """
-    Возвращает оценку пробок на основе времени суток (часы пик).
+    Возвращает оценку пробок на основе времени суток.
     Используется как fallback, если не удалось получить реальные данные.
+    Если для города накоплены замеры за прошлые дни, берётся его обычный
+    уровень в этот час, иначе — общая оценка по часам пик.
     """
     hour = datetime.now().hour
 
+    baseline = hourly_baseline(normalize_city(city), SAMPLE_TRAFFIC, hour) if city else None
+    if baseline is not None:
+        level = min(10, max(1, round(baseline)))
     # Утренний час пик: 7-9
-    if 7 <= hour <= 9:
+    elif 7 <= hour <= 9:
         level = 8
     # Вечерний час пик: 17-20
     elif 17 <= hour <= 20:
@@ -122,7 +232,9 @@ def get_traffic_by_time_of_day() -> Dict[str, Any]:
     return {
         "status": 200,
         "level": level,
-        "description": get_traffic_description(level)
+        "description": get_traffic_description(level),
+        # Оценка, а не замер: не сравнивается с нормой в отчёте
+        "estimated": True,
     }
 
 
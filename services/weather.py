@@ -2,67 +2,384 @@ import sys
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
-import requests
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
+
 from config import Config
+from database import get_cached_geocode, save_geocode
+from metrics import UPSTREAM_ERRORS, register_cache
+from services.cache import FRESH, TTLCache
+from services.singleflight import FlightTimeoutError
+from services.cities import normalize_city
+from services.gazetteer import lookup_city
+from services import http
+from services.http import OPENWEATHERMAP
+from services.quota import BATCH, INTERACTIVE, QuotaExceededError, owm_quota
+from services.samples import record_weather
 
+# Кэш погоды по нормализованному названию города
+weather_cache = TTLCache(
+    maxsize=Config.WEATHER_CACHE_SIZE,
+    ttl=Config.WEATHER_CACHE_TTL,
+    stale_ttl=Config.WEATHER_CACHE_STALE_TTL,
+    wait_timeout=Config.COALESCE_WAIT_TIMEOUT,
+)
+register_cache('weather', weather_cache)
 
-def is_valid_city(city_name: str) -> bool:
-    """Проверяет существование города через OpenWeatherMap API"""
+# Максимум городов в одном запросе к групповому эндпоинту OpenWeatherMap
+GROUP_BATCH_SIZE = 20
+
+GEO_URL = f"{Config.OPENWEATHER_BASE_URL}/geo/1.0/direct"
+WEATHER_URL = f"{Config.OPENWEATHER_BASE_URL}/data/2.5/weather"
+GROUP_URL = f"{Config.OPENWEATHER_BASE_URL}/data/2.5/group"
+
+
+# Метки эндпоинтов OpenWeatherMap в метриках
+ENDPOINTS = {GEO_URL: 'geo', WEATHER_URL: 'weather', GROUP_URL: 'group'}
+
+
+def take_quota(priority: str, endpoint: str) -> None:
+    """
+    Списывает из общей квоты OpenWeatherMap один запрос.
+    Пакетные запросы ждут освобождения квоты, интерактивные — нет.
+    """
+    timeout = Config.OWM_BATCH_QUOTA_WAIT if priority == BATCH else 0
+    if not owm_quota.acquire(priority, timeout=timeout):
+        UPSTREAM_ERRORS.inc(service=OPENWEATHERMAP, endpoint=endpoint, reason='quota')
+        raise QuotaExceededError(priority)
+
+
+def owm_get(url: str, params: dict, priority: str, read_timeout: Optional[float] = None):
+    """Запрос к OpenWeatherMap: квота списывается за каждую попытку, включая повторы"""
+    endpoint = ENDPOINTS.get(url, 'other')
+    return http.get(
+        OPENWEATHERMAP, url, params=params, read_timeout=read_timeout, endpoint=endpoint,
+        before_attempt=lambda: take_quota(priority, endpoint),
+    )
+
+
+async def async_owm_get_json(url: str, params: dict) -> Tuple[int, Any]:
+    """Асинхронный запрос к OpenWeatherMap с учётом квоты (только интерактивный приоритет)"""
+    endpoint = ENDPOINTS.get(url, 'other')
+    return await http.async_get_json(
+        OPENWEATHERMAP, url, params=params, endpoint=endpoint,
+        before_attempt=lambda: take_quota(INTERACTIVE, endpoint),
+    )
+
+
+def resolve_city(city_name: str, priority: str = INTERACTIVE) -> Optional[Dict[str, Any]]:
+    """
+    Находит город по офлайн-справочнику или через геокодинг OpenWeatherMap
+    с кэшированием в базе.
+
+    Возвращает словарь с полями name, lat, lon, city_id или None, если город не найден.
+    Отрицательные ответы тоже кэшируются, но на меньшее время.
+    """
     if not city_name or len(city_name.strip()) < 2:
-        return False
+        return None
+
+    query = normalize_city(city_name)
+    cached = get_cached_geocode(query)
+    if cached is not None:
+        if not cached['found']:
+            return None
+        if cached['city_id'] is None:
+            # Записи, сохранённые до появления city_id, дополняем при обращении
+            cached['city_id'] = lookup_city_id(query, cached['lat'], cached['lon'], priority)
+            if cached['city_id'] is not None:
+                save_geocode(query, **cached)
+        return cached
+
+    place = lookup_city(city_name)
+    if place:
+        # Координаты из справочника заменяют геокодинг. В поставляемом наборе городов
+        # id нет, поэтому id OpenWeatherMap даёт один запрос погоды по координатам,
+        # который заодно прогревает кэш погоды. В справочнике, собранном из GeoNames,
+        # id уже есть и совпадает с id OpenWeatherMap — тогда запросов к API нет
+        result = {'found': True, 'name': place.name, 'lat': place.lat, 'lon': place.lon, 'city_id': place.city_id}
+        if result['city_id'] is None:
+            result['city_id'] = lookup_city_id(query, place.lat, place.lon, priority)
+        save_geocode(query, **result)
+        return result
+
+    try:
+        response = owm_get(GEO_URL, geo_params(city_name), priority, read_timeout=5)
+        if response.status_code != 200:
+            return None
+        data = response.json()
+    except Exception:
+        # Сетевые ошибки не кэшируем: город может существовать
+        return None
+
+    result = parse_geo(data)
+    if result is None:
+        save_geocode(query, found=False)
+        return None
+
+    result['city_id'] = lookup_city_id(query, result['lat'], result['lon'], priority)
+    save_geocode(query, **result)
+    return result
 
-    url = "http://api.openweathermap.org/geo/1.0/direct"
-    params = {
+
+def geo_params(city_name: str) -> dict:
+    return {
         "q": city_name.strip(),
         "limit": 1,
         "appid": Config.OPENWEATHER_API_KEY
     }
 
+
+def parse_geo(data: list) -> Optional[Dict[str, Any]]:
+    """Разбирает ответ геокодинга, None — город не найден"""
+    if not data:
+        return None
+    place = data[0]
+    return {
+        'found': True,
+        'name': place.get('local_names', {}).get('ru', place['name']),
+        'lat': place['lat'],
+        'lon': place['lon'],
+    }
+
+
+def weather_params(**query: Any) -> dict:
+    return {
+        **query,
+        "appid": Config.OPENWEATHER_API_KEY,
+        "units": "metric",
+        "lang": "ru"
+    }
+
+
+def lookup_city_id(query: str, lat: float, lon: float, priority: str = INTERACTIVE) -> Optional[int]:
+    """
+    Получает id города OpenWeatherMap по координатам.
+    Геокодинг id не возвращает, а запрос погоды по координатам — возвращает,
+    поэтому заодно кладём полученную погоду в кэш.
+    """
     try:
-        response = requests.get(url, params=params, timeout=5)
-        if response.status_code == 200:
-            data = response.json()
-            return len(data) > 0
-        return False
+        response = owm_get(WEATHER_URL, weather_params(lat=lat, lon=lon), priority, read_timeout=5)
+        response.raise_for_status()
+        data = response.json()
+        weather = parse_weather(data)
+        weather_cache.set(query, weather)
+        record_weather(query, weather)
+        return data["id"]
     except Exception:
-        return False
-    
+        return None
+
+
+def is_valid_city(city_name: str) -> bool:
+    """
+    Проверяет существование города.
+    Сначала ищет в офлайн-справочнике, затем через геокодинг OpenWeatherMap.
+    """
+    if lookup_city(city_name):
+        return True
+    return resolve_city(city_name) is not None
 
-def get_weather(city: str) -> dict:
-    """Получает погоду и записывает данные в result."""
+
+def get_weather(city: str, priority: str = INTERACTIVE) -> dict:
+    """
+    Получает погоду для города с учётом кэша.
+    Устаревшие данные отдаются сразу, а свежие запрашиваются в фоне.
+    priority — класс запроса для квоты OpenWeatherMap (INTERACTIVE или BATCH).
+    """
     if not city or not isinstance(city, str):
         return {
             'status': 500,
             'exception': 'Invalid city parameter'
         }
 
-    url = "https://api.openweathermap.org/data/2.5/weather"
-    params = {
-        "q": city.strip(),
-        "appid": Config.OPENWEATHER_API_KEY,
-        "units": "metric",
-        "lang": "ru"
-    }
+    key = normalize_city(city)
+    try:
+        # Пакетная загрузка может долго ждать квоту, поэтому команды пользователей
+        # к ней не присоединяются: загрузки объединяются отдельно по приоритету
+        return weather_cache.get_or_load(
+            key,
+            lambda: fetch_weather(city, priority),
+            cacheable=lambda result: result['status'] == 200,
+            flight_key=(key, priority),
+        )
+    except FlightTimeoutError as e:
+        return {
+            'status': 500,
+            'exception': e
+        }
+
 
+def fetch_weather(city: str, priority: str = INTERACTIVE) -> dict:
+    """Запрашивает погоду в OpenWeatherMap без кэша."""
     try:
-        response = requests.get(url, params=params, timeout=10)
+        response = owm_get(WEATHER_URL, weather_params(q=city.strip()), priority)
         response.raise_for_status() 
 
-        data = response.json()
+        weather = parse_weather(response.json())
+        record_weather(normalize_city(city), weather)
+        return weather
+
+    except Exception as e:
+        return {
+            'status': 500,
+            'exception': e
+        }
+
+
+def parse_weather(data: dict) -> dict:
+    """Преобразует ответ OpenWeatherMap о погоде в город в словарь результата"""
+    return {
+        'status': 200,
+        'city': data["name"],
+        'temp': data["main"]["temp"],
+        'feels_like': data["main"]["feels_like"],
+        'description': data["weather"][0]["description"].capitalize()
+    }
+
+
+def get_weather_batch(cities: Dict[str, Tuple[str, Optional[int]]], priority: str = BATCH) -> Dict[str, dict]:
+    """
+    Получает погоду сразу для многих городов.
+
+    cities: нормализованный ключ -> (название, id города в OpenWeatherMap).
+    Свежие данные берутся из кэша, города с известным id запрашиваются пачками
+    через групповой эндпоинт (до GROUP_BATCH_SIZE городов за запрос),
+    остальные — по одному через get_weather.
+    """
+    results = {}
+    by_id: Dict[int, List[str]] = {}
+    for key, (city, city_id) in cities.items():
+        value, state = weather_cache.lookup(key)
+        if state == FRESH:
+            results[key] = value
+        elif city_id is not None:
+            by_id.setdefault(city_id, []).append(key)
+
+    ids = list(by_id)
+    for start in range(0, len(ids), GROUP_BATCH_SIZE):
+        chunk = ids[start:start + GROUP_BATCH_SIZE]
+        for city_id, weather in fetch_weather_group(chunk, priority).items():
+            for key in by_id.get(city_id, []):
+                weather_cache.set(key, weather)
+                record_weather(key, weather)
+                results[key] = weather
+
+    # Города без id и те, что не вернул групповой запрос
+    for key, (city, _) in cities.items():
+        if key not in results:
+            results[key] = get_weather(city, priority)
+    return results
+
+
+def fetch_weather_group(city_ids: List[int], priority: str = BATCH) -> Dict[int, dict]:
+    """Запрашивает погоду для нескольких городов одним запросом по их id"""
+    params = weather_params(id=",".join(str(city_id) for city_id in city_ids))
+    try:
+        response = owm_get(GROUP_URL, params, priority)
+        response.raise_for_status()
+        return {item["id"]: parse_weather(item) for item in response.json().get("list", [])}
+    except Exception:
+        return {}
+
+
+async def async_resolve_city(city_name: str) -> Optional[Dict[str, Any]]:
+    """Асинхронная версия resolve_city через общий HTTP-клиент"""
+    if not city_name or len(city_name.strip()) < 2:
+        return None
+
+    query = normalize_city(city_name)
+    cached = await asyncio.to_thread(get_cached_geocode, query)
+    if cached is not None:
+        if not cached['found']:
+            return None
+        if cached['city_id'] is None:
+            cached['city_id'] = await async_lookup_city_id(query, cached['lat'], cached['lon'])
+            if cached['city_id'] is not None:
+                await asyncio.to_thread(save_geocode, query, **cached)
+        return cached
+
+    place = lookup_city(city_name)
+    if place:
+        # Как в resolve_city: у городов поставляемого набора id нет, его даёт запрос погоды
+        result = {'found': True, 'name': place.name, 'lat': place.lat, 'lon': place.lon, 'city_id': place.city_id}
+        if result['city_id'] is None:
+            result['city_id'] = await async_lookup_city_id(query, place.lat, place.lon)
+        await asyncio.to_thread(save_geocode, query, **result)
+        return result
+
+    try:
+        status, data = await async_owm_get_json(GEO_URL, geo_params(city_name))
+        if status != 200:
+            return None
+    except Exception:
+        return None
+
+    result = parse_geo(data)
+    if result is None:
+        await asyncio.to_thread(save_geocode, query, found=False)
+        return None
+
+    result['city_id'] = await async_lookup_city_id(query, result['lat'], result['lon'])
+    await asyncio.to_thread(save_geocode, query, **result)
+    return result
+
+
+async def async_lookup_city_id(query: str, lat: float, lon: float) -> Optional[int]:
+    """Асинхронная версия lookup_city_id"""
+    try:
+        status, data = await async_owm_get_json(WEATHER_URL, weather_params(lat=lat, lon=lon))
+        if status != 200:
+            return None
+        weather = parse_weather(data)
+        weather_cache.set(query, weather)
+        record_weather(query, weather)
+        return data["id"]
+    except Exception:
+        return None
+
+
+async def async_is_valid_city(city_name: str) -> bool:
+    """Асинхронная версия is_valid_city"""
+    if lookup_city(city_name):
+        return True
+    return await async_resolve_city(city_name) is not None
+
+
+async def async_get_weather(city: str) -> dict:
+    """Асинхронная версия get_weather, использует тот же кэш"""
+    if not city or not isinstance(city, str):
+        return {
+            'status': 500,
+            'exception': 'Invalid city parameter'
+        }
+
+    try:
+        return await weather_cache.get_or_load_async(
+            normalize_city(city),
+            lambda: async_fetch_weather(city),
+            cacheable=lambda result: result['status'] == 200
+        )
+    except FlightTimeoutError as e:
         return {
-            'status': 200,
-            'city': data["name"],
-            'temp': data["main"]["temp"],
-            'feels_like': data["main"]["feels_like"],
-            'description': data["weather"][0]["description"].capitalize()
+            'status': 500,
+            'exception': e
         }
 
 
+async def async_fetch_weather(city: str) -> dict:
+    """Асинхронно запрашивает погоду в OpenWeatherMap без кэша"""
+    try:
+        status, data = await async_owm_get_json(WEATHER_URL, weather_params(q=city.strip()))
+        if status != 200:
+            raise RuntimeError(f"OpenWeatherMap responded with {status}")
+        weather = parse_weather(data)
+        record_weather(normalize_city(city), weather)
+        return weather
     except Exception as e:
         return {
             'status': 500,
             'exception': e
         }
-    
+
+
 if __name__ == "__main__":
     print(get_weather('Krasnodar'))
\ No newline at end of file
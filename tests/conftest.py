@@ -0,0 +1,23 @@
+import os
+import tempfile
+
+import pytest
+
+# Тесты работают с отдельной временной базой и журналом, а не с файлами из окружения или .env
+TEST_DIR = tempfile.mkdtemp(prefix='bot-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(TEST_DIR, 'test.db')
+os.environ['LOG_DIR'] = os.path.join(TEST_DIR, 'logs')
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '1:test')
+
+
+@pytest.fixture
+def db():
+    """Схема базы актуальной версии; после теста все таблицы очищаются"""
+    import database
+
+    database.run_migrations()
+    yield database
+    with database.engine.begin() as connection:
+        for table in reversed(database.Base.metadata.sorted_tables):
+            connection.execute(table.delete())
+    database.chat_state_cache.clear()
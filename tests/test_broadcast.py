@@ -0,0 +1,101 @@
+import pytest
+import requests
+from telebot.apihelper import ApiTelegramException
+
+from services import broadcast
+from services.broadcast import (
+    PERMANENT, REJECTED, TRANSIENT, Broadcaster, classify_error, get_migrate_to_chat_id, get_retry_after,
+)
+
+
+def telegram_error(error_code, description, parameters=None):
+    result_json = {'ok': False, 'error_code': error_code, 'description': description}
+    if parameters:
+        result_json['parameters'] = parameters
+    return ApiTelegramException('sendMessage', None, result_json)
+
+
+@pytest.mark.parametrize('error, kind', [
+    (telegram_error(403, 'Forbidden: bot was blocked by the user'), PERMANENT),
+    (telegram_error(403, 'Forbidden: bot was kicked from the group chat'), PERMANENT),
+    (telegram_error(400, 'Bad Request: chat not found'), PERMANENT),
+    (telegram_error(400, 'Bad Request: group chat was deleted'), PERMANENT),
+    (telegram_error(400, 'Bad Request: message is too long'), REJECTED),
+    (telegram_error(400, "Bad Request: can't parse entities"), REJECTED),
+    (telegram_error(429, 'Too Many Requests: retry after 5', {'retry_after': 5}), TRANSIENT),
+    (telegram_error(502, 'Bad Gateway'), TRANSIENT),
+    (requests.ConnectionError('connection reset'), TRANSIENT),
+])
+def test_classify_error(error, kind):
+    assert classify_error(error) == kind
+
+
+def test_error_parameters():
+    migrated = telegram_error(400, 'Bad Request: group chat was upgraded to a supergroup chat',
+                              {'migrate_to_chat_id': -1001})
+    flood = telegram_error(429, 'Too Many Requests: retry after 7', {'retry_after': 7})
+
+    assert get_migrate_to_chat_id(migrated) == -1001
+    assert get_migrate_to_chat_id(flood) is None
+    assert get_retry_after(flood) == 7
+    assert get_retry_after(migrated) is None
+
+
+class FakeBot:
+    """Отправка, которая для каждого чата по очереди выдаёт заданные ошибки, затем успех"""
+
+    def __init__(self, errors):
+        self.errors = {chat_id: list(chat_errors) for chat_id, chat_errors in errors.items()}
+        self.sent = []
+
+    def send(self, chat_id, text):
+        chat_errors = self.errors.get(chat_id)
+        if chat_errors:
+            raise chat_errors.pop(0)
+        self.sent.append((chat_id, text))
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(broadcast.time, 'sleep', lambda seconds: None)
+
+
+def test_broadcaster_handles_each_kind():
+    bot = FakeBot({
+        1: [telegram_error(403, 'Forbidden: bot was blocked by the user')],
+        2: [telegram_error(400, 'Bad Request: message is too long')],
+        3: [requests.ConnectionError('connection reset')],
+        4: [telegram_error(400, 'Bad Request: group chat was upgraded to a supergroup chat',
+                           {'migrate_to_chat_id': 40})],
+    })
+    failures = []
+    migrations = []
+    broadcaster = Broadcaster(
+        bot.send, workers=2, rate=1000, max_retries=2,
+        on_failure=lambda chat_id, e: failures.append((chat_id, classify_error(e))),
+        on_migrate=lambda old, new: migrations.append((old, new)),
+    )
+
+    stats = broadcaster.run([(chat_id, 'report') for chat_id in (1, 2, 3, 4, 5)])
+
+    assert sorted(bot.sent) == [(3, 'report'), (5, 'report'), (40, 'report')]
+    assert sorted(failures) == [(1, PERMANENT), (2, REJECTED)]
+    assert migrations == [(4, 40)]
+    assert stats['sent'] == 3
+    assert stats['failed_permanent'] == 1
+    assert stats['failed_rejected'] == 1
+    assert stats['retried'] == 1
+    assert stats['migrated'] == 1
+
+
+def test_broadcaster_gives_up_after_max_retries():
+    bot = FakeBot({1: [requests.ConnectionError('connection reset')] * 3})
+    failures = []
+    broadcaster = Broadcaster(bot.send, workers=1, rate=1000, max_retries=2)
+
+    stats = broadcaster.run([(1, 'report')], on_failure=lambda chat_id, e: failures.append(chat_id))
+
+    assert bot.sent == []
+    assert failures == [1]
+    assert stats['retried'] == 2
+    assert stats['failed_transient'] == 1
@@ -0,0 +1,114 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from services import cache
+from services.cache import FRESH, MISS, STALE, TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache, 'time', clock)
+    return clock
+
+
+def test_expiry(clock):
+    ttl_cache = TTLCache(maxsize=10, ttl=60, stale_ttl=30)
+    ttl_cache.set('key', 'value')
+
+    clock.now += 59
+    assert ttl_cache.lookup('key') == ('value', FRESH)
+    clock.now += 1
+    assert ttl_cache.lookup('key') == ('value', STALE)
+    clock.now += 30
+    assert ttl_cache.lookup('key') == (None, MISS)
+    assert len(ttl_cache) == 0
+
+
+def test_without_ttl_entries_do_not_expire(clock):
+    ttl_cache = TTLCache(maxsize=10, ttl=None)
+    ttl_cache.set('key', 'value')
+    clock.now += 10 ** 6
+    assert ttl_cache.lookup('key') == ('value', FRESH)
+
+
+def test_lru_eviction(clock):
+    ttl_cache = TTLCache(maxsize=2, ttl=60)
+    ttl_cache.set('a', 1)
+    ttl_cache.set('b', 2)
+    # Обращение к 'a' делает её недавно использованной, вытесняется 'b'
+    assert ttl_cache.get('a') == 1
+    ttl_cache.set('c', 3)
+
+    assert ttl_cache.get('b') is None
+    assert ttl_cache.get('a') == 1
+    assert ttl_cache.get('c') == 3
+    assert ttl_cache.stats()['evictions'] == 1
+
+
+def test_stale_value_returned_while_refreshing(clock):
+    ttl_cache = TTLCache(maxsize=10, ttl=60, stale_ttl=60)
+    ttl_cache.set('key', 'old')
+    clock.now += 90
+
+    release = threading.Event()
+
+    def loader():
+        release.wait(5)
+        return 'new'
+
+    # Устаревшее значение отдаётся сразу, повторный промах не запускает второе обновление
+    assert ttl_cache.get_or_load('key', loader) == 'old'
+    assert ttl_cache.get_or_load('key', lambda: pytest.fail('second refresh')) == 'old'
+
+    release.set()
+    # Обновление идёт в общем пуле: ждём, пока оно сохранит новое значение
+    for _ in range(500):
+        if ttl_cache.lookup('key') == ('new', FRESH):
+            break
+        time.sleep(0.01)
+    assert ttl_cache.lookup('key') == ('new', FRESH)
+    assert ttl_cache.stats()['stale_hits'] >= 2
+
+
+def test_stale_value_returned_while_refreshing_async(clock):
+    ttl_cache = TTLCache(maxsize=10, ttl=60, stale_ttl=60)
+    ttl_cache.set('key', 'old')
+    clock.now += 90
+
+    async def loader():
+        return 'new'
+
+    async def scenario():
+        assert await ttl_cache.get_or_load_async('key', loader) == 'old'
+        # Даём фоновой задаче выполниться
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        return ttl_cache.lookup('key')
+
+    assert asyncio.run(scenario()) == ('new', FRESH)
+
+
+def test_uncacheable_results_are_not_stored(clock):
+    ttl_cache = TTLCache(maxsize=10, ttl=60)
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return {'status': 500}
+
+    for _ in range(2):
+        assert ttl_cache.get_or_load('key', loader, cacheable=lambda result: result['status'] == 200) == {'status': 500}
+    assert len(calls) == 2
+    assert ttl_cache.get('key') is None
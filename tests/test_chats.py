@@ -0,0 +1,12 @@
+def test_save_chat_reactivates_with_fresh_city(db):
+    db.save_chat(1, 'private')
+    db.update_city(1, 'Казань', city_id=551487, lat=55.79, lon=49.12)
+    db.deactivate_chat(1)
+
+    assert db.save_chat(1, 'private')
+
+    with db.SessionLocal() as session:
+        chat = session.get(db.Chat, 1)
+        assert (chat.city, chat.city_id, chat.lat, chat.lon, chat.is_active) == ('Москва', None, None, None, True)
+    assert db.is_active_chat(1)
+    assert db.get_city_name(1) == 'Москва'
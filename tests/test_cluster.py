@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from services.cluster import LeaderElection, count_sending_nodes
+
+
+def expire(db, name):
+    """Имитирует процесс, который перестал продлевать аренду"""
+    with db.SessionLocal() as session:
+        session.execute(update(db.Lease).where(db.Lease.name == name)
+                        .values(expires_at=datetime.now() - timedelta(seconds=1)))
+        session.commit()
+
+
+def test_lease_is_exclusive_until_expired(db):
+    assert db.acquire_lease('scheduler', 'node-a', 60)
+    assert not db.acquire_lease('scheduler', 'node-b', 60)
+    # Владелец продлевает свою аренду
+    assert db.acquire_lease('scheduler', 'node-a', 60)
+
+    expire(db, 'scheduler')
+    assert db.acquire_lease('scheduler', 'node-b', 60)
+    assert not db.acquire_lease('scheduler', 'node-a', 60)
+
+
+def test_release_only_by_owner(db):
+    assert db.acquire_lease('scheduler', 'node-a', 60)
+    db.release_lease('scheduler', 'node-b')
+    assert not db.acquire_lease('scheduler', 'node-b', 60)
+
+    db.release_lease('scheduler', 'node-a')
+    assert db.acquire_lease('scheduler', 'node-b', 60)
+
+
+def test_count_sending_nodes(db):
+    assert count_sending_nodes() == 1
+    db.acquire_lease('broadcast:1:0', 'node-a/1', 60)
+    db.acquire_lease('broadcast:1:1', 'node-a/2', 60)
+    db.acquire_lease('broadcast:1:2', 'node-b/3', 60)
+    db.acquire_lease('scheduler', 'node-c', 60)
+    assert count_sending_nodes() == 2
+
+    expire(db, 'broadcast:1:2')
+    assert count_sending_nodes() == 1
+
+
+class Node:
+    """Участник выборов, записывающий смену своей роли"""
+
+    def __init__(self, owner, ttl=60):
+        self.events = []
+        self.election = LeaderElection(
+            'scheduler', ttl,
+            on_elected=lambda: self.events.append('elected'),
+            on_demoted=lambda: self.events.append('demoted'),
+            owner=owner,
+        )
+
+
+def test_leader_election_failover(db):
+    first, second = Node('node-a'), Node('node-b')
+
+    first.election._check()
+    second.election._check()
+    assert first.election.is_leader and not second.election.is_leader
+
+    # Лидер завис и не продлил аренду: после ttl лидером становится другой процесс
+    expire(db, 'scheduler')
+    second.election._check()
+    first.election._check()
+
+    assert first.events == ['elected', 'demoted']
+    assert second.events == ['elected']
+
+
+def test_leader_election_stop_hands_over(db):
+    first, second = Node('node-a'), Node('node-b')
+    first.election.start()
+    second.election._check()
+    assert first.election.is_leader and not second.election.is_leader
+
+    first.election.stop()
+    second.election._check()
+
+    assert first.events == ['elected', 'demoted']
+    assert second.election.is_leader
+
+
+def test_leader_is_demoted_when_database_fails(db, monkeypatch):
+    node = Node('node-a')
+    node.election._check()
+
+    def broken(*args):
+        raise ConnectionError('database is unavailable')
+
+    monkeypatch.setattr('services.cluster.acquire_lease', broken)
+    node.election._check()
+
+    assert not node.election.is_leader
+    assert node.events == ['elected', 'demoted']
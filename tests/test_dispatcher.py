@@ -0,0 +1,97 @@
+import threading
+import time
+
+from services.dispatcher import ChatDispatcher
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'condition not reached'
+        time.sleep(0.005)
+
+
+def test_tasks_of_one_chat_run_in_order():
+    done = []
+    lock = threading.Lock()
+    running = set()
+    overlaps = []
+
+    def handle(task):
+        chat, number = task
+        with lock:
+            if chat in running:
+                overlaps.append(task)
+            running.add(chat)
+        time.sleep(0.001)
+        with lock:
+            running.discard(chat)
+            done.append(task)
+
+    dispatcher = ChatDispatcher(handle, workers=4, queue_size=1000, name='test-order')
+    for number in range(50):
+        for chat in ('a', 'b', 'c'):
+            assert dispatcher.submit(chat, (chat, number))
+
+    wait_until(lambda: len(done) == 150)
+    for chat in ('a', 'b', 'c'):
+        assert [number for task_chat, number in done if task_chat == chat] == list(range(50))
+    assert overlaps == []
+    assert dispatcher.stats()['queued'] == 0
+    assert dispatcher.stats()['chats'] == 0
+
+
+def test_slow_chat_does_not_block_others():
+    release = threading.Event()
+    done = []
+
+    def handle(task):
+        if task == 'slow':
+            release.wait(5)
+        done.append(task)
+
+    dispatcher = ChatDispatcher(handle, workers=2, queue_size=100, name='test-slow')
+    dispatcher.submit('a', 'slow')
+    dispatcher.submit('a', 'after slow')
+    dispatcher.submit('b', 'fast')
+
+    wait_until(lambda: 'fast' in done)
+    assert 'after slow' not in done
+    release.set()
+    wait_until(lambda: len(done) == 3)
+    assert done.index('slow') < done.index('after slow')
+
+
+def test_sheds_tasks_over_capacity():
+    release = threading.Event()
+    done = []
+
+    def handle(task):
+        release.wait(5)
+        done.append(task)
+
+    dispatcher = ChatDispatcher(handle, workers=1, queue_size=3, name='test-shed')
+    accepted = [dispatcher.submit(chat, chat) for chat in range(5)]
+
+    assert accepted == [True, True, True, False, False]
+    assert dispatcher.stats()['shed'] == 2
+    release.set()
+    wait_until(lambda: len(done) == 3)
+    # После разбора очереди задачи снова принимаются
+    wait_until(lambda: dispatcher.stats()['queued'] == 0)
+    assert dispatcher.submit(5, 5)
+
+
+def test_failed_task_does_not_stop_the_chat():
+    done = []
+
+    def handle(task):
+        if task == 'broken':
+            raise ValueError('handler failed')
+        done.append(task)
+
+    dispatcher = ChatDispatcher(handle, workers=1, queue_size=10, name='test-failure')
+    dispatcher.submit('a', 'broken')
+    dispatcher.submit('a', 'next')
+
+    wait_until(lambda: done == ['next'])
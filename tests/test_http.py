@@ -0,0 +1,93 @@
+import asyncio
+import json
+
+import pytest
+import requests
+
+from config import Config
+from services import http
+
+
+class FakeSession:
+    """Сессия requests, которая отвечает заранее заданными результатами"""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = 0
+
+    def get(self, url, params=None, timeout=None):
+        self.calls += 1
+        result = self.results.pop(0)
+        if isinstance(result, BaseException):
+            raise result
+        response = requests.Response()
+        response.status_code = result
+        return response
+
+
+class FakeAsyncResponse:
+    status = 200
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def json(self, content_type=None):
+        raise json.JSONDecodeError('Expecting value', '<html>', 0)
+
+
+class FakeAsyncSession:
+    def get(self, url, params=None):
+        return FakeAsyncResponse()
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    monkeypatch.setattr(Config, 'HTTP_RETRIES', 0)
+    monkeypatch.setattr(Config, 'BREAKER_FAILURE_THRESHOLD', 1)
+    monkeypatch.setattr(Config, 'BREAKER_RESET_TIMEOUT', 60)
+    monkeypatch.setattr(http, '_breakers', {})
+    breaker = http.get_breaker('test')
+    breaker.record_failure()
+    # Время размыкания сдвигается в прошлое, чтобы следующий запрос стал пробным
+    breaker.opened_at -= Config.BREAKER_RESET_TIMEOUT
+    return breaker
+
+
+def test_half_open_trial_with_unexpected_error_reopens(monkeypatch, breaker):
+    monkeypatch.setattr(http, 'get_session', lambda service: FakeSession(requests.exceptions.ChunkedEncodingError()))
+
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        http.get('test', 'http://upstream/')
+
+    assert breaker.state == http.CircuitBreaker.OPEN
+    with pytest.raises(http.CircuitOpenError):
+        http.get('test', 'http://upstream/')
+
+
+def test_half_open_trial_success_closes(monkeypatch, breaker):
+    monkeypatch.setattr(http, 'get_session', lambda service: FakeSession(200))
+
+    assert http.get('test', 'http://upstream/').status_code == 200
+    assert breaker.state == http.CircuitBreaker.CLOSED
+
+
+def test_async_trial_with_broken_json_reopens(monkeypatch, breaker):
+    monkeypatch.setattr(http, 'get_async_session', FakeAsyncSession)
+
+    with pytest.raises(json.JSONDecodeError):
+        asyncio.run(http.async_get_json('test', 'http://upstream/'))
+
+    assert breaker.state == http.CircuitBreaker.OPEN
+
+
+def test_stuck_half_open_trial_is_replaced_after_timeout(breaker):
+    assert breaker.allow()
+    assert breaker.state == http.CircuitBreaker.HALF_OPEN
+    # Исход пробного запроса не записан: пока не прошёл reset_timeout, запросы не пропускаются
+    assert not breaker.allow()
+
+    breaker.opened_at -= Config.BREAKER_RESET_TIMEOUT
+    assert breaker.allow()
@@ -0,0 +1,35 @@
+import pytest
+
+import metrics
+from config import Config
+
+
+@pytest.fixture
+def profiler_enabled(monkeypatch):
+    monkeypatch.setattr(Config, 'PROFILER_ENABLED', True)
+    monkeypatch.setattr(metrics, 'profile', lambda seconds, interval: f'{seconds} {interval}\n')
+
+
+@pytest.mark.parametrize('query', [
+    'seconds=abc', 'interval=fast', 'seconds=-1', 'seconds=0', 'interval=0', 'seconds=nan', 'seconds=inf',
+])
+def test_profile_rejects_bad_parameters(profiler_enabled, query):
+    status, _, _ = metrics.handle_request(f'/debug/profile?{query}')
+    assert status == 400
+
+
+def test_profile_clamps_parameters(profiler_enabled):
+    assert metrics.handle_request('/debug/profile?seconds=600&interval=0.00001')[::2] == (200, '60 0.001\n')
+    assert metrics.handle_request('/debug/profile')[::2] == (200, '10.0 0.01\n')
+
+
+def test_profile_disabled(monkeypatch):
+    monkeypatch.setattr(Config, 'PROFILER_ENABLED', False)
+    assert metrics.handle_request('/debug/profile?seconds=1')[0] == 404
+
+
+def test_metrics_endpoint():
+    status, content_type, body = metrics.handle_request('/metrics')
+    assert status == 200
+    assert content_type.startswith('text/plain; version=0.0.4')
+    assert '# TYPE' in body
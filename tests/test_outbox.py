@@ -0,0 +1,127 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select, update
+
+from config import Config
+from services import report
+
+
+@pytest.fixture
+def chats(db):
+    for chat_id, city in ((1, 'Москва'), (2, 'Москва'), (3, 'Казань'), (4, 'Казань')):
+        db.save_chat(chat_id, 'private', city)
+    return db
+
+
+def statuses(db, run_id):
+    with db.SessionLocal() as session:
+        stmt = select(db.Delivery.chat_id, db.Delivery.status).where(db.Delivery.run_id == run_id)
+        return dict(session.execute(stmt).all())
+
+
+def claim_all(db, run_id, claim_timeout=600):
+    return [row for shard in range(db.get_run_shards(run_id)) for row in
+            db.claim_deliveries(run_id, shard, 100, claim_timeout)]
+
+
+class FakeDeliver:
+    """deliver для drain_run: первая отправка в чаты из fail завершается их ошибкой"""
+
+    def __init__(self, fail=None):
+        self.fail = fail or {}
+        self.sent = []
+
+    def __call__(self, batch, on_success, on_failure):
+        for chat_id, text in batch:
+            if chat_id in self.fail:
+                on_failure(chat_id, self.fail.pop(chat_id))
+            else:
+                self.sent.append((chat_id, text))
+                on_success(chat_id)
+
+
+def test_start_run_is_idempotent(chats):
+    run_id, created = chats.start_broadcast_run('daily_report:test', shards=2)
+    assert created
+    assert chats.start_broadcast_run('daily_report:test', shards=2) == (run_id, False)
+    assert statuses(chats, run_id) == {1: 'pending', 2: 'pending', 3: 'pending', 4: 'pending'}
+
+
+def test_claim_takes_each_row_once(chats):
+    run_id, _ = chats.start_broadcast_run('daily_report:test', shards=2)
+
+    first = claim_all(chats, run_id)
+    assert sorted(chat_id for _, chat_id, _ in first) == [1, 2, 3, 4]
+    # Забранные строки не отдаются повторно, пока не истёк claim_timeout
+    assert claim_all(chats, run_id) == []
+    assert set(statuses(chats, run_id).values()) == {'sending'}
+
+
+def test_reschedule_retries_transient_and_fails_permanent(chats):
+    run_id, _ = chats.start_broadcast_run('daily_report:test')
+    ids = {chat_id: delivery_id for delivery_id, chat_id, _ in claim_all(chats, run_id)}
+
+    chats.complete_deliveries([ids[1]])
+    retried = chats.reschedule_deliveries(
+        [(ids[2], 'timeout', False), (ids[3], 'chat not found', True)], max_attempts=2, backoff=60,
+    )
+
+    assert retried == 1
+    assert statuses(chats, run_id) == {1: 'done', 2: 'pending', 3: 'failed', 4: 'sending'}
+    # Повтор ещё не наступил
+    assert claim_all(chats, run_id) == []
+
+    with chats.SessionLocal() as session:
+        session.execute(update(chats.Delivery).where(chats.Delivery.id == ids[2])
+                        .values(next_attempt_at=datetime.now() - timedelta(seconds=1)))
+        session.commit()
+    assert [chat_id for _, chat_id, _ in claim_all(chats, run_id)] == [2]
+
+    # Вторая попытка была последней
+    assert chats.reschedule_deliveries([(ids[2], 'timeout', False)], max_attempts=2, backoff=60) == 0
+    assert statuses(chats, run_id)[2] == 'failed'
+
+
+def test_resume_after_crash(chats, monkeypatch):
+    run_id, _ = chats.start_broadcast_run('daily_report:test', shards=2)
+    chats.save_broadcast_messages(run_id, {'москва': 'отчёт Москва', 'казань': 'отчёт Казань'})
+    # Процесс забрал строки и упал, не отметив отправку
+    crashed = claim_all(chats, run_id)
+    assert len(crashed) == 4
+
+    deliver = FakeDeliver()
+    assert report.resume_broadcasts(deliver)[0]['pending'] == 0
+    # Пока не истёк claim_timeout, строки считаются отправляемыми упавшим процессом
+    assert deliver.sent == []
+
+    monkeypatch.setattr(Config, 'OUTBOX_CLAIM_TIMEOUT', 0)
+    results = report.resume_broadcasts(deliver)
+
+    assert sorted(deliver.sent) == [
+        (1, 'отчёт Москва'), (2, 'отчёт Москва'), (3, 'отчёт Казань'), (4, 'отчёт Казань'),
+    ]
+    assert results[0]['done'] == 4
+    assert results[0]['finished_at'] is not None
+    assert chats.get_unfinished_runs() == []
+
+
+def test_daily_report_resumes_with_stored_texts(chats, monkeypatch):
+    version = ['первый']
+    monkeypatch.setattr(report, 'fetch_city_data', lambda cities: {key: ({}, {}) for key in cities})
+    monkeypatch.setattr(report, 'render_report', lambda city, weather, traffic: f'{city}: {version[0]}')
+
+    failing = FakeDeliver(fail={3: ConnectionError('timeout')})
+    first = report.run_daily_report(failing)
+    assert first['run']['done'] == 3
+
+    # Повторный запуск в тот же день досылает оставшийся чат тем же текстом
+    with chats.SessionLocal() as session:
+        session.execute(update(chats.Delivery).values(next_attempt_at=datetime.now() - timedelta(seconds=1)))
+        session.commit()
+    version[0] = 'второй'
+    deliver = FakeDeliver()
+    second = report.run_daily_report(deliver)
+
+    assert deliver.sent == [(3, 'Казань: первый')]
+    assert second['run']['done'] == 4
@@ -0,0 +1,63 @@
+import threading
+
+from services import quota
+from services.quota import BATCH, INTERACTIVE, QuotaManager
+
+
+def test_two_managers_share_minute_limit(db):
+    first = QuotaManager('test', per_minute=5, per_day=0)
+    second = QuotaManager('test', per_minute=5, per_day=0)
+
+    granted = [first.acquire(), second.acquire(), first.acquire(), second.acquire(), first.acquire()]
+    assert granted == [True] * 5
+    assert not first.acquire()
+    assert not second.acquire()
+    assert first.stats()['minute_used'] == 5
+    assert second.stats()['minute_used'] == 5
+
+
+def test_two_managers_share_day_limit(db):
+    first = QuotaManager('test', per_minute=0, per_day=3)
+    second = QuotaManager('test', per_minute=0, per_day=3)
+
+    assert first.acquire() and second.acquire() and first.acquire()
+    # Суточная квота исчерпана: пакетный запрос не ждёт конца суток
+    assert not second.acquire(BATCH, timeout=60)
+    assert second.stats()['rejected_batch'] == 1
+
+
+def test_concurrent_managers_never_exceed_limit(db):
+    managers = [QuotaManager('test', per_minute=20, per_day=0) for _ in range(4)]
+    results = []
+
+    def worker(manager):
+        for _ in range(10):
+            results.append(manager.acquire())
+
+    threads = [threading.Thread(target=worker, args=(manager,)) for manager in managers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count(True) == 20
+
+
+def test_batch_leaves_room_for_interactive(db):
+    manager = QuotaManager('test', per_minute=4, per_day=0, batch_share=0.5)
+
+    assert manager.acquire(BATCH) and manager.acquire(BATCH)
+    assert not manager.acquire(BATCH)
+    assert manager.acquire(INTERACTIVE) and manager.acquire(INTERACTIVE)
+    assert not manager.acquire(INTERACTIVE)
+
+
+def test_batch_waits_for_next_minute(db, monkeypatch):
+    manager = QuotaManager('test', per_minute=1, per_day=0, batch_share=1)
+    now = [6000.0]
+    monkeypatch.setattr(quota.time, 'time', lambda: now[0])
+    monkeypatch.setattr(quota.time, 'sleep', lambda seconds: now.__setitem__(0, now[0] + seconds))
+
+    assert manager.acquire(BATCH)
+    assert manager.acquire(BATCH, timeout=61)
+    assert manager.waited == 60
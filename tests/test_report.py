@@ -0,0 +1,37 @@
+import threading
+
+from config import Config
+from services import report
+
+
+def test_fetch_city_data_loads_traffic_in_parallel(monkeypatch):
+    barrier = threading.Barrier(3, timeout=5)
+
+    def traffic(city):
+        # Все три города ждут друг друга: при последовательной загрузке барьер не пройти
+        barrier.wait()
+        return {'status': 200, 'city': city}
+
+    cities = {'a': ('A', 1), 'b': ('B', 2), 'c': ('C', None)}
+    monkeypatch.setattr(Config, 'PREFETCH_WORKERS', 3)
+    monkeypatch.setattr(report, 'get_weather_batch', lambda cities: {key: {'status': 200} for key in cities})
+    monkeypatch.setattr(report, 'get_traffic_level', traffic)
+
+    data = report.fetch_city_data(cities)
+
+    assert data == {key: ({'status': 200}, {'status': 200, 'city': city}) for key, (city, _) in cities.items()}
+
+
+def test_fetch_city_data_isolates_failures(monkeypatch):
+    def traffic(city):
+        if city == 'B':
+            raise ConnectionError('OSRM is down')
+        return {'status': 200}
+
+    monkeypatch.setattr(report, 'get_weather_batch', lambda cities: {key: {'status': 200} for key in cities})
+    monkeypatch.setattr(report, 'get_traffic_level', traffic)
+
+    data = report.fetch_city_data({'a': ('A', None), 'b': ('B', None)})
+
+    assert data['a'] == ({'status': 200}, {'status': 200})
+    assert data['b'][0]['status'] == 500 and data['b'][1]['status'] == 500
@@ -0,0 +1,92 @@
+import time
+from datetime import date, datetime, time as dt_time, timedelta
+
+import pytest
+
+from config import Config
+from services import samples
+from services.samples import SAMPLE_TEMP, SAMPLE_TRAFFIC, hourly_baseline, yesterday_value
+
+CITY = 'казань'
+
+
+@pytest.fixture
+def store(db):
+    # Замеры, оставшиеся в буфере от других тестов, не должны попасть в подсчёт
+    samples.sample_buffer.flush()
+    samples.trend_cache.clear()
+    yield samples.sample_buffer
+    samples.trend_cache.clear()
+
+
+def add(buffer, metric, value, ts):
+    buffer.add(CITY, metric, value, ts=int(ts))
+
+
+def hour_start(days_ago, hour):
+    return (datetime.combine(date.today(), dt_time(hour)) - timedelta(days=days_ago)).timestamp()
+
+
+def test_yesterday_value_averages_window(store):
+    now = time.time()
+    window = Config.SAMPLES_YESTERDAY_WINDOW
+    add(store, SAMPLE_TEMP, 10, now - 86400 - window / 2)
+    add(store, SAMPLE_TEMP, 14, now - 86400 + window / 2)
+    # Вне окна и другая метрика не учитываются
+    add(store, SAMPLE_TEMP, 40, now - 86400 - 2 * window)
+    add(store, SAMPLE_TEMP, 40, now - 3600)
+    add(store, SAMPLE_TRAFFIC, 9, now - 86400)
+    store.flush()
+
+    assert yesterday_value(CITY, SAMPLE_TEMP) == pytest.approx(12)
+    assert yesterday_value('другой город', SAMPLE_TEMP) is None
+
+
+def test_yesterday_value_is_cached(store):
+    assert yesterday_value(CITY, SAMPLE_TEMP) is None
+    add(store, SAMPLE_TEMP, 10, time.time() - 86400)
+    store.flush()
+    # Значение пересчитывается раз в несколько минут, а не для каждого чата
+    assert yesterday_value(CITY, SAMPLE_TEMP) is None
+    samples.trend_cache.clear()
+    assert yesterday_value(CITY, SAMPLE_TEMP) == 10
+
+
+def test_hourly_baseline_uses_same_hour_on_previous_days(store, monkeypatch):
+    monkeypatch.setattr(Config, 'SAMPLES_MIN_COUNT', 3)
+    monkeypatch.setattr(Config, 'SAMPLES_BASELINE_DAYS', 7)
+    for days_ago, level in ((1, 4), (2, 6), (3, 8)):
+        add(store, SAMPLE_TRAFFIC, level, hour_start(days_ago, 8) + 600)
+    # Другой час, сегодняшний день и замер старше SAMPLES_BASELINE_DAYS не входят в норму
+    add(store, SAMPLE_TRAFFIC, 10, hour_start(1, 9) + 600)
+    add(store, SAMPLE_TRAFFIC, 10, hour_start(0, 8) + 600)
+    add(store, SAMPLE_TRAFFIC, 10, hour_start(8, 8) + 600)
+    store.flush()
+
+    assert hourly_baseline(CITY, SAMPLE_TRAFFIC, 8) == pytest.approx(6)
+    assert hourly_baseline(CITY, SAMPLE_TRAFFIC, 9) is None
+
+
+def test_hourly_baseline_needs_enough_samples(store, monkeypatch):
+    monkeypatch.setattr(Config, 'SAMPLES_MIN_COUNT', 3)
+    add(store, SAMPLE_TRAFFIC, 5, hour_start(1, 8) + 600)
+    add(store, SAMPLE_TRAFFIC, 7, hour_start(2, 8) + 600)
+    store.flush()
+
+    assert hourly_baseline(CITY, SAMPLE_TRAFFIC, 8) is None
+
+
+def test_record_skips_failed_responses(store):
+    samples.record_weather(CITY, {'status': 500})
+    samples.record_traffic(CITY, {'status': 200, 'level': 3})
+    samples.record_weather(CITY, {'status': 200, 'temp': 21})
+    assert store.flush() == 2
+
+
+def test_save_samples_without_insert_ignore(db, monkeypatch):
+    # База без INSERT ... ON CONFLICT: дубли отсекаются построчно
+    monkeypatch.setattr(db, 'insert_ignore', lambda model: None)
+    db.save_samples([(CITY, SAMPLE_TEMP, 100, 10.0), (CITY, SAMPLE_TEMP, 200, 12.0)])
+    db.save_samples([(CITY, SAMPLE_TEMP, 200, 99.0), (CITY, SAMPLE_TEMP, 300, 14.0)])
+
+    assert db.get_sample_stats(CITY, SAMPLE_TEMP, [(0, 1000)]) == (pytest.approx(12.0), 3)
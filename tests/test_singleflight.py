@@ -0,0 +1,122 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from services.singleflight import FlightTimeoutError, SingleFlight
+
+
+def start_leader(flight, key, fn):
+    """Запускает первый вызов в отдельном потоке и дожидается, пока он начнёт выполняться"""
+    started = threading.Event()
+
+    def leader():
+        started.set()
+        return fn()
+
+    pool = ThreadPoolExecutor(max_workers=1)
+    future = pool.submit(flight.do, key, leader)
+    assert started.wait(5)
+    pool.shutdown(wait=False)
+    return future
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return 'result'
+
+    leader = start_leader(flight, 'key', fetch)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        followers = [pool.submit(flight.do, 'key', lambda: pytest.fail('second execution')) for _ in range(4)]
+        while flight.stats()['shared'] < 4:
+            threading.Event().wait(0.01)
+        release.set()
+        results = [future.result(5) for future in followers]
+
+    assert leader.result(5) == 'result'
+    assert results == ['result'] * 4
+    assert calls == [1]
+    assert flight.stats() == {'executed': 1, 'shared': 4, 'timeouts': 0}
+
+
+def test_error_is_shared():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def fetch():
+        release.wait(5)
+        raise ValueError('upstream failed')
+
+    leader = start_leader(flight, 'key', fetch)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        follower = pool.submit(flight.do, 'key', lambda: 'unused')
+        while flight.stats()['shared'] < 1:
+            threading.Event().wait(0.01)
+        release.set()
+        with pytest.raises(ValueError):
+            follower.result(5)
+    with pytest.raises(ValueError):
+        leader.result(5)
+
+
+def test_sequential_calls_execute_again():
+    flight = SingleFlight()
+    assert flight.do('key', lambda: 1) == 1
+    assert flight.do('key', lambda: 2) == 2
+    assert flight.stats()['executed'] == 2
+
+
+def test_follower_times_out():
+    flight = SingleFlight(timeout=0.05)
+    release = threading.Event()
+
+    leader = start_leader(flight, 'key', lambda: release.wait(5) and 'result')
+    with pytest.raises(FlightTimeoutError):
+        flight.do('key', lambda: 'unused')
+    release.set()
+
+    # Таймаут ожидающего не прерывает первый вызов
+    assert leader.result(5) == 'result'
+    assert flight.stats()['timeouts'] == 1
+
+
+def test_async_calls_share_one_execution():
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'result'
+
+    async def scenario():
+        return await asyncio.gather(*(flight.do_async('key', fetch) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == ['result'] * 5
+    assert calls == [1]
+    assert flight.stats() == {'executed': 1, 'shared': 4, 'timeouts': 0}
+
+
+def test_async_follower_times_out_without_cancelling_leader():
+    flight = SingleFlight(timeout=0.01)
+
+    async def fetch():
+        await asyncio.sleep(0.1)
+        return 'result'
+
+    async def scenario():
+        leader = asyncio.ensure_future(flight.do_async('key', fetch))
+        await asyncio.sleep(0)
+        with pytest.raises(FlightTimeoutError):
+            await flight.do_async('key', fetch)
+        return await leader
+
+    assert asyncio.run(scenario()) == 'result'
+    assert flight.stats()['timeouts'] == 1
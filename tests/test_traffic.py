@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+import requests
+
+from services import traffic
+from services.traffic import parse_table_response, traffic_cache
+
+CITY = 'Москва'
+
+
+def table(durations, distances, code='Ok'):
+    return {'code': code, 'durations': durations, 'distances': distances}
+
+
+class StubOSRM:
+    """Подменяет HTTP-клиент: отвечает заранее заданными результатами и считает запросы"""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = 0
+
+    def _next(self):
+        self.calls += 1
+        result = self.results.pop(0)
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+    def get(self, service, url, params=None, endpoint=None):
+        status, data = self._next()
+        response = requests.Response()
+        response.status_code = status
+        response._content = requests.compat.json.dumps(data).encode()
+        return response
+
+    async def async_get_json(self, service, url, params=None, endpoint=None):
+        return self._next()
+
+
+@pytest.fixture
+def osrm(db, monkeypatch):
+    traffic_cache.clear()
+    yield lambda *results: _install(monkeypatch, StubOSRM(*results))
+    traffic_cache.clear()
+
+
+def _install(monkeypatch, stub):
+    monkeypatch.setattr(traffic.http, 'get', stub.get)
+    monkeypatch.setattr(traffic.http, 'async_get_json', stub.async_get_json)
+    return stub
+
+
+def test_parse_table_free_roads():
+    # 10 км за 10 минут: скорость 60 км/ч, задержки нет
+    data = table([[0, 600], [600, 0]], [[0, 10000], [10000, 0]])
+    assert parse_table_response(data) == {
+        'status': 200, 'level': 1, 'description': '🟢 Свободные дороги', 'routes': 2,
+    }
+
+
+def test_parse_table_uses_median_and_skips_missing_routes():
+    # Пары: вдвое медленнее, вдвое медленнее, без маршрута, очень медленно
+    data = table(
+        [[0, 1200, None], [1200, 0, 6000], [0, 0, 0]],
+        [[0, 10000, 10000], [10000, 0, 10000], [0, 0, 0]],
+    )
+    result = parse_table_response(data)
+    assert result['routes'] == 3
+    assert result['level'] == 6
+
+
+def test_parse_table_without_routes():
+    assert parse_table_response(table([[0]], [[0]])) is None
+    assert parse_table_response(table([[0, 600]], [[0, 10000]], code='NoRoute')) is None
+    assert parse_table_response({}) is None
+
+
+def test_real_data_is_cached(osrm):
+    stub = osrm((200, table([[0, 600], [600, 0]], [[0, 10000], [10000, 0]])))
+
+    first = traffic.get_traffic_level(CITY)
+    second = traffic.get_traffic_level(CITY)
+
+    assert first == second
+    assert 'estimated' not in first
+    assert stub.calls == 1
+
+
+@pytest.mark.parametrize('failure', [
+    (500, {}),
+    (200, {'code': 'NoRoute'}),
+    requests.ConnectionError('connection refused'),
+])
+def test_fallback_is_not_cached(osrm, failure):
+    stub = osrm(failure, (200, table([[0, 600], [600, 0]], [[0, 10000], [10000, 0]])))
+
+    fallback = traffic.get_traffic_level(CITY)
+    assert fallback['estimated'] is True
+
+    # Оценка по времени суток не попала в кэш: следующий запрос снова идёт в OSRM
+    result = traffic.get_traffic_level(CITY)
+    assert 'estimated' not in result
+    assert stub.calls == 2
+
+
+def test_async_fallback_is_not_cached(osrm):
+    stub = osrm((502, None), (200, table([[0, 600], [600, 0]], [[0, 10000], [10000, 0]])))
+
+    fallback = asyncio.run(traffic.async_get_traffic_level(CITY))
+    result = asyncio.run(traffic.async_get_traffic_level(CITY))
+
+    assert fallback['estimated'] is True
+    assert 'estimated' not in result
+    assert stub.calls == 2
@@ -0,0 +1,90 @@
+import http.client
+import json
+import threading
+
+import pytest
+
+from webhook import SECRET_HEADER, WebhookServer
+
+SECRET = 'secret'
+UPDATE = json.dumps({'update_id': 1, 'message': {
+    'message_id': 1, 'date': 0, 'chat': {'id': 42, 'type': 'private'}, 'text': '/start',
+}}).encode()
+
+
+@pytest.fixture
+def webhook():
+    """Сервер на свободном порту; accept задаёт ответ submit"""
+    received = []
+    state = {'accept': True}
+
+    def submit(update):
+        if not state['accept']:
+            return False
+        received.append(update)
+        return True
+
+    server = WebhookServer(submit, '127.0.0.1', 0, '/hook', SECRET, stats=lambda: {'queued': len(received)})
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.received = received
+    server.state = state
+    yield server
+    server.shutdown()
+    thread.join(timeout=5)
+
+
+def request(server, method='POST', path='/hook', body=UPDATE, headers=None):
+    connection = http.client.HTTPConnection(*server.httpd.server_address[:2], timeout=5)
+    try:
+        connection.request(method, path, body=body, headers=headers if headers is not None else {
+            SECRET_HEADER: SECRET, 'Content-Type': 'application/json',
+        })
+        response = connection.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        connection.close()
+
+
+def test_accepted_update(webhook):
+    status, _, _ = request(webhook)
+    assert status == 200
+    assert [update.update_id for update in webhook.received] == [1]
+    assert webhook.received[0].message.chat.id == 42
+
+
+@pytest.mark.parametrize('headers', [{}, {SECRET_HEADER: 'wrong'}])
+def test_bad_secret(webhook, headers):
+    status, _, _ = request(webhook, headers=headers)
+    assert status == 403
+    assert webhook.received == []
+
+
+def test_full_queue(webhook):
+    webhook.state['accept'] = False
+    status, headers, _ = request(webhook)
+    assert status == 503
+    assert headers['Retry-After'] == '1'
+    assert webhook.health()['rejected'] == 1
+
+
+@pytest.mark.parametrize('body, length', [(b'not json', None), (UPDATE, 'abc')])
+def test_malformed_request(webhook, body, length):
+    headers = {SECRET_HEADER: SECRET}
+    if length is not None:
+        headers['Content-Length'] = length
+    status, _, _ = request(webhook, body=body, headers=headers)
+    assert status == 400
+    assert webhook.received == []
+
+
+def test_unknown_path(webhook):
+    status, _, _ = request(webhook, path='/other')
+    assert status == 404
+
+
+def test_healthz(webhook):
+    request(webhook)
+    status, _, body = request(webhook, method='GET', path='/healthz', body=None)
+    assert status == 200
+    assert json.loads(body) == {'status': 'ok', 'rejected': 0, 'queue': {'queued': 1}}
@@ -0,0 +1,113 @@
+import hmac
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+import telebot
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer:
+    """
+    HTTP-сервер для приёма обновлений Telegram через webhook.
+
+    Обработчик запроса проверяет секрет, разбирает обновление и передаёт его в submit
+    (например, в диспетчер команд) до ответа Telegram. Если submit не принял обновление,
+    сервер отвечает 503, и Telegram повторит доставку позже: принятое с ответом 200
+    обновление уже стоит в очереди и не теряется.
+    GET /healthz возвращает состояние сервера и очереди.
+    """
+
+    def __init__(
+        self,
+        submit: Callable[[telebot.types.Update], bool],
+        host: str,
+        port: int,
+        path: str,
+        secret: str,
+        stats: Optional[Callable[[], dict]] = None,
+    ):
+        self.submit = submit
+        self.path = path
+        self.secret = secret
+        self.stats = stats
+        self.rejected = 0
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != server.path:
+                    self._reply(404)
+                    return
+                token = self.headers.get(SECRET_HEADER, '')
+                if not server.secret or not hmac.compare_digest(token, server.secret):
+                    self._reply(403)
+                    return
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    logger.warning("Bad webhook Content-Length: %r", self.headers.get('Content-Length'))
+                    self._reply(400)
+                    return
+                body = self.rfile.read(length)
+                try:
+                    update = telebot.types.Update.de_json(body.decode('utf-8'))
+                except (ValueError, KeyError, TypeError) as e:
+                    logger.warning("Malformed webhook update: %s", e)
+                    self._reply(400)
+                    return
+                if not server.submit(update):
+                    server.rejected += 1
+                    self._reply(503, headers={'Retry-After': '1'})
+                    return
+                self._reply(200)
+
+            def do_GET(self):
+                if self.path != '/healthz':
+                    self._reply(404)
+                    return
+                self._reply(200, server.health(), content_type='application/json')
+
+            def _reply(self, status, payload=None, content_type='text/plain', headers=None):
+                body = json.dumps(payload).encode() if payload is not None else b''
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug("%s - %s", self.address_string(), format % args)
+
+        return Handler
+
+    def health(self) -> dict:
+        """Состояние сервера для /healthz"""
+        health = {'status': 'ok', 'rejected': self.rejected}
+        if self.stats is not None:
+            health['queue'] = self.stats()
+        return health
+
+    def serve_forever(self) -> None:
+        """Принимает запросы до остановки процесса"""
+        host, port = self.httpd.server_address[:2]
+        logger.info("Webhook server listening on %s:%s%s", host, port, self.path)
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.httpd.server_close()
+
+    def shutdown(self) -> None:
+        self.httpd.shutdown()
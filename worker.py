@@ -0,0 +1,33 @@
+"""
+Отдельный процесс рассылки.
+
+Забирает шарды незавершённых прогонов из очереди доставки и отправляет их.
+Запускается рядом с bot.py на любом числе машин с общей базой: шарды делятся
+между процессами через аренды, а отчёт создаёт лидер планировщика.
+"""
+import logging
+import time
+
+from bot import resume_daily_reports
+from config import Config
+from database import log_exception, run_migrations
+from metrics import start_metrics_server
+from services.cluster import NODE_ID
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    run_migrations()
+    start_metrics_server(Config.METRICS_HOST, Config.METRICS_PORT)
+    logger.info("Broadcast worker %s started", NODE_ID)
+    while True:
+        try:
+            resume_daily_reports()
+        except Exception as e:
+            log_exception(e, node=NODE_ID)
+        time.sleep(Config.WORKER_POLL_INTERVAL)
+
+
+if __name__ == '__main__':
+    main()